@@ -1,23 +1,34 @@
-from flask import Flask, request
+from flask import Flask, request, Response, stream_with_context
 from flask_restx import Api, Resource, fields
 import requests
-from bs4 import BeautifulSoup
 import re
-from urllib.parse import urlparse
-from copy import deepcopy
 from flask_cors import CORS
 import logging
-import jwt
-import datetime
 import os
-from functools import wraps
+from functools import lru_cache, wraps, partial
+from urllib.parse import urlparse
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
-import threading
 import time
+import json
+import hashlib
+import math
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from auth_tokens import create_token_verifier
+from recipe_store import create_recipe_store
+from scrape_cache import create_scrape_cache, normalize_url
+from fetcher import create_page_store, fetch_page
+from domain_strategies import get_domain_strategies
+from units import calculate_servings, convert_units, get_conversion_engine, parse_serving_size
+from ingredient_table import IngredientTable
+from parse_pool import create_parse_pool, ParsePoolBusy, ParseTimeout
+from metrics import collectors, deferred, render_metrics, replay, stage_seconds
+from scrape_jobs import create_scrape_job_queue, ScrapeQueueFull
+from recipe_corpus import corpus_record, create_recipe_corpus, warm_start
 
-app = Flask(__name__)
-CORS(app, origins=["*"])
+load_dotenv()
 
 authorizations = {
     'basicAuth': {
@@ -25,16 +36,16 @@ authorizations = {
     }
 }
 
-api = Api(app, authorizations=authorizations)
+# The resources below are registered on the Api and bound to a Flask app by create_app() at the end of this file.
+# RECIPE_SCRAPER_SWAGGER=0 turns off the Swagger UI in production (the spec is only built when /swagger.json is asked for)
+api = Api(authorizations=authorizations, doc='/' if os.getenv('RECIPE_SCRAPER_SWAGGER', '1') != '0' else False)
 
 # Define headers to simulate website access via browsers
 headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36'
         }
 
-load_dotenv()
-
-app.config['SECRET_KEY'] = os.getenv('RECIPE_SCRAPER_SECRET_KEY', 'wheeee')  # for testing/dev
+secret_key = os.getenv('RECIPE_SCRAPER_SECRET_KEY', 'wheeee')  # for testing/dev
 
 # ## LOGGING ######################################
 # # Basic logging configuration
@@ -57,12 +68,11 @@ login_model = api.model('Login', {
     'password': fields.String(required=True, description='The password')
 })
 
+# Signs new tokens and verifies (and remembers) the ones clients send, see auth_tokens.py for key rotation
+token_verifier = create_token_verifier(secret_key)
+
 def generate_token(username):
-    payload = {
-        'username': username,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)  # Token expiration time
-    }
-    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+    return token_verifier.issue(username)  # expires in 24 hours
 
 def verify_credentials(username, password):
     # Replace with actual authentication mechanism (don't store passwords in plain text)
@@ -72,40 +82,44 @@ def verify_credentials(username, password):
         return True
     return False
 
+# Returns (current_user, None) for a valid token ("Bearer <token>" or just the token), otherwise (None, error response)
+def authenticate(token):
+    # logging.info(f"Received Authorization header: {token}")
+    payload, error = token_verifier.verify(token)
+    if error:
+        return None, ({'message': error}, 401)
+
+    return payload['username'], None
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization', None)
-        # logging.info(f"Received Authorization header: {token}")
-        if not token:
-            return {'message': 'Missing authorization token'}, 401
-
-        try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = data['username']
-        except jwt.DecodeError:
-            return {'message': 'Invalid token'}, 401
+        current_user, error = authenticate(request.headers.get('Authorization', None))
+        if error:
+            return error
 
         return f(current_user, *args, **kwargs)
 
     return decorated
 
+def login(data):
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return {'message': 'Missing username or password'}, 401
+
+    if not verify_credentials(username, password):
+        return {'message': 'Invalid credentials'}, 401
+
+    token = generate_token(username)
+    return {'token': token}
+
 @api.route('/login')
 class UserLogin(Resource):
     @api.expect(login_model)  # Optional for Swagger UI clarity
     def post(self):
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-
-        if not username or not password:
-            return {'message': 'Missing username or password'}, 401
-
-        if not verify_credentials(username, password):
-            return {'message': 'Invalid credentials'}, 401
-
-        token = generate_token(username)
-        return {'token': token}
+        return login(request.get_json())
 
 # Define models for the input payloads
 recipe_url_model = api.model('RecipeURL', {
@@ -113,425 +127,410 @@ recipe_url_model = api.model('RecipeURL', {
 })
 
 unit_type_model = api.model('UnitType', {
+    'recipe_id': fields.String(required=True, description='Recipe ID returned by /scrape-recipe-steps'),
     'unit_type': fields.String(required=True, description='Either "si" or "metric" ')
 })
 
+recipe_urls_model = api.model('RecipeURLs', {
+    'recipe_urls': fields.List(fields.String, required=True, description='URLs of the recipes')
+})
+
 serving_size_model = api.model('ServingSize', {
+    'recipe_id': fields.String(required=True, description='Recipe ID returned by /scrape-recipe-steps'),
     'serving_size': fields.String(required=True, description='Numeric value')
 })
 
-# Define some cooking action words to help locate the recipe in some websites where the recipe isn't labelled
-cooking_action_words = [
-    'heat', 'preheat', 'saute', 'stir', 'simmer', 'remove', 'serve', 'garnish', 
-    'pour', 'mix', 'bake', 'grill', 'boil', 'chop', 'slice', 'dice', 'cool', 
-    'prepare', 'melt', 'transfer', 'refrigerate', 'reheat', 'arrange', 'whisk', 'blend', 'fry',
-    'marinate', 'combine', 'drizzle', 'sprinkle', 'toss', 'fold', 'cover', 'let stand',
-    'mix together', 'beat', 'brush', 'shape', 'spray', 'roll', 'cut', 'spread', 'dip',
-    'top with', 'squeeze', 'shake', 'divide', 'whip', 'knead', 'grate', 'baste', 'pound', 'set', 'mash', 'stir',
-    'dry', 'wait', 'cool', 'season', 'start', 'cook'
-]
-
-common_units = [
-    "grams", "gram", "milliliters", "milliliter", "centimeter", "centimeter", "kilograms", "kilogram", 
-    "cups", "cup", "tablespoons", "tablespoon", "teaspoons", "teaspoon", "tsp", "tbsp",
-    "pounds", "pound", "ounces", "ounce", "grams", "gram", "tsp .", "tb .", "lb",
-    "cloves", "clove", "can", "tin", "jar", "g", "kg", "litre", "litres", "millilitres", "millilitre"
-]
-
-to_si_conversion = {
-'cups': {'ml': 236.588, 'g': 125.39},
-'cup': {'ml': 236.588, 'g': 125.39},
-'lb': {'g': 453.592},
-'oz': {'g': 28.3495}
-} 
-
-to_metric_conversion = {
-'ml': {'cups': 0.00422675, 'cup': 0.00422675},
-'l': {'cups': 4.22675, 'cup': 4.22675},
-'g': {'oz': 0.03527396, 'cup': 0.007975, 'cups': 0.007975, 'lb': 1}
-}
+scrape_job_model = api.model('ScrapeJob', {
+    'recipe_url': fields.String(required=True, description='URL of the recipe'),
+    'callback_url': fields.String(required=False, description='Optional, the finished job is POSTed to this URL')
+})
 
-liquids = ["water", "oil", "milk", "honey"]
-solids = ["flour", "pepper", "salt"]
-
-# Global variables
-global ingredients
-global servings 
-global ingredients_pre_conversion
-global converted
-global requested_serving_size
-global original_unit_type
-global unit_type
-
-ingredients = None
-servings = None
-ingredients_pre_conversion = None
-converted = False
-requested_serving_size = None
-original_unit_type = None
-unit_type = None
-
-# Function to extract the recipe steps when there's some labelling (id/class) on the html elements that indicates its the recipe
-def extract_recipe_steps_labelled(soup):
-    logging.info("DEBUG: extract_recipe_steps_labelled")
-    recipe_steps = []
-    step_positions = []
-    extracted_steps = set()  
-
-    recipe_steps_html = soup.find_all('li', id=re.compile(r'.*(instruction|direction|step).*', re.I))
-    recipe_steps_html += soup.find_all(['p', 'li'], {'class': re.compile(r'instruction|direction|step', re.I)} )
-    recipe_steps_html = [step.get_text(strip=True) for step in recipe_steps_html]
-    has_cooking_related_words = any(any(word in step.lower() for word in cooking_action_words) for step in recipe_steps_html)
-    if has_cooking_related_words:
-        for element in recipe_steps_html:
-            text = element.strip()
-            if text.strip() not in extracted_steps:
-                recipe_steps.append(text.strip())
-                step_positions.append(recipe_steps_html.index(element))
-                extracted_steps.add(text.strip())
-    return recipe_steps
-
-# Function to extract the recipe steps when there is no labelling (id/class) on the html elements at all to indicate that its the recipe
-def extract_recipe_steps_manual(soup):
-    recipe_steps = []
-
-    # DOM traversal starting from any heading containing directions, instructions, method, or how to make
-    if not recipe_steps:
-        logging.info("DEBUG: extract_recipe_steps_manual")
-        headers = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-        target_headers = [header for header in headers if any(keyword.lower() in header.text.lower() for keyword in ['directions', 'instructions', 'method', 'how to make'])]
-
-        for header in target_headers:
-            current_element = header.parent
-            while current_element:
-                ol_element = current_element.find('ol')
-                if ol_element:
-                    for li in ol_element.find_all('li'):
-                        step_text = li.get_text(strip=True)
-                        if step_text not in recipe_steps:
-                            recipe_steps.append(step_text)
-                    break
-                current_element = current_element.find_next()
-    
-    return recipe_steps
-
-def extract_recipe_steps(soup):
-    # Try to find the recipe by the class/id labels
-    recipe_steps = extract_recipe_steps_labelled(soup)
-
-    # If there's no labelling found
-    if not recipe_steps:
-        recipe_steps = extract_recipe_steps_manual(soup)
-
-    return recipe_steps
-
-def extract_ingredients(soup):
-    ingredients = []
-
-    # Found id or class labels for the ingredient li
-    ingredients_html = [ingredient.text.strip() + " " for ingredient in soup.find_all('li', id=re.compile(r'.*(ingredient).*', re.I))]
-    ingredients_html += [" ".join(ingredient.text.split()) for ingredient in soup.find_all(['p', 'li'], {'class': re.compile(r'ingredient', re.I)})]
-    if ingredients_html:
-        logging.info("DEBUG: method 1 ingredients")
-        return sorted(set(ingredients_html))
-
-    # Found ingredients list (ol/ul) but li is not labelled
-    elif not ingredients_html:
-        for element in soup.find_all(['ol', 'ul', 'div'], {'class': re.compile(r'ingredient', re.I)}):
-            logging.info("DEBUG: method 2 ingredients")
-            for item in element.find_all('li'):  # Find all list items within the <ol> or <ul>
-                ingredient_text = item.get_text(strip=True)
-                if ingredient_text not in ingredients:
-                    ingredients.append(ingredient_text)  # Append each list item to the ingredients list
-
-    # Manually search for what looks like ingredients (current limitation is if the ingredients list totally got no labelling anywhere in the whole page then cannot)
-    if not ingredients:
-        logging.info("DEBUG: method 3 ingredients")
-        headers = soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-        target_headers = [header for header in headers if any(keyword.lower() in header.text.lower() for keyword in ['ingredients'])]
-
-        for header in target_headers:
-            current_element = header.parent    
-            while current_element:
-                ol_element = current_element.find('ul')
-                if ol_element:
-                    for li in ol_element.find_all('li'):
-                        ingredient_text = li.get_text(strip=True)
-                        if ingredient_text not in ingredients:
-                            ingredients.append(ingredient_text)
-                    break
-
-                current_element = current_element.find_next()
+compute_model = api.model('ComputeIngredients', {
+    'recipe_id': fields.String(required=False, description='Recipe ID returned by /scrape-recipe-steps, instead of ingredients'),
+    'ingredients': fields.List(fields.Raw, required=False, description='Ingredient lines or [quantity, unit, name] rows'),
+    'servings': fields.String(required=False, description='Servings of the recipe as written (defaults to the scraped servings for a recipe ID)'),
+    'serving_size': fields.String(required=False, description='Numeric value, the servings wanted'),
+    'unit_type': fields.String(required=False, description='Either "si" or "metric", defaults to the recipe\'s own units')
+})
 
-    return ingredients
+# Scraped recipes are kept per recipe ID so that users (and workers) never share each other's state
+recipe_store = create_recipe_store()
 
-def extract_recipe_name(soup, recipe_url):
-    # Parse the URL to extract the recipe name
-    recipe_url = recipe_url[:-1] if recipe_url.endswith('/') else recipe_url
-    parsed_url = urlparse(recipe_url)
-    path_components = parsed_url.path.split('/')
-    recipe_name_from_url = path_components[-1].replace('-', ' ').title()
-    recipe_name_from_url = recipe_name_from_url.split('.')
-    recipe_name_from_url = recipe_name_from_url[0]
-
-    # labelled with ID or class
-    title_html = [title.text.strip() + " " for title in soup.find_all(['h1', 'h2'], {'id': re.compile(r'.*(title|heading).*', re.I)})]
-    title_html += [title.text.strip() + " " for title in soup.find_all(['h1', 'h2'], {'class': re.compile(r'.*(title|heading).*', re.I)})]
-    recipe_name_list = [item for item in title_html if item.strip().istitle()]
-
-    # compare which title/heading is most similar to the url cause the url usually has the recipe name in it
-    for item in recipe_name_list:
-        words1 = set(item.lower().split())
-        words2 = set(recipe_name_from_url.lower().split())
-        intersection = words1.intersection(words2)
-        similarity = len(intersection) / max(len(words1), len(words2))
-        if similarity >= 0.3:
-            return item.strip()
-    
-    return recipe_name_from_url.strip()
-
-# FUNCTION TO GET THE SERVING SIZE OF THE RECIPE ON THE WEBSITE
-def get_serving_size(soup):
-    servings = None
-    elements = soup.find_all(['p', 'span', 'em', 'div'])
-    target_elements = [element for element in elements if any(keyword.lower() in element.text.lower() for keyword in ['serves', 'servings', 'yield', 'serving'])]
-
-    for element in target_elements:
-        numbers = re.findall(r'\d+', element.get_text())
-        if numbers:
-            text = element.get_text()
-            # check if the serving number is inside the same element as the word servings or yield etc
-            match = re.search(r'(?:Yields:|Serves:|Servings:|Yield:|Serving:)\s*(.+)', text, re.IGNORECASE)
-            if match:
-                text = match.group(1)
-                text = text.split(',') # split it just in case it comes together with the prep time etc
-                # if after splitting its still very long, then split it again by spaces cause it probably still contains some other irrelevant information
-                if len(text[0]) > 12:
-                    text[0] = text[0].split(' ', 1)
-                    return text[0][0]
-                else:
-                    return text[0]
-            # if not, check whether it is at the same level in the DOM structure (for both this and next method, extract a digit once its found)
-            else:
-                current_element = element.find_next()
-                while current_element:
-                    numbers = re.findall(r'\d+', current_element.get_text())
-                    if numbers and len(current_element.get_text()) < 10:
-                        servings = int(list(filter(str.isdigit, current_element.get_text()))[0])
-                        break
-                    current_element = current_element.find_next()
-                if servings is not None:
-                    break
-                # if also not, then check the next elements within the same parent
-                else:
-                    current_element = element.parent
-                    while current_element:
-                        numbers = re.findall(r'\d+', current_element.get_text())
-                        if numbers and len(current_element.get_text()) < 10:
-                            servings = int(list(filter(str.isdigit, current_element.get_text()))[0])
-                            break
-                        current_element = current_element.find_next()
-                    if servings is not None:
-                        break
-    return servings
-
-def postprocess_list(lst):
-    if lst:
-        return [re.sub(r'^\s*▢\s*', '', item) for item in lst]
-    else:
-        return None
+# Scrape results of recently requested recipe URLs, so popular recipes don't get fetched and parsed every time
+scrape_cache = create_scrape_cache()
 
-def postprocess_text(txt):
-    return txt.strip()
-
-def standardize_units(ingredients):
-    unit_mapping = {'g': 'g', 'gram': 'grams', 'g': 'grams', 'lb': 'lb', 'pound': 'lb', 'pounds': 'lb', 'kg': 'kg', 'kilogram': 'kg', 
-                    'kilograms': 'kg', 'oz': 'oz', 'ounce': 'oz', 'ounces': 'oz', 'mg': 'mg', 'milligram': 'mg', 'milligrams': 'mg', 
-                    'l': 'l', 'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l', 'ml': 'ml', 'milliliter': 'ml', 'milliliters': 'ml', 'tsp': 'tsp', 
-                    'teaspoon': 'tsp', 'teaspoons': 'tsp', 'tbsp': 'tbsp', 'tablespoon': 'tbsp', 'tablespoons': 'tbsp'}
-    
-    def clean_unit(unit):
-        # Remove any trailing periods and extra spaces
-        if unit:
-            unit = re.sub(r'\s*\.\s*', '', unit)
-            unit = unit.strip().lower()
-        return unit
-    
-    for ingredient in ingredients:
-        unit = clean_unit(ingredient[1])
-        if ingredient and unit in unit_mapping:
-            standardized_unit = unit_mapping[unit]
-            ingredient[1] = standardized_unit
-        else:
-            pass
+# Raw HTML of scraped pages with their ETag/Last-Modified, so expired recipes can be refreshed with conditional requests
+page_store = create_page_store()
 
-    return ingredients
+# Every successful extraction is appended to RECIPE_SCRAPER_CORPUS_DIR for offline analysis (see recipe_corpus.py), and
+# the latest ones warm up the scrape cache and the per-website strategies in the background when the app starts
+recipe_corpus = create_recipe_corpus()
 
-# FUNCTIONS TO POSTPROCESS THE INGREDIENTS LIST
-def extract_units(ingredients):
-    parsed_ingredients = []
-    for ingredient in ingredients:
-        match = re.match(r'^((?:\d+\s*)?(?:\d*½|\d*¼|\d*[¾¾]|\d*⅛|\d*⅔|\d+\s*[/–-]|to\s*\d+)?[\s\d/–-]*)[\s]?([a-zA-Z]+\b)?[\s]?(.*)$', ingredient)
-        #match = re.match(r'^((?:\d+\s*)?(?:\d*½|\d*¼|\d*[¾¾]|\d*⅛|\d*⅔|\d+\s*[/–-]|to\s*\d+)?[\s\d/–-]*)?[\s]*(?:([a-zA-Z]+)\b)?[\s]*(.*)$', ingredient)
-        quantity, unit, name = match.groups()
-
-        if '-' in str(quantity):
-            quantity = str(quantity).replace(" ", "")
-        elif 'to' in str(quantity):
-            quantity = str(quantity).replace(" ", "")
-            quantity = quantity.split('to')
-            quantity = '-'.join(quantity)
-        else:
-            quantity = quantity.strip() if quantity else None
-            quantity = quantity.replace("½", "1/2").replace("¼", "1/4").replace("¾", "3/4").replace("⅛", "1/8").replace("⅔", "2/3") if quantity else None
-        
-        if unit == "garlic":
-            name = unit
-            unit = None
-        else:
-            if unit and unit !="garlic":
-                modified_unit = re.split(r'^({})'.format('|'.join(common_units)), unit)
-                unit = modified_unit[1] if len(modified_unit) > 1 else modified_unit[0]
-                name = modified_unit[2] + " " + name if len(modified_unit) > 1 else name
+# Batch scrapes fetch up to RECIPE_SCRAPER_BATCH_CONCURRENCY pages at a time (the fetch client also limits each host),
+# and extract them on a separate pool as soon as each page arrives
+max_batch_size = int(os.getenv('RECIPE_SCRAPER_MAX_BATCH_SIZE', 200))
+fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv('RECIPE_SCRAPER_BATCH_CONCURRENCY', 16)), thread_name_prefix='fetch')
+parse_executor = ThreadPoolExecutor(max_workers=int(os.getenv('RECIPE_SCRAPER_PARSE_WORKERS', os.cpu_count() or 1)), thread_name_prefix='parse')
+
+# With RECIPE_SCRAPER_PARSE_MODE=process pages are extracted in worker processes instead of the request thread
+parse_pool = create_parse_pool()
+
+recipe_not_found_error = {'error': 'Recipe not found or expired. Please scrape the recipe again.'}
+serving_size_error = {'error': 'serving_size must be a number above 0'}
+extraction_failed_error = {"error": "Oops! We encountered a hiccup while trying to extract the recipe from this website. It seems its structure is quite unique and our system is having trouble with it. We're continuously working on improvements though! Thank you for your patience and support. ^^"}
+
+def extract_page_recipe(page):
+    # the page hasn't changed since we last extracted it
+    if page.not_modified and page.recipe is not None:
+        return page.recipe
+
+    # the metrics of the extraction are held back until it's done, the corpus keeps which methods worked and the timings
+    events = []
+    try:
+        with deferred() as events, stage_seconds.time('extract'):
+            if parse_pool:
+                recipe = parse_pool.extract(page.content, page.url)
             else:
-                logging.info("DEBUG: Unit is NoneType:", name)
-        
-        if unit and unit.lower() not in common_units:
-            name = unit + " " + name
-            unit = None
-        
-        parsed_ingredients.append([quantity, unit, name.strip() if name else None])
-
-    standardized_ingredients = standardize_units(parsed_ingredients)
-    ingredients_pre_conversion = deepcopy(standardized_ingredients)
-    
-    if any(i[1] in to_si_conversion for i in ingredients_pre_conversion):
-        original_unit_type = "metric"
-    if any(i[1] in to_metric_conversion for i in ingredients_pre_conversion):
-        original_unit_type = "si"
-
-    return standardized_ingredients, original_unit_type, ingredients_pre_conversion
-
-def calculate_servings(ingredients, servings, requested_serving_size):
-    for ingredient in ingredients:
-        quantity = ingredient[0]
-        if not quantity:
-            continue
-
-        if '-' in str(quantity):
-            quantity = str(quantity).replace(" ", "")
-            quantity = quantity.split('-')
-        elif 'to' in str(quantity):
-            quantity = str(quantity).replace(" ", "")
-            quantity = quantity.split('to')
-
-        def convert_fraction(q):
-            q = str(q).replace("1/2", "0.5").replace("1/4", "0.25").replace("3/4", "0.75").replace("1/8", "0.125").replace("2/3", "0.667")
-            return q
-
-        def adjust_quantity(q):
-            q = sum(float(num_str) for num_str in q.split(" "))
-            base_quantity = q / float(servings)
-            temp_quantity = round((base_quantity * requested_serving_size), 3)
-            temp_quantity = str(temp_quantity).replace("0.5", "1/2").replace("0.25", "1/4").replace("0.75", "3/4").replace("0.125", "1/8").replace("0.66", "2/3")
-            temp_quantity = temp_quantity.replace(".5", " 1/2").replace(".25", " 1/4").replace(".75", " 3/4").replace(".125", " 1/8").replace(".66", " 2/3")
-            return temp_quantity[:-2] if temp_quantity.endswith(".0") else temp_quantity
-
-        if isinstance(quantity, list):
-            new_quantity = [adjust_quantity(convert_fraction(q)) for q in quantity]
-            ingredient[0] = '-'.join(new_quantity)
+                # the scraping stack (bs4, soupsieve, lxml) is imported by the first scrape instead of when the app starts
+                from scraper import extract_recipe
+                recipe = extract_recipe(page.content, page.url)
+    finally:
+        replay(events)
+    if page_store:
+        page_store.save_recipe(page.url, recipe)
+    if recipe_corpus and is_complete_recipe(recipe):
+        recipe_corpus.append(corpus_record(page.url, recipe, events, page.fetch_seconds))
+    return recipe
+
+# FUNCTION TO FETCH AND EXTRACT EVERYTHING WE NEED FROM A RECIPE URL
+def scrape_recipe(recipe_url):
+    return extract_page_recipe(fetch_page(recipe_url, headers, page_store))
+
+def is_complete_recipe(recipe):
+    return bool(recipe['recipe_name'] and recipe['recipe_steps'] and recipe['ingredients'] and recipe['servings'])
+
+def cache_recipe(recipe_url, recipe, start_time):
+    # only cache recipes we managed to extract, a failure might just be a temporary problem with the website
+    if is_complete_recipe(recipe):
+        scrape_cache.set(recipe_url, recipe, elapsed=time.perf_counter() - start_time)
+
+def recipe_ingredient_table(recipe):
+    if recipe.get('ingredient_table'):
+        return IngredientTable.from_json(recipe['ingredient_table'])
+    # recipes cached before the ingredient table existed only have the formatted rows
+    return IngredientTable.from_rows(recipe['ingredients'])
+
+# Saves the scraped recipe for the follow-up endpoints under a new recipe ID and builds the response for it
+def recipe_response(recipe_url, recipe):
+    if not is_complete_recipe(recipe):
+        return extraction_failed_error
+
+    recipe_id = recipe_store.create({
+        'ingredient_table': recipe_ingredient_table(recipe).to_json(),
+        'servings': recipe['servings'],
+        'original_unit_type': recipe['original_unit_type'],
+        'unit_type': recipe['original_unit_type'],
+        'requested_serving_size': None,
+    })
+    return {'recipe_id': recipe_id, 'recipe_url': recipe_url, 'recipe_name': recipe['recipe_name'], 'recipe_steps': recipe['recipe_steps'], 'ingredients': recipe['ingredients'], 'servings': recipe['servings'], 'original_unit_type': recipe['original_unit_type']}
+
+# FUNCTION TO SCRAPE MANY RECIPES AT ONCE, yields (recipe_url, recipe, error) in the order they finish
+def scrape_recipes_concurrently(recipe_urls):
+    results = queue.Queue()
+
+    for recipe_url in recipe_urls:
+        recipe = scrape_cache.get(recipe_url)
+        if recipe is not None:
+            results.put((recipe_url, recipe, None))
         else:
-            ingredient[0] = adjust_quantity(convert_fraction(quantity))
+            future = fetch_executor.submit(fetch_page, recipe_url, headers, page_store)
+            future.add_done_callback(partial(on_page_fetched, results, recipe_url, time.perf_counter()))
+
+    for _ in recipe_urls:
+        yield results.get()
+
+def on_page_fetched(results, recipe_url, start_time, future):
+    try:
+        page = future.result()
+        parse_future = parse_executor.submit(extract_page_recipe, page)
+        parse_future.add_done_callback(partial(on_recipe_extracted, results, recipe_url, start_time))
+    except Exception as e:
+        results.put((recipe_url, None, 'Failed to fetch recipe data: {}'.format(str(e))))
+
+def on_recipe_extracted(results, recipe_url, start_time, future):
+    try:
+        recipe = future.result()
+        cache_recipe(recipe_url, recipe, start_time)
+        results.put((recipe_url, recipe, None))
+    except Exception as e:
+        logging.exception("Failed to extract recipe from {}".format(recipe_url))
+        results.put((recipe_url, None, 'Failed to extract recipe data: {}'.format(str(e))))
+
+# ============= Request handlers =============
+# The endpoints' logic, shared by the Flask API below and the ASGI app in asgi.py
+scrape_errors = (requests.RequestException, ParsePoolBusy, ParseTimeout)
+
+def scrape_error_response(e):
+    if isinstance(e, ParsePoolBusy):
+        return {'error': str(e)}, 503
+    if isinstance(e, ParseTimeout):
+        return extraction_failed_error, 500
+    return {'error': 'Failed to fetch recipe data: {}'.format(str(e))}, 500
+
+# clean up the servings numbers, "Serves 4-6" -> 4.0
+def parse_servings(servings):
+    match = re.search("\\d+", str(servings)) if servings else None
+    return float(match[0]) if match else None
+
+def get_stored_recipe(recipe_id):
+    recipe = recipe_store.get(recipe_id)
+    # records saved before the ingredient table existed can't be converted, the recipe has to be scraped again
+    if recipe is None or 'ingredient_table' not in recipe:
+        return None
+    return recipe
+
+def convert_recipe_units(data):
+    recipe_id = data.get('recipe_id')
+    recipe = get_stored_recipe(recipe_id)
+    if recipe is None:
+        return recipe_not_found_error, 404
+
+    recipe['unit_type'] = data.get('unit_type')
+
+    # the ingredients are always worked out from the scraped table, with the current serving size
+    ingredient_table = IngredientTable.from_json(recipe['ingredient_table'])
+    converted_ingredients = convert_units(ingredient_table, recipe['unit_type'], recipe['requested_serving_size'], recipe['servings'], recipe['original_unit_type'])
+    recipe_store.save(recipe_id, recipe)
+    return converted_ingredients
+
+def calculate_serving_ingredients(data):
+    recipe_id = data.get('recipe_id')
+    recipe = get_stored_recipe(recipe_id)
+    if recipe is None:
+        return recipe_not_found_error, 404
+
+    requested_serving_size = parse_serving_size(data.get('serving_size'))
+    if requested_serving_size is None:
+        return serving_size_error, 400
+    recipe['requested_serving_size'] = requested_serving_size
+
+    if not recipe['servings']:
+        return None
+
+    servings = parse_servings(recipe['servings'])
+    recipe['servings'] = servings
 
+    ingredient_table = IngredientTable.from_json(recipe['ingredient_table'])
+    if recipe['original_unit_type'] == recipe['unit_type']:
+        ingredients = calculate_servings(ingredient_table, servings, requested_serving_size)
+    else:
+        ingredients = convert_units(ingredient_table, recipe['unit_type'], requested_serving_size, servings, recipe['original_unit_type'])
+    recipe_store.save(recipe_id, recipe)
     return ingredients
 
-def convert_units(ingredients, unit_type, requested_serving_size, servings, original_unit_type, ingredients_pre_conversion):
-    def convert_large_vals(converted_unit, converted_q):
-        # if the cup value is super small, change to teaspoons (1 cup = 48 teaspoons)
-        # if teaspoons is too much, change to tablespoons
-        if converted_unit == "cups" and converted_q < 0.1:
-            converted_unit = "tsp"
-            converted_q *= 48
-
-            if converted_q >= 3:
-                converted_unit = "tbsp"
-                converted_q /= 3 # 1 tablespoon = 3 teaspoons
-
-        # if oz is greater than 32, change to pounds (1lb = 16oz)
-        if converted_unit == "oz" and converted_q >= 32:
-            converted_q /= 16 
-            converted_unit = "lb"
-        return converted_unit, converted_q
-
-    # check if ingredients is populated or not first
-    if not ingredients:
-        return None
-    
-    conversion_dict = to_si_conversion if unit_type == "si" else to_metric_conversion
-    
-    # if they want to convert back to the original unit, must maintain the original units
-    if original_unit_type == unit_type:
-        if requested_serving_size is None or requested_serving_size == servings:
-            logging.info("DEBUG: Conversion method 1")
-            return ingredients_pre_conversion
-        else:
-            logging.info("DEBUG: Conversion method 2")
-            ingredients = calculate_servings(deepcopy(ingredients_pre_conversion), servings, requested_serving_size)
-            return ingredients
-            
-    # only do the conversion if they want a different unit
+# an ingredient line, or a [quantity, unit, name] row like the scraped ones: the quantity a number, text or None, the
+# unit text or None and the name text
+def valid_ingredient(ingredient):
+    if isinstance(ingredient, str):
+        return bool(ingredient.strip())
+    if not isinstance(ingredient, list) or len(ingredient) != 3:
+        return False
+    quantity, unit, name = ingredient
+    if isinstance(quantity, bool) or not (quantity is None or isinstance(quantity, (str, int, float))):
+        return False
+    if isinstance(quantity, float) and not math.isfinite(quantity):
+        return False
+    return (unit is None or isinstance(unit, str)) and isinstance(name, str) and bool(name.strip())
+
+# Scales and converts in one go without saving anything, so it can be called any number of times from anywhere
+def compute_ingredients(data):
+    recipe_id = data.get('recipe_id')
+    if recipe_id:
+        recipe = get_stored_recipe(recipe_id)
+        if recipe is None:
+            return recipe_not_found_error, 404
+        ingredient_table = IngredientTable.from_json(recipe['ingredient_table'])
+        servings = data.get('servings') or recipe['servings']
+        original_unit_type = recipe['original_unit_type']
     else:
-        for ingredient in ingredients:
-            convert_to = None
-            quantity = ingredient[0]
-            if quantity: 
-                # handle cases where the quantity is a range
-                if '-' in str(quantity):
-                    quantity = quantity.replace(" ", "")
-                    quantity = quantity.split('-')
-                elif 'to' in str(quantity):
-                    quantity = quantity.replace(" ", "")
-                    quantity = quantity.split('to')
-                else:
-                    # convert fractions like 3 1/4 to a whole number i.e. 3.25
-                    quantity = str(quantity).replace("1/2", "0.5").replace("1/4", "0.25").replace("3/4", "0.75").replace("1/8", "0.125").replace("2/3", "0.667")
-                    quantity_parts = quantity.split(" ")
-                    quantity = sum(float(num_str) for num_str in quantity_parts)
-                    
-            unit = ingredient[1]
-            name = ingredient[2]
-
-            if quantity and unit and unit in [key for key, value in conversion_dict.items()]:
-                # convert liquids from cups/tsp/tbsp to ml and solids to g
-                if unit in ["cup", "cups", "tsp", "tbsp"]:
-                    if any(liquid in name for liquid in liquids):
-                        convert_to = "ml" 
-                    else:
-                        convert_to = "g"
-                # convert grams of flour to cups of flour and not oz of flour
-                if any(solid in name for solid in solids) and unit in ['g']:
-                    convert_to = "cups"
-                converted_unit = convert_to if convert_to else [key for key, value in conversion_dict[unit].items()][0]
-                
-                # handle cases where the quantity is a range
-                if isinstance(quantity, list):
-                    converted_quantities = []
-                    for q in quantity:
-                        converted_q = float(q) * conversion_dict[unit][converted_unit]
-                        converted_unit, converted_q = convert_large_vals(converted_unit, converted_q)
-                        temp = round(converted_q, 2)
-                        converted_quantities.append(str(temp))
-                    converted_quantity = '-'.join(converted_quantities)
-                    ingredient[0] = converted_quantity
-                # handle normal single number quantities
-                else:
-                    converted_quantity = float(quantity) * conversion_dict[unit][converted_unit]
-                    converted_unit, converted_quantity = convert_large_vals(converted_unit, converted_quantity)
-                    ingredient[0] = round(converted_quantity, 2)
-                ingredient[1] = converted_unit
-        logging.info("DEBUG: Conversion method 3")
+        ingredients = data.get('ingredients')
+        if not isinstance(ingredients, list) or not ingredients or not all(valid_ingredient(i) for i in ingredients):
+            return {'error': 'Send a recipe_id or ingredients as a list of ingredient lines or [quantity, unit, name] rows'}, 400
+        ingredient_table = IngredientTable.from_rows([[i] if isinstance(i, str) else i for i in ingredients])
+        servings = data.get('servings')
+        original_unit_type = get_conversion_engine().unit_type(ingredient_table.units)
+
+    servings = parse_servings(servings)
+    requested_serving_size = data.get('serving_size')
+    if requested_serving_size is not None:
+        requested_serving_size = parse_serving_size(requested_serving_size)
+        if requested_serving_size is None:
+            return serving_size_error, 400
+        if not servings:
+            return {'error': 'The servings of the recipe are needed to scale it'}, 400
+    unit_type = data.get('unit_type') or original_unit_type
 
-    return ingredients
+    ingredients = convert_units(ingredient_table, unit_type, requested_serving_size, servings, original_unit_type)
+    return {'ingredients': ingredients, 'servings': requested_serving_size or servings, 'unit_type': unit_type}, 200
+
+def get_or_scrape_recipe(recipe_url):
+    recipe, expires_at, error = lookup_or_scrape_recipe(recipe_url)
+    return recipe, error
+
+# same, with when the recipe expires from the scrape cache (None for a fresh scrape, it has the whole TTL ahead of it)
+def lookup_or_scrape_recipe(recipe_url):
+    recipe, expires_at = scrape_cache.lookup(recipe_url)
+    if recipe is None:
+        start_time = time.perf_counter()
+        try:
+            recipe = scrape_recipe(recipe_url)
+        except scrape_errors as e:
+            return None, None, scrape_error_response(e)
+        cache_recipe(recipe_url, recipe, start_time)
+    return recipe, expires_at, None
+
+# the recipe_url of a JSON body, or the 400 to answer with
+def read_recipe_url(data):
+    recipe_url = data.get('recipe_url') if isinstance(data, dict) else None
+    if not recipe_url:
+        return None, ({'error': 'recipe_url is required'}, 400)
+    if not isinstance(recipe_url, str):
+        return None, ({'error': 'recipe_url must be a string'}, 400)
+    return recipe_url, None
+
+def scrape_recipe_steps(data):
+    recipe_url, error = read_recipe_url(data)
+    if error:
+        return error
+    recipe, error = get_or_scrape_recipe(recipe_url)
+    if error:
+        return error
+    return recipe_response(recipe_url, recipe), 200
+
+# ============= Background scrape jobs =============
+# the result of each job is what /scrape-recipe-steps would have answered
+def scrape_job_result(recipe_url, recipe, error):
+    if error:
+        return error
+    body = recipe_response(recipe_url, recipe)
+    return body, 200 if 'recipe_id' in body else 500
+
+# Jobs are kept in memory, or in RECIPE_SCRAPER_JOB_STORE_PATH (SQLite) to be shared by the workers and survive restarts.
+# The queue is built the first time it's needed, importing this module doesn't open the job store
+@lru_cache(maxsize=None)
+def get_scrape_jobs():
+    return create_scrape_job_queue(get_or_scrape_recipe, scrape_job_result)
+
+def submit_scrape_job(data):
+    recipe_url, error = read_recipe_url(data)
+    if error:
+        return error
+    callback_url = data.get('callback_url')
+    if callback_url and urlparse(callback_url).scheme not in ('http', 'https'):
+        return {'error': 'callback_url must be an http(s) URL'}, 400
+
+    try:
+        job = get_scrape_jobs().submit(recipe_url, callback_url)
+    except ScrapeQueueFull as e:
+        return {'error': str(e)}, 503
+    return {'job_id': job['job_id'], 'status': job['status'], 'status_url': '/scrape-jobs/{}'.format(job['job_id'])}, 202
+
+def get_scrape_job(job_id):
+    job = get_scrape_jobs().get(job_id)
+    if job is None:
+        return {'error': 'Job not found or expired'}, 404
+    return job, 200
+
+# ============= Cacheable GET views =============
+# GET forms of scrape/convert/scale keyed only on their query parameters. A view of a recipe URL is fully determined
+# by the extracted recipe and the parameters, so its strong ETag is a hash of both and the client can keep it for as long
+# as the scrape cache still keeps the recipe. They need a token, so shared caches (proxies, CDNs) must not keep them.
+# No recipe ID is handed out, these never touch the recipe store.
+def read_view_params(view, args):
+    recipe_url = args.get('recipe_url')
+    if not recipe_url:
+        return None, ({'error': 'recipe_url is required'}, 400)
+
+    unit_type = args.get('unit_type') or None
+    if view == 'convert' and not unit_type:
+        return None, ({'error': 'unit_type is required'}, 400)
+
+    serving_size = args.get('serving_size') or None
+    if serving_size is not None:
+        serving_size = parse_serving_size(serving_size)
+        if serving_size is None:
+            return None, (serving_size_error, 400)
+    elif view == 'scale':
+        return None, ({'error': 'serving_size is required'}, 400)
+
+    if view == 'recipe':
+        unit_type = serving_size = None
+    return {'recipe_url': recipe_url, 'unit_type': unit_type, 'serving_size': serving_size}, None
+
+def recipe_etag(recipe, view, params):
+    digest = hashlib.sha256(json.dumps(recipe, sort_keys=True).encode('utf-8'))
+    for value in (view, normalize_url(params['recipe_url']), params['unit_type'], params['serving_size']):
+        digest.update(b'\0' + str(value).encode('utf-8'))
+    return '"{}"'.format(digest.hexdigest()[:32])
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        # If-None-Match uses the weak comparison
+        if tag == '*' or tag == etag or tag == 'W/' + etag:
+            return True
+    return False
+
+# returns (body, status, headers). expires_at is when the scrape cache drops the recipe, None if it was just scraped
+def recipe_view(view, params, recipe, if_none_match=None, expires_at=None):
+    if not is_complete_recipe(recipe):
+        return extraction_failed_error, 500, {}
+
+    etag = recipe_etag(recipe, view, params)
+    max_age = scrape_cache.ttl if expires_at is None else max(0, int(expires_at - time.time()))
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age={}'.format(max_age), 'Vary': 'Authorization'}
+    if etag_matches(if_none_match, etag):
+        return None, 304, headers
+
+    if view == 'recipe':
+        body = {key: recipe[key] for key in ('recipe_name', 'recipe_steps', 'ingredients', 'servings', 'original_unit_type')}
+        body['recipe_url'] = normalize_url(params['recipe_url'])
+        return body, 200, headers
+
+    servings = parse_servings(recipe['servings'])
+    if params['serving_size'] is not None and not servings:
+        return {'error': 'The servings of the recipe are needed to scale it'}, 400, {}
+    original_unit_type = recipe['original_unit_type']
+    unit_type = params['unit_type'] or original_unit_type
+    return convert_units(recipe_ingredient_table(recipe), unit_type, params['serving_size'], servings, original_unit_type), 200, headers
+
+def get_recipe_view(view, args, if_none_match):
+    params, error = read_view_params(view, args)
+    if error:
+        return error
+    recipe, expires_at, error = lookup_or_scrape_recipe(params['recipe_url'])
+    if error:
+        return error
+    return recipe_view(view, params, recipe, if_none_match, expires_at)
+
+def health_check(data=None):
+    return {"message": "Health check is ok"}, 200
+
+# the scrape cache keeps its own counters, they're only turned into metric lines when /metrics is read
+def scrape_cache_metrics():
+    stats = scrape_cache.stats()
+    lines = ['# HELP recipe_scraper_scrape_cache_lookups_total Scrape cache lookups by result',
+             '# TYPE recipe_scraper_scrape_cache_lookups_total counter']
+    for result in ('hits', 'disk_hits', 'misses'):
+        lines.append('recipe_scraper_scrape_cache_lookups_total{{result="{}"}} {}'.format(result, stats[result]))
+    lines += ['# HELP recipe_scraper_scrape_cache_entries Recipes in the scrape cache',
+              '# TYPE recipe_scraper_scrape_cache_entries gauge',
+              'recipe_scraper_scrape_cache_entries {}'.format(stats['entries'])]
+    return lines
+
+collectors.append(scrape_cache_metrics)
 
 # ============= APIs =============
 @api.route('/convert-recipe-units')
@@ -542,17 +541,13 @@ class ConvertUnits(Resource):
     @api.expect(unit_type_model)
     @token_required
     def post(self, current_user):
-        global ingredients
-        global unit_type
-        global requested_serving_size
-        global servings
-        global original_unit_type
-        global ingredients_pre_conversion
-        
-        data = request.get_json()
-        unit_type = data.get('unit_type')
+        return convert_recipe_units(request.get_json())
 
-        return convert_units(ingredients, unit_type, requested_serving_size, servings, original_unit_type, ingredients_pre_conversion)
+    @api.doc(description="Ingredients of a recipe URL converted to a unit type, cacheable (ETag/If-None-Match)")
+    @api.doc(params={'recipe_url': 'URL of the recipe', 'unit_type': 'Either "si" or "metric"', 'serving_size': 'Optional, numeric value'})
+    @token_required
+    def get(self, current_user):
+        return get_recipe_view('convert', request.args, request.headers.get('If-None-Match'))
 
 @api.route('/calculate-serving-ingredients')
 class MultiplyServingSize(Resource):
@@ -562,28 +557,23 @@ class MultiplyServingSize(Resource):
     @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
     @token_required
     def post(self, current_user):
-        global servings
-        global requested_serving_size
-        global ingredients
-        global unit_type
-        global original_unit_type
-        global ingredients_pre_conversion
+        return calculate_serving_ingredients(request.get_json())
 
-        data = request.get_json()
-        requested_serving_size = float(data.get('serving_size'))
-
-        if not servings:
-            return None
-        
-        # clean up the servings numbers
-        servings = float(re.search("\\d+", str(servings))[0])
+    @api.doc(description="Ingredients of a recipe URL for a serving size, cacheable (ETag/If-None-Match)")
+    @api.doc(params={'recipe_url': 'URL of the recipe', 'serving_size': 'Numeric value', 'unit_type': 'Optional, either "si" or "metric"'})
+    @token_required
+    def get(self, current_user):
+        return get_recipe_view('scale', request.args, request.headers.get('If-None-Match'))
 
-        if original_unit_type == unit_type:
-            ingredients = calculate_servings(deepcopy(ingredients_pre_conversion), servings, requested_serving_size)
-        else:
-            temp = convert_units(deepcopy(ingredients_pre_conversion), unit_type, requested_serving_size, servings, original_unit_type, ingredients_pre_conversion)
-            ingredients = calculate_servings(temp, servings, requested_serving_size)
-        return ingredients
+@api.route('/compute-ingredients')
+class ComputeIngredients(Resource):
+    @api.doc(description="Scale and convert ingredients in one request without changing the stored recipe")
+    @api.expect(compute_model)
+    @api.doc(security='basicAuth')
+    @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
+    @token_required
+    def post(self, current_user):
+        return compute_ingredients(request.get_json())
 
 @api.route('/scrape-recipe-steps')
 class ScrapeRecipeSteps(Resource):
@@ -593,51 +583,119 @@ class ScrapeRecipeSteps(Resource):
     @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
     @token_required
     def post(self, current_user):
-        global ingredients
-        global servings
-        global original_unit_type
-        global ingredients_pre_conversion
+        return scrape_recipe_steps(request.get_json())
+
+    @api.doc(description="Recipe of a URL without a recipe ID, cacheable (ETag/If-None-Match)")
+    @api.doc(params={'recipe_url': 'URL of the recipe'})
+    @token_required
+    def get(self, current_user):
+        return get_recipe_view('recipe', request.args, request.headers.get('If-None-Match'))
+
+@api.route('/scrape-jobs')
+class ScrapeJobs(Resource):
+    @api.doc(description="Scrape a recipe in the background, returns a job ID to poll right away")
+    @api.expect(scrape_job_model)
+    @api.doc(security='basicAuth')
+    @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
+    @token_required
+    def post(self, current_user):
+        return submit_scrape_job(request.get_json())
 
+@api.route('/scrape-jobs/<string:job_id>')
+class ScrapeJob(Resource):
+    @api.doc(description="Status of a background scrape job, with the same result as /scrape-recipe-steps once it's done")
+    @api.doc(security='basicAuth')
+    @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
+    @token_required
+    def get(self, current_user, job_id):
+        return get_scrape_job(job_id)
+
+@api.route('/scrape-recipes/batch')
+class ScrapeRecipesBatch(Resource):
+    @api.doc(description="Scrape many recipes at once, each result is streamed as a line of NDJSON as soon as it's ready")
+    @api.expect(recipe_urls_model)
+    @api.doc(security='basicAuth')
+    @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
+    @token_required
+    def post(self, current_user):
         data = request.get_json()
-        recipe_url = data.get('recipe_url')
-        
-        try:
-            response = requests.get(recipe_url, headers=headers)
-            response.raise_for_status()  
-        except requests.RequestException as e:
-            return {'error': 'Failed to fetch recipe data: {}'.format(str(e))}, 500
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        recipe_name = postprocess_text(extract_recipe_name(soup, recipe_url))
-        recipe_steps = postprocess_list(extract_recipe_steps(soup))
-        ingredients = postprocess_list(extract_ingredients(soup))
-        if ingredients:
-            ingredients, original_unit_type, ingredients_pre_conversion = extract_units(ingredients)
-            servings = get_serving_size(soup)
-     
-        if recipe_name and recipe_steps and ingredients and servings:
-            return {'recipe_url': recipe_url, 'recipe_name': recipe_name, 'recipe_steps': recipe_steps, 'ingredients': ingredients, 'servings': servings, 'original_unit_type': original_unit_type}, 200
-        else:
-            return {"error": "Oops! We encountered a hiccup while trying to extract the recipe from this website. It seems its structure is quite unique and our system is having trouble with it. We're continuously working on improvements though! Thank you for your patience and support. ^^"}     
+        recipe_urls = data.get('recipe_urls') if isinstance(data, dict) else None
+
+        if not isinstance(recipe_urls, list) or not recipe_urls or not all(isinstance(url, str) and url for url in recipe_urls):
+            return {'error': 'recipe_urls must be a list of recipe URLs'}, 400
+        if len(recipe_urls) > max_batch_size:
+            return {'error': 'A batch can have at most {} recipe URLs'.format(max_batch_size)}, 400
+
+        # the same recipe might be in the batch more than once (with different tracking params etc), only scrape it once
+        positions = {}
+        for index, recipe_url in enumerate(recipe_urls):
+            positions.setdefault(normalize_url(recipe_url), []).append(index)
+        unique_urls = [recipe_urls[indexes[0]] for indexes in positions.values()]
+
+        def generate():
+            for recipe_url, recipe, error in scrape_recipes_concurrently(unique_urls):
+                for index in positions[normalize_url(recipe_url)]:
+                    if error:
+                        result = {'error': error, 'recipe_url': recipe_urls[index]}
+                    else:
+                        result = recipe_response(recipe_urls[index], recipe)
+                    yield json.dumps(dict(result, index=index)) + '\n'
 
-@api.route('/health-check')
-class HealthCheck(Resource):
-    def post(self):
-        return {"message": "Health check is ok"}, 200
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-def keep_alive():
-    while True:
-        try:
-            response = requests.post('https://recipe-scraper-backend.onrender.com/health-check', json={})
-            if response.status_code == 200:
-                print("Health check successful")
-            else:
-                print(f"Health check failed with status code {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            print(f"Exception while doing health check: {str(e)}")
+@api.route('/cache-stats')
+class CacheStats(Resource):
+    @api.doc(description="Hit/miss counters of the scrape result cache")
+    @api.doc(security='basicAuth')
+    @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
+    @token_required
+    def get(self, current_user):
+        return scrape_cache.stats(), 200
 
-        time.sleep(600)
+@api.route('/domain-strategies')
+class DomainStrategies(Resource):
+    @api.doc(description="Extraction method and list selectors learned for each website")
+    @api.doc(security='basicAuth')
+    @api.doc(params={'Authorization': {'in': 'header', 'description': 'Bearer <JWT token>', 'type': 'string'}})
+    @token_required
+    def get(self, current_user):
+        domain_strategies = get_domain_strategies()
+        if domain_strategies is None:
+            return {'error': 'Learning extraction strategies is turned off'}, 404
+        return domain_strategies.all(), 200
+
+@api.route('/metrics')
+class Metrics(Resource):
+    @api.doc(description="Stage latencies, extraction methods, cache lookups and upstream responses in the Prometheus text format")
+    def get(self):
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
-ping_thread = threading.Thread(target=keep_alive)
-ping_thread.start()
\ No newline at end of file
+@api.route('/health-check')
+class HealthCheck(Resource):
+    def post(self):
+        return health_check()
+
+# What a worker that's about to serve runs in the background: resuming the scrape jobs other workers left unfinished and
+# warming up from the recipe corpus. Called by create_app and the ASGI lifespan startup (only the first call does
+# anything), never on import
+@lru_cache(maxsize=None)
+def start_background_tasks():
+    get_scrape_jobs().start()
+    if recipe_corpus and os.getenv('RECIPE_SCRAPER_CORPUS_WARM_START', '1') != '0':
+        threading.Thread(target=warm_start, args=(recipe_corpus, scrape_cache, get_domain_strategies()), name='corpus-warm-start', daemon=True).start()
+
+# The Flask app serving the API. `gunicorn 'app:create_app()'` builds it in the worker, `gunicorn app:app` still works
+def create_app():
+    flask_app = Flask(__name__)
+    CORS(flask_app, origins=["*"], expose_headers=["ETag"])
+    flask_app.config['SECRET_KEY'] = secret_key
+    api.init_app(flask_app)
+    start_background_tasks()
+    return flask_app
+
+# `app` is only built the first time it's used, importing this module for its handlers (eg. asgi.py) doesn't need it
+def __getattr__(name):
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
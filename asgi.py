@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from app import (authenticate, login, convert_recipe_units, calculate_serving_ingredients, compute_ingredients, health_check, headers,
+                 scrape_cache, page_store, parse_executor, extract_page_recipe, cache_recipe, recipe_response,
+                 scrape_errors, scrape_error_response, read_recipe_url, read_view_params, recipe_view,
+                 submit_scrape_job, get_scrape_job, start_background_tasks)
+from fetcher import fetch_page_async, default_async_client
+from metrics import render_metrics
+
+# Async (ASGI) entry point serving the same routes as the Flask app, eg. `uvicorn asgi:application`.
+# Waiting on a slow recipe website doesn't hold a worker here: pages are fetched with the async fetch client and only
+# the extraction runs on the parse executor, so one process can have hundreds of scrapes in flight. What reads or
+# writes the stores (scrape cache, recipe store, SQLite jobs) runs on a thread too, it would hold up every connection
+# on the event loop otherwise.
+
+cors_headers = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Authorization, Content-Type, If-None-Match'),
+    (b'access-control-expose-headers', b'ETag'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+]
+
+
+async def get_or_scrape_recipe_async(recipe_url):
+    recipe, expires_at, error = await lookup_or_scrape_recipe_async(recipe_url)
+    return recipe, error
+
+
+async def lookup_or_scrape_recipe_async(recipe_url):
+    recipe, expires_at = await asyncio.to_thread(scrape_cache.lookup, recipe_url)
+    if recipe is None:
+        start_time = time.perf_counter()
+        try:
+            page = await fetch_page_async(recipe_url, headers, page_store)
+            recipe = await asyncio.get_running_loop().run_in_executor(parse_executor, extract_page_recipe, page)
+        except scrape_errors as e:
+            return None, None, scrape_error_response(e)
+        await asyncio.to_thread(cache_recipe, recipe_url, recipe, start_time)
+    return recipe, expires_at, None
+
+
+async def scrape_recipe_steps_async(data):
+    recipe_url, error = read_recipe_url(data)
+    if error:
+        return error
+    recipe, error = await get_or_scrape_recipe_async(recipe_url)
+    if error:
+        return error
+    return await asyncio.to_thread(recipe_response, recipe_url, recipe), 200
+
+
+async def get_recipe_view_async(view, args, if_none_match):
+    params, error = read_view_params(view, args)
+    if error:
+        return error
+    recipe, expires_at, error = await lookup_or_scrape_recipe_async(params['recipe_url'])
+    if error:
+        return error
+    return await asyncio.to_thread(recipe_view, view, params, recipe, if_none_match, expires_at)
+
+
+# path -> (handler, needs a token)
+routes = {
+    '/login': (login, False),
+    '/scrape-recipe-steps': (scrape_recipe_steps_async, True),
+    '/convert-recipe-units': (convert_recipe_units, True),
+    '/calculate-serving-ingredients': (calculate_serving_ingredients, True),
+    '/compute-ingredients': (compute_ingredients, True),
+    '/scrape-jobs': (submit_scrape_job, True),
+    '/health-check': (health_check, False),
+}
+
+# path -> view for the cacheable GET forms, they all need a token
+get_routes = {
+    '/scrape-recipe-steps': 'recipe',
+    '/convert-recipe-units': 'convert',
+    '/calculate-serving-ingredients': 'scale',
+}
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, result):
+    # handlers return either the body, (body, status) or (body, status, headers) like flask-restx resources do
+    if not isinstance(result, tuple):
+        result = (result, 200)
+    body, status, extra_headers = result if len(result) == 3 else result + ({},)
+    response_headers = [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in extra_headers.items()]
+
+    # a 304 has no body
+    payload = b'' if status == 304 else json.dumps(body).encode('utf-8') + b'\n'
+    if status != 304:
+        response_headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': response_headers + cors_headers,
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def send_text(send, text, content_type=b'text/plain; version=0.0.4'):
+    payload = text.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(payload)).encode())] + cors_headers,
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            start_background_tasks()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await default_async_client.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    if scope['method'] == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 200, 'headers': cors_headers})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    path = scope['path'].rstrip('/') or '/'
+    if path == '/metrics' and scope['method'] == 'GET':
+        await send_text(send, render_metrics())
+        return
+    request_headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+
+    if path.startswith('/scrape-jobs/') and scope['method'] == 'GET':
+        current_user, error = authenticate(request_headers.get('authorization'))
+        await send_json(send, error or await asyncio.to_thread(get_scrape_job, path[len('/scrape-jobs/'):]))
+        return
+    route = routes.get(path)
+    if route is None:
+        await send_json(send, ({'message': 'The requested URL was not found on the server.'}, 404))
+        return
+
+    if scope['method'] == 'GET' and path in get_routes:
+        current_user, error = authenticate(request_headers.get('authorization'))
+        if error:
+            await send_json(send, error)
+            return
+        args = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        await send_json(send, await get_recipe_view_async(get_routes[path], args, request_headers.get('if-none-match')))
+        return
+
+    if scope['method'] != 'POST':
+        await send_json(send, ({'message': 'The method is not allowed for the requested URL.'}, 405))
+        return
+    handler, needs_token = route
+
+    if needs_token:
+        current_user, error = authenticate(request_headers.get('authorization'))
+        if error:
+            await send_json(send, error)
+            return
+
+    body = await read_body(receive)
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        await send_json(send, ({'message': 'Failed to decode JSON object'}, 400))
+        return
+
+    if asyncio.iscoroutinefunction(handler):
+        result = await handler(data)
+    else:
+        result = await asyncio.to_thread(handler, data)
+    await send_json(send, result)
@@ -0,0 +1,106 @@
+import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Issues and verifies the JWTs of the API. Verified tokens are remembered (by their hash, until they expire), so
+# chatty clients calling the unit/serving endpoints over and over don't pay for the signature check every time.
+# Several signing keys can be active at once, each with a key ID ("kid" in the token header): tokens are signed with
+# the first one and accepted with any of them, so a new key can be rolled out before the old one is dropped.
+# PyJWT is imported by the first token issued or checked, a worker answering health checks doesn't need it.
+
+DEFAULT_CACHE_SIZE = 1024
+TOKEN_LIFETIME = datetime.timedelta(hours=24)
+
+
+class TokenVerifier:
+    # keys is {kid: secret}, the first one signs. default_kid is the key for tokens without a kid (issued before rotation)
+    def __init__(self, keys, default_kid=None, algorithm='HS256', cache_size=DEFAULT_CACHE_SIZE):
+        self.keys = dict(keys)
+        self.signing_kid = next(iter(self.keys))
+        self.default_kid = default_kid if default_kid in self.keys else self.signing_kid
+        self.algorithm = algorithm
+        self.cache_size = cache_size
+        self._verified = OrderedDict()  # sha256 of the token -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def issue(self, username, lifetime=TOKEN_LIFETIME):
+        import jwt
+
+        payload = {'username': username, 'exp': datetime.datetime.utcnow() + lifetime}
+        # a single key without a kid issues the same tokens as before there was rotation
+        headers = {'kid': self.signing_kid} if self.signing_kid is not None else None
+        return jwt.encode(payload, self.keys[self.signing_kid], algorithm=self.algorithm, headers=headers)
+
+    # Returns (payload, None) for a valid token, otherwise (None, reason)
+    def verify(self, authorization):
+        token = parse_authorization(authorization)
+        if not token:
+            return None, 'Missing authorization token'
+
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._verified.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._verified.move_to_end(key)
+                    return entry[1], None
+                del self._verified[key]
+
+        import jwt
+
+        try:
+            kid = jwt.get_unverified_header(token).get('kid', None)
+            secret = self.keys.get(kid if kid is not None else self.default_kid)
+            if secret is None:
+                return None, 'Invalid token'
+            payload = jwt.decode(token, secret, algorithms=[self.algorithm])
+        except jwt.ExpiredSignatureError:
+            return None, 'Token has expired'
+        except jwt.InvalidTokenError:
+            return None, 'Invalid token'
+        if not isinstance(payload.get('username'), str):
+            return None, 'Invalid token'
+
+        # tokens without an expiry are still accepted, but they're checked every time
+        expires_at = payload.get('exp')
+        if isinstance(expires_at, (int, float)):
+            with self._lock:
+                self._verified[key] = (expires_at, payload)
+                while len(self._verified) > self.cache_size:
+                    self._verified.popitem(last=False)
+        return payload, None
+
+
+# "Bearer <token>" or just the token, like the frontend has always sent it
+def parse_authorization(authorization):
+    if not authorization:
+        return None
+    scheme, _, rest = authorization.strip().partition(' ')
+    if rest and scheme.lower() == 'bearer':
+        return rest.strip()
+    return authorization.strip()
+
+
+# RECIPE_SCRAPER_SECRET_KEYS="kid1:secret1,kid2:secret2" turns on key rotation, kid1 signs and both are accepted.
+# Without it secret_key (RECIPE_SCRAPER_SECRET_KEY) is the only key. With it, tokens without a kid are still accepted
+# when RECIPE_SCRAPER_SECRET_KEY is set, so the tokens issued before rotation keep working until they expire.
+def create_token_verifier(secret_key):
+    keys = {}
+    for item in os.getenv('RECIPE_SCRAPER_SECRET_KEYS', '').split(','):
+        kid, _, secret = item.strip().partition(':')
+        if kid and secret:
+            keys[kid] = secret
+
+    default_kid = None
+    legacy_key = os.getenv('RECIPE_SCRAPER_SECRET_KEY')
+    if not keys:
+        keys[None] = secret_key
+    elif legacy_key:
+        if legacy_key not in keys.values():
+            keys['legacy'] = legacy_key
+        default_kid = next(kid for kid, secret in keys.items() if secret == legacy_key)
+    return TokenVerifier(keys, default_kid=default_kid, cache_size=int(os.getenv('RECIPE_SCRAPER_TOKEN_CACHE_SIZE', DEFAULT_CACHE_SIZE)))
@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+
+import jwt
+
+# Auth overhead per request: a plain jwt.decode (what token_required used to do on every request), the token verifier
+# on a token it hasn't seen yet and on a token it has already verified, and a whole request to a cheap endpoint
+# through Flask with a cold and a warm verifier. Run from the repo root:
+#   python benchmarks/auth_benchmark.py --requests 20000
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+
+def per_call(function, count):
+    start_time = time.perf_counter()
+    for i in range(count):
+        function(i)
+    return (time.perf_counter() - start_time) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ.setdefault('RECIPE_SCRAPER_USERNAME', 'benchmark')
+    os.environ.setdefault('RECIPE_SCRAPER_PASSWORD', 'benchmark')
+    import app as app_module
+    from auth_tokens import TokenVerifier
+
+    secret = app_module.app.config['SECRET_KEY']
+    token = app_module.generate_token('benchmark')
+    # a different token for every call, so none of them are in the cache
+    verifier = TokenVerifier({None: secret})
+    tokens = [verifier.issue('user{}'.format(i)) for i in range(args.requests)]
+
+    results = [
+        ('jwt.decode', per_call(lambda i: jwt.decode(token, secret, algorithms=['HS256']), args.requests)),
+        ('verifier, new token', per_call(lambda i: verifier.verify(tokens[i]), args.requests)),
+        ('verifier, cached token', per_call(lambda i: app_module.token_verifier.verify('Bearer ' + token), args.requests)),
+    ]
+
+    client = app_module.app.test_client()
+    requests = max(args.requests // 10, 1)
+    results.append(('request, new token', per_call(
+        lambda i: client.get('/scrape-jobs/missing', headers={'Authorization': tokens[i]}), requests)))
+    results.append(('request, cached token', per_call(
+        lambda i: client.get('/scrape-jobs/missing', headers={'Authorization': token}), requests)))
+
+    print('{:<24} {:>10}'.format('', 'us/call'))
+    for name, microseconds in results:
+        print('{:<24} {:>10.1f}'.format(name, microseconds))
+    os._exit(0)  # the app's background threads never stop on their own
+
+
+if __name__ == '__main__':
+    main()
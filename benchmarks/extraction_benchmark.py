@@ -0,0 +1,302 @@
+import argparse
+import gc
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Offline benchmark of the extraction pipeline over the saved recipe pages in benchmarks/corpus, no live sites needed.
+# Reports the wall time and memory of every stage and how many fields match the golden outputs. Run from the repo root:
+#   python benchmarks/extraction_benchmark.py                      # run and print the report
+#   python benchmarks/extraction_benchmark.py --save before.json   # keep the results to compare later
+#   python benchmarks/extraction_benchmark.py --compare before.json after.json
+#   python benchmarks/extraction_benchmark.py --against HEAD~1     # run this corpus on another commit and compare
+# --update-golden writes the current outputs as the new golden outputs, only do that after checking them.
+# Learned per-website strategies are off (in the --against run too): every pass times the full cascade, not selectors
+# an earlier pass or a strategy store left behind.
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+corpus_dir = os.path.join(root_dir, 'benchmarks', 'corpus')
+golden_path = os.path.join(corpus_dir, 'golden.json')
+
+fields = ['recipe_name', 'recipe_steps', 'ingredients', 'servings', 'original_unit_type']
+# stages of the heuristic (DOM) pipeline, in the order extract_recipe runs them
+stage_names = ['parse', 'index', 'name', 'steps', 'ingredients', 'units', 'servings']
+
+DEFAULT_REPEAT = 5
+DEFAULT_TIME_THRESHOLD = 0.10  # 10% slower counts as a regression
+DEFAULT_MEMORY_THRESHOLD = 0.10
+
+
+def load_corpus():
+    with open(golden_path) as f:
+        golden = json.load(f)
+    corpus = []
+    for name, entry in sorted(golden['pages'].items()):
+        with open(os.path.join(corpus_dir, name), 'rb') as f:
+            corpus.append((name, entry['url'], f.read(), entry['expected']))
+    return corpus
+
+
+def import_scraper(repo_dir):
+    sys.path.insert(0, repo_dir)
+    try:
+        import scraper
+    except ImportError as e:
+        sys.exit('Can\'t benchmark {}, it has no usable scraper module: {}'.format(repo_dir, e))
+    return scraper
+
+
+# Runs the heuristic stages one by one on a page, yields (stage, function) so they can be timed and measured
+def pipeline_stages(scraper, content, url):
+    state = {}
+    has_index = hasattr(scraper, 'build_dom_index')
+
+    def parse():
+        state['soup'] = scraper.make_soup(content)
+
+    def index():
+        state['index'] = scraper.build_dom_index(state['soup']) if has_index else None
+
+    def with_index(function, *args):
+        return function(*args, index=state['index']) if has_index else function(*args)
+
+    def ingredients():
+        state['ingredients'] = scraper.postprocess_list(with_index(scraper.extract_ingredients, state['soup']))
+
+    def units():
+        if state['ingredients']:
+            scraper.extract_units(state['ingredients'])
+
+    return [
+        ('parse', parse),
+        ('index', index),
+        ('name', lambda: with_index(scraper.extract_recipe_name, state['soup'], url)),
+        ('steps', lambda: with_index(scraper.extract_recipe_steps, state['soup'])),
+        ('ingredients', ingredients),
+        ('units', units),
+        ('servings', lambda: with_index(scraper.get_serving_size, state['soup'])),
+    ]
+
+
+def time_stages(scraper, corpus, repeat):
+    timings = {stage: [] for stage in stage_names + ['total']}
+    for _ in range(repeat):
+        for name, url, content, expected in corpus:
+            for stage, function in pipeline_stages(scraper, content, url):
+                start_time = time.perf_counter()
+                function()
+                timings[stage].append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            scraper.extract_recipe(content, url)
+            timings['total'].append(time.perf_counter() - start_time)
+    # per page, median over the repeats
+    pages = len(corpus)
+    return {stage: round(statistics.median(sum(values[i:i + pages]) for i in range(0, len(values), pages)) / pages * 1000, 3)
+            for stage, values in timings.items()}
+
+
+# Peak memory and allocated blocks of every stage, in a separate pass because tracemalloc slows everything down
+def measure_memory(scraper, corpus):
+    memory = {stage: {'peak_kb': 0.0, 'blocks': 0} for stage in stage_names + ['total']}
+    tracemalloc.start()
+    try:
+        for name, url, content, expected in corpus:
+            stages = pipeline_stages(scraper, content, url) + [('total', lambda: scraper.extract_recipe(content, url))]
+            for stage, function in stages:
+                gc.collect()
+                tracemalloc.reset_peak()
+                current_before = tracemalloc.get_traced_memory()[0]
+                blocks_before = sys.getallocatedblocks()
+                function()
+                peak = tracemalloc.get_traced_memory()[1] - current_before
+                memory[stage]['peak_kb'] = max(memory[stage]['peak_kb'], round(peak / 1024, 1))
+                memory[stage]['blocks'] += sys.getallocatedblocks() - blocks_before
+    finally:
+        tracemalloc.stop()
+    return memory
+
+
+def field_matches(field, actual, expected):
+    if field == 'ingredients':
+        # the labelled ingredient methods don't keep the page order, only what was found counts
+        return sorted(map(json.dumps, actual or [])) == sorted(map(json.dumps, expected or []))
+    if field == 'servings':
+        return str(actual) == str(expected)
+    return actual == expected
+
+
+def list_f1(actual, expected):
+    actual = [json.dumps(item) for item in actual or []]
+    expected = [json.dumps(item) for item in expected or []]
+    if not actual and not expected:
+        return 1.0
+    common = len(set(actual) & set(expected))
+    if not common:
+        return 0.0
+    precision, recall = common / len(set(actual)), common / len(set(expected))
+    return 2 * precision * recall / (precision + recall)
+
+
+def check_accuracy(scraper, corpus):
+    outputs = {}
+    accuracy = {field: 0 for field in fields}
+    f1 = {'recipe_steps': [], 'ingredients': []}
+    failures = []
+    for name, url, content, expected in corpus:
+        recipe = scraper.extract_recipe(content, url)
+        outputs[name] = {field: recipe.get(field) for field in fields}
+        for field in fields:
+            if field_matches(field, recipe.get(field), expected.get(field)):
+                accuracy[field] += 1
+            else:
+                failures.append((name, field))
+        for field in f1:
+            f1[field].append(list_f1(recipe.get(field), expected.get(field)))
+
+    pages = len(corpus)
+    return {
+        'fields': {field: round(matches / pages, 3) for field, matches in accuracy.items()},
+        'f1': {field: round(sum(values) / pages, 3) for field, values in f1.items()},
+        'failures': ['{}: {}'.format(name, field) for name, field in failures],
+    }, outputs
+
+
+def git_commit(repo_dir):
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(repo_dir, repeat):
+    scraper = import_scraper(repo_dir)
+    corpus = load_corpus()
+    accuracy, outputs = check_accuracy(scraper, corpus)
+    results = {
+        'commit': git_commit(repo_dir),
+        'pages': len(corpus),
+        'corpus_kb': round(sum(len(content) for name, url, content, expected in corpus) / 1024, 1),
+        'time_ms': time_stages(scraper, corpus, repeat),
+        'memory': measure_memory(scraper, corpus),
+        'accuracy': accuracy,
+    }
+    return results, outputs
+
+
+def print_report(results):
+    print('commit {} | {} pages ({} KB)'.format(results['commit'], results['pages'], results['corpus_kb']))
+    print('{:<12} {:>10} {:>10} {:>10}'.format('stage', 'ms/page', 'peak KB', 'blocks'))
+    for stage in stage_names + ['total']:
+        memory = results['memory'][stage]
+        print('{:<12} {:>10.3f} {:>10.1f} {:>10}'.format(stage, results['time_ms'][stage], memory['peak_kb'], memory['blocks']))
+    print('accuracy: ' + ', '.join('{} {:.0%}'.format(field, value) for field, value in results['accuracy']['fields'].items()))
+    print('list F1:  ' + ', '.join('{} {:.3f}'.format(field, value) for field, value in results['accuracy']['f1'].items()))
+    for failure in results['accuracy']['failures']:
+        print('  mismatch ' + failure)
+
+
+# Anything slower/bigger than the thresholds, or less accurate, is a regression
+def compare(before, after, time_threshold, memory_threshold):
+    regressions = []
+    print('{:<12} {:>10} {:>10} {:>8}'.format('stage', 'before ms', 'after ms', 'change'))
+    for stage in stage_names + ['total']:
+        old, new = before['time_ms'].get(stage), after['time_ms'].get(stage)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        flag = ''
+        # sub-millisecond stages are too noisy to judge on a relative change alone
+        if change > time_threshold and new - old > 0.05:
+            flag = '  REGRESSION'
+            regressions.append('{} is {:.0%} slower'.format(stage, change))
+        print('{:<12} {:>10.3f} {:>10.3f} {:>+8.0%}{}'.format(stage, old, new, change, flag))
+
+        old_peak, new_peak = before['memory'][stage]['peak_kb'], after['memory'][stage]['peak_kb']
+        if old_peak and (new_peak - old_peak) / old_peak > memory_threshold and new_peak - old_peak > 16:
+            regressions.append('{} peak memory went from {} KB to {} KB'.format(stage, old_peak, new_peak))
+
+    for field, old in before['accuracy']['fields'].items():
+        new = after['accuracy']['fields'].get(field, 0)
+        if new < old:
+            regressions.append('{} accuracy dropped from {:.0%} to {:.0%}'.format(field, old, new))
+    newly_failing = sorted(set(after['accuracy']['failures']) - set(before['accuracy']['failures']))
+    for failure in newly_failing:
+        regressions.append('now wrong: ' + failure)
+
+    for regression in regressions:
+        print('REGRESSION: ' + regression)
+    if not regressions:
+        print('no regressions')
+    return regressions
+
+
+# Runs the benchmark of another commit (checked out in a temporary worktree) on this corpus, in a separate process
+def run_against(commit, repeat):
+    worktree = tempfile.mkdtemp(prefix='extraction-benchmark-')
+    results_path = os.path.join(worktree, 'results.json')
+    try:
+        subprocess.run(['git', 'worktree', 'add', '--detach', worktree, commit], cwd=root_dir, check=True, capture_output=True)
+        benchmark = subprocess.run([sys.executable, os.path.abspath(__file__), '--repo', worktree, '--repeat', str(repeat), '--save', results_path, '--quiet'],
+                                   cwd=root_dir)
+        if benchmark.returncode != 0:
+            sys.exit('The benchmark failed on {}'.format(commit))
+        with open(results_path) as f:
+            return json.load(f)
+    finally:
+        subprocess.run(['git', 'worktree', 'remove', '--force', worktree], cwd=root_dir, capture_output=True)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repo', default=root_dir, help='checkout whose scraper is benchmarked')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two saved results')
+    parser.add_argument('--against', metavar='COMMIT', help='compare this checkout with another commit')
+    parser.add_argument('--time-threshold', type=float, default=DEFAULT_TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=DEFAULT_MEMORY_THRESHOLD)
+    parser.add_argument('--update-golden', action='store_true', help='save the current outputs as the golden outputs')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+    os.environ['RECIPE_SCRAPER_LEARN_STRATEGIES'] = '0'
+    os.environ.pop('RECIPE_SCRAPER_STRATEGY_PATH', None)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        sys.exit(1 if compare(before, after, args.time_threshold, args.memory_threshold) else 0)
+
+    before = run_against(args.against, args.repeat) if args.against else None
+
+    results, outputs = run_benchmark(args.repo, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if not args.quiet:
+        print_report(results)
+
+    if args.update_golden:
+        with open(golden_path) as f:
+            golden = json.load(f)
+        for name, output in outputs.items():
+            golden['pages'][name]['expected'] = output
+        with open(golden_path, 'w') as f:
+            json.dump(golden, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+
+    if before is not None:
+        print()
+        sys.exit(1 if compare(before, results, args.time_threshold, args.memory_threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import os
+import re
+import sys
+import time
+
+# Micro benchmark of the ingredient line parser against the regex/replace based version it replaced.
+# Run from the repo root:
+#   python benchmarks/ingredient_parser_benchmark.py --lines 20000
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingredient_parser import parse_ingredient, format_quantity  # noqa: E402
+
+sample_lines = [
+    '1 1/2 lb chicken thighs', '½ cup flour', '2 cups water', '2-3 potatoes', '3 tablespoons oil', '6 cloves garlic',
+    '2 to 3 tbsp. olive oil', '200g spinach', '1 tsp salt', '1 ½ teaspoons ground cumin', '400 ml coconut milk',
+    '1 can chickpeas, drained', '2 garlic cloves, minced', 'salt and pepper to taste', '8 fl oz cream', '1 kg potatoes',
+]
+
+# frozen copy of the old parsing, only here to compare against
+legacy_common_units = [
+    "grams", "gram", "milliliters", "milliliter", "centimeter", "centimeter", "kilograms", "kilogram",
+    "cups", "cup", "tablespoons", "tablespoon", "teaspoons", "teaspoon", "tsp", "tbsp",
+    "pounds", "pound", "ounces", "ounce", "grams", "gram", "tsp .", "tb .", "lb",
+    "cloves", "clove", "can", "tin", "jar", "g", "kg", "litre", "litres", "millilitres", "millilitre"
+]
+legacy_unit_mapping = {'gram': 'grams', 'g': 'grams', 'lb': 'lb', 'pound': 'lb', 'pounds': 'lb', 'kg': 'kg', 'kilogram': 'kg',
+                       'kilograms': 'kg', 'oz': 'oz', 'ounce': 'oz', 'ounces': 'oz', 'mg': 'mg', 'milligram': 'mg', 'milligrams': 'mg',
+                       'l': 'l', 'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l', 'ml': 'ml', 'milliliter': 'ml', 'milliliters': 'ml',
+                       'tsp': 'tsp', 'teaspoon': 'tsp', 'teaspoons': 'tsp', 'tbsp': 'tbsp', 'tablespoon': 'tbsp', 'tablespoons': 'tbsp'}
+
+
+def legacy_parse(ingredient):
+    match = re.match(r'^((?:\d+\s*)?(?:\d*½|\d*¼|\d*[¾¾]|\d*⅛|\d*⅔|\d+\s*[/–-]|to\s*\d+)?[\s\d/–-]*)[\s]?([a-zA-Z]+\b)?[\s]?(.*)$', ingredient)
+    quantity, unit, name = match.groups()
+
+    if '-' in str(quantity):
+        quantity = str(quantity).replace(" ", "")
+    elif 'to' in str(quantity):
+        quantity = '-'.join(str(quantity).replace(" ", "").split('to'))
+    else:
+        quantity = quantity.strip() if quantity else None
+        quantity = quantity.replace("½", "1/2").replace("¼", "1/4").replace("¾", "3/4").replace("⅛", "1/8").replace("⅔", "2/3") if quantity else None
+
+    if unit == "garlic":
+        name = unit
+        unit = None
+    elif unit:
+        modified_unit = re.split(r'^({})'.format('|'.join(legacy_common_units)), unit)
+        unit = modified_unit[1] if len(modified_unit) > 1 else modified_unit[0]
+        name = modified_unit[2] + " " + name if len(modified_unit) > 1 else name
+
+    if unit and unit.lower() not in legacy_common_units:
+        name = unit + " " + name
+        unit = None
+
+    if unit:
+        cleaned = re.sub(r'\s*\.\s*', '', unit).strip().lower()
+        unit = legacy_unit_mapping.get(cleaned, unit)
+    return [quantity, unit, name.strip() if name else None]
+
+
+def compiled_parse(ingredient):
+    parsed = parse_ingredient(ingredient)
+    return [format_quantity(parsed.low, parsed.high), parsed.unit, parsed.name]
+
+
+def measure(parse, lines):
+    start_time = time.perf_counter()
+    for line in lines:
+        parse(line)
+    elapsed = time.perf_counter() - start_time
+    return len(lines) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--show', action='store_true', help='print how both versions parse the sample lines')
+    args = parser.parse_args()
+
+    if args.show:
+        for line in sample_lines:
+            print('{!r}\n  legacy:   {}\n  compiled: {}'.format(line, legacy_parse(line), compiled_parse(line)))
+
+    lines = (sample_lines * (args.lines // len(sample_lines) + 1))[:args.lines]
+    legacy_rate = measure(legacy_parse, lines)
+    compiled_rate = measure(compiled_parse, lines)
+    print('legacy:   {:.0f} lines/s'.format(legacy_rate))
+    print('compiled: {:.0f} lines/s ({:.1f}x)'.format(compiled_rate, compiled_rate / legacy_rate))
+
+
+if __name__ == '__main__':
+    main()
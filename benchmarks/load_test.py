@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# Load test comparing the gunicorn/Flask app with the ASGI app (uvicorn) when the recipe websites are slow.
+# A local stand-in recipe website answers every page after --upstream-delay seconds, and each request scrapes a
+# different URL so the scrape cache doesn't help. Run from the repo root:
+#   python benchmarks/load_test.py --requests 200 --concurrency 100 --upstream-delay 0.5
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+recipe_page = b'''<html><body>
+<h1 class="entry-title">Ayam Pongteh Nyonya Chicken And Potato Stew</h1>
+<p>Servings: 4</p>
+<ul>
+<li class="recipe-ingredient">2 cups water</li>
+<li class="recipe-ingredient">1 lb chicken thighs</li>
+<li class="recipe-ingredient">3 tablespoons oil</li>
+</ul>
+<ol>
+<li class="recipe-instruction">Heat the oil in a pot.</li>
+<li class="recipe-instruction">Add the chicken and stir.</li>
+<li class="recipe-instruction">Simmer for 30 minutes and serve.</li>
+</ol>
+</body></html>'''
+
+
+def start_upstream(delay):
+    class SlowRecipeSite(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(recipe_page)))
+            self.end_headers()
+            self.wfile.write(recipe_page)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowRecipeSite)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_command(mode, port, threads):
+    if mode == 'flask':
+        return [sys.executable, '-m', 'gunicorn', '--workers', '1', '--threads', str(threads), '--bind', '127.0.0.1:{}'.format(port), 'app:app']
+    return [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning', 'asgi:application']
+
+
+def wait_until_up(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Server exited with code {}'.format(process.returncode))
+        try:
+            if requests.post(base_url + '/health-check', json={}, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('Server did not start within {}s'.format(timeout))
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run_load(base_url, upstream_url, total_requests, concurrency, run_id):
+    token = requests.post(base_url + '/login', json={'username': 'loadtest', 'password': 'loadtest'}).json()['token']
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def scrape(i):
+        start = time.perf_counter()
+        try:
+            response = session.post(base_url + '/scrape-recipe-steps', json={'recipe_url': '{}/recipe?run={}&i={}'.format(upstream_url, run_id, i)},
+                                    headers={'Authorization': token}, timeout=120)
+            ok = response.status_code == 200 and 'recipe_id' in response.json()
+        except (requests.RequestException, ValueError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(scrape, range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, ok in results if ok]
+    return {
+        'requests': total_requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(total_requests / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Flask (gunicorn) and ASGI (uvicorn) serving modes under slow upstream websites')
+    parser.add_argument('--modes', default='flask,asgi')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--upstream-delay', type=float, default=0.5)
+    parser.add_argument('--gunicorn-threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    upstream = start_upstream(args.upstream_delay)
+    upstream_url = 'http://127.0.0.1:{}'.format(upstream.server_port)
+
+    env = dict(os.environ, RECIPE_SCRAPER_USERNAME='loadtest', RECIPE_SCRAPER_PASSWORD='loadtest',
+               RECIPE_SCRAPER_MAX_PER_HOST=str(args.requests), RECIPE_SCRAPER_FETCH_POOL_SIZE=str(args.concurrency))
+
+    results = {}
+    for mode in args.modes.split(','):
+        process = subprocess.Popen(server_command(mode, args.port, args.gunicorn_threads), cwd=root_dir, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base_url = 'http://127.0.0.1:{}'.format(args.port)
+            wait_until_up(base_url, process)
+            results[mode] = run_load(base_url, upstream_url, args.requests, args.concurrency, run_id=mode)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        print('{}: {}'.format(mode, json.dumps(results[mode])))
+
+    upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# Runs the current extraction over the raw pages kept in the page store (RECIPE_SCRAPER_PAGE_STORE_DIR) for every
+# recipe in the recipe corpus (RECIPE_SCRAPER_CORPUS_DIR) and reports which fields and extraction methods come out
+# different from what was recorded when the page was scraped, without fetching anything. Run from the repo root:
+#   python benchmarks/reextract_corpus.py --corpus corpus/ --pages pages/ --show 20
+# Learned per-website strategies are off, so every page goes through the full cascade.
+# Pages whose download was stopped early (RECIPE_SCRAPER_EARLY_STOP) only have their start stored. That's still what
+# the recorded extraction ran on, so they're re-extracted too, and the report says how many of the changes they make up.
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+
+
+def reextract(corpus, page_store, limit=None):
+    import metrics
+    from recipe_corpus import corpus_record, recipe_fields
+    from scraper import extract_recipe
+
+    results = {'records': 0, 'missing_pages': 0, 'truncated_pages': 0, 'failed': 0, 'changed': {field: 0 for field in recipe_fields + ['methods']},
+               'changed_truncated': {field: 0 for field in recipe_fields + ['methods']}, 'method_changes': {},
+               'recorded_seconds': 0.0, 'seconds': 0.0, 'changed_urls': []}
+    records = corpus.latest()
+    for record in records[-limit:] if limit else records:
+        stored = page_store.get(record['url'])
+        content = page_store.get_content(record['url']) if stored else None
+        if content is None:
+            results['missing_pages'] += 1
+            continue
+        truncated = stored.get('truncated')
+        results['records'] += 1
+        if truncated:
+            results['truncated_pages'] += 1
+
+        start_time = time.perf_counter()
+        try:
+            with metrics.deferred() as events:
+                recipe = extract_recipe(content, record['url'])
+        except Exception:
+            results['failed'] += 1
+            results['changed_urls'].append((record['url'], ['failed'], truncated))
+            continue
+        results['seconds'] += time.perf_counter() - start_time
+        results['recorded_seconds'] += record['timings'].get('extract', 0.0)
+
+        current = corpus_record(record['url'], recipe, events)
+        changed = [field for field in recipe_fields if current[field] != record[field]]
+        for field in sorted(set(record['methods']) | set(current['methods'])):
+            before, after = record['methods'].get(field), current['methods'].get(field)
+            if before != after:
+                key = '{}: {} -> {}'.format(field, before, after)
+                results['method_changes'][key] = results['method_changes'].get(key, 0) + 1
+                if 'methods' not in changed:
+                    changed.append('methods')
+        for field in changed:
+            results['changed'][field] += 1
+            if truncated:
+                results['changed_truncated'][field] += 1
+        if changed:
+            results['changed_urls'].append((record['url'], changed, truncated))
+    return results
+
+
+def print_report(results, show):
+    records = results['records']
+    print('{} recipes re-extracted ({} from a page stored up to an early stop), {} without a stored page, {} failed'.format(
+        records, results['truncated_pages'], results['missing_pages'], results['failed']))
+    if not records:
+        return
+    print('extraction {:.1f} ms/page now, {:.1f} ms/page when scraped'.format(
+        results['seconds'] / records * 1000, results['recorded_seconds'] / records * 1000))
+    print('{:<20} {:>8} {:>8} {:>10}'.format('changed', 'pages', 'share', 'truncated'))
+    for field, count in results['changed'].items():
+        print('{:<20} {:>8} {:>8.1%} {:>10}'.format(field, count, count / records, results['changed_truncated'][field]))
+    for change, count in sorted(results['method_changes'].items(), key=lambda item: -item[1]):
+        print('  {:>6}  {}'.format(count, change))
+    for url, fields, truncated in results['changed_urls'][:show]:
+        print('  {}  {}{}'.format(url, ', '.join(fields), '  (stored up to the {} early stop)'.format(truncated) if truncated else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=os.getenv('RECIPE_SCRAPER_CORPUS_DIR'), help='recipe corpus directory')
+    parser.add_argument('--pages', default=os.getenv('RECIPE_SCRAPER_PAGE_STORE_DIR'), help='page store directory')
+    parser.add_argument('--limit', type=int, help='only the latest LIMIT recipes')
+    parser.add_argument('--show', type=int, default=10, help='how many of the changed URLs to list')
+    parser.add_argument('--compact', action='store_true', help='compact the finished logs of the corpus first')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    args = parser.parse_args()
+    if not args.corpus or not args.pages:
+        parser.error('--corpus and --pages (or RECIPE_SCRAPER_CORPUS_DIR and RECIPE_SCRAPER_PAGE_STORE_DIR) are needed')
+
+    os.environ['RECIPE_SCRAPER_LEARN_STRATEGIES'] = '0'
+    os.environ.pop('RECIPE_SCRAPER_STRATEGY_PATH', None)
+    from fetcher import PageStore
+    from recipe_corpus import RecipeCorpus
+
+    corpus = RecipeCorpus(args.corpus)
+    if args.compact:
+        corpus.compact()
+    results = reextract(corpus, PageStore(args.pages), args.limit)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    print_report(results, args.show)
+
+
+if __name__ == '__main__':
+    main()
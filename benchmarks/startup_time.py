@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold start of the API the way a host that scales to zero sees it: a fresh interpreter importing the app, building
+# it and answering the first request, then the first scrape (which imports the scraping stack). Every run is a new
+# process. Run from the repo root:
+#   python benchmarks/startup_time.py --runs 10
+#   python benchmarks/startup_time.py --importtime   (slowest imports of one start)
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+recipe_page = '''<html><body><h1 class="entry-title">Startup Stew</h1><p>Servings: 4</p>
+<ul><li class="recipe-ingredient">2 cups water</li><li class="recipe-ingredient">1 lb chicken</li></ul>
+<ol><li class="recipe-instruction">Heat the water.</li><li class="recipe-instruction">Simmer and serve.</li></ol>
+</body></html>'''
+
+# runs in the fresh process, prints the timings as JSON
+startup_script = '''
+import json, os, sys, time
+start_time = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+flask_app = app_module.create_app() if hasattr(app_module, 'create_app') else app_module.app
+client = flask_app.test_client()
+client.post('/health-check')
+first_response = time.perf_counter()
+from scraper import extract_recipe
+extract_recipe(sys.argv[1].encode(), 'https://example.com/startup-stew')
+first_scrape = time.perf_counter()
+print(json.dumps({'import': imported - start_time, 'first_response': first_response - start_time, 'first_scrape': first_scrape - start_time}))
+os._exit(0)
+'''
+
+
+def run_once(repo_dir, env):
+    output = subprocess.run([sys.executable, '-c', startup_script, recipe_page], cwd=repo_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(repo_dir, env, count):
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=repo_dir, env=env,
+                            capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # only what app.py imports itself, their cumulative time includes everything they import
+        if name.startswith('   ') and not name.startswith('    '):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repo', default=root_dir, help='checkout whose app is started')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true', help='also list the slowest imports of app.py')
+    args = parser.parse_args()
+
+    env = dict(os.environ, RECIPE_SCRAPER_USERNAME='startup', RECIPE_SCRAPER_PASSWORD='startup')
+    runs = [run_once(args.repo, env) for _ in range(args.runs)]
+
+    print('{:<16} {:>10} {:>10}'.format('', 'median ms', 'max ms'))
+    for key in ('import', 'first_response', 'first_scrape'):
+        values = [run[key] * 1000 for run in runs]
+        print('{:<16} {:>10.1f} {:>10.1f}'.format(key, statistics.median(values), max(values)))
+
+    if args.importtime:
+        print()
+        for milliseconds, name in slowest_imports(args.repo, env, 15):
+            print('{:>8.1f} ms  {}'.format(milliseconds, name))
+
+
+if __name__ == '__main__':
+    main()
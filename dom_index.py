@@ -0,0 +1,182 @@
+import logging
+import os
+import re
+import time
+
+from bs4 import NavigableString, CData, Tag
+
+from metrics import traversal_budget_exhausted
+
+# Walks the soup once and sorts out every element that any of the extraction heuristics might look at
+# (title headings, labelled steps/ingredients, section headings and serving size candidates),
+# so the heuristics don't each have to find_all() their way through the whole page again.
+
+title_label_pattern = re.compile(r'title|heading', re.I)
+step_label_pattern = re.compile(r'instruction|direction|step', re.I)
+ingredient_label_pattern = re.compile(r'ingredient', re.I)
+serving_keywords = ['serves', 'servings', 'yield', 'serving']
+
+heading_tags = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+serving_candidate_tags = {'p', 'span', 'em', 'div'}
+
+# strings that count towards an element's .text (script/style contents and comments don't)
+text_string_types = (NavigableString, CData)
+
+# How much of the page the fallback heuristics (walking forward from a heading or a serving size candidate) may look at
+# for one recipe. Pathological pages give up with "not found" instead of spending seconds of CPU on it
+DEFAULT_MAX_NODES = 100000
+DEFAULT_MAX_TEXT = 2000000
+DEFAULT_TRAVERSAL_TIMEOUT = 2
+
+
+class TraversalBudget:
+    def __init__(self, max_nodes=DEFAULT_MAX_NODES, max_text=DEFAULT_MAX_TEXT, timeout=DEFAULT_TRAVERSAL_TIMEOUT):
+        self.nodes_left = max_nodes
+        self.text_left = max_text
+        self.deadline = time.monotonic() + timeout
+        self.exhausted = None  # which limit ran out
+
+    # one more element visited, False once the budget is used up
+    def visit(self):
+        if self.exhausted:
+            return False
+        self.nodes_left -= 1
+        if self.nodes_left < 0:
+            self._exhaust('nodes')
+        # looking at the clock every time would cost more than visiting the element
+        elif self.nodes_left % 256 == 0 and time.monotonic() > self.deadline:
+            self._exhaust('deadline')
+        return not self.exhausted
+
+    # text of that length inspected, False once the budget is used up
+    def read(self, length):
+        if self.exhausted:
+            return False
+        self.text_left -= length
+        if self.text_left < 0:
+            self._exhaust('text')
+        return not self.exhausted
+
+    def _exhaust(self, limit):
+        self.exhausted = limit
+        traversal_budget_exhausted.inc(limit)
+        logging.warning("Traversal budget ran out ({}), giving up on the rest of the fallback heuristics".format(limit))
+
+
+def create_traversal_budget():
+    return TraversalBudget(
+        max_nodes=int(os.getenv('RECIPE_SCRAPER_TRAVERSAL_MAX_NODES', DEFAULT_MAX_NODES)),
+        max_text=int(os.getenv('RECIPE_SCRAPER_TRAVERSAL_MAX_TEXT', DEFAULT_MAX_TEXT)),
+        timeout=float(os.getenv('RECIPE_SCRAPER_TRAVERSAL_TIMEOUT', DEFAULT_TRAVERSAL_TIMEOUT)),
+    )
+
+
+# the text of the element if it's shorter than limit, without getting all the text of a big element to find out
+def short_text(element, limit):
+    parts = []
+    length = 0
+    for string in element.strings:
+        length += len(string)
+        if length >= limit:
+            return None
+        parts.append(string)
+    return ''.join(parts)
+
+
+def label_matches(pattern, value):
+    if not value:
+        return False
+    # same as bs4's attribute matching: any single class, or all of them joined together
+    if isinstance(value, list):
+        return any(pattern.search(v) for v in value) or bool(pattern.search(' '.join(value)))
+    return bool(pattern.search(value))
+
+
+class DomIndex:
+    def __init__(self, soup, budget=None):
+        self.soup = soup
+        self.budget = budget or create_traversal_budget()
+        self._texts = {}  # id(element) -> element.get_text()
+
+        # all of these are in document order, like find_all() would return them
+        self.titles_by_id = []
+        self.titles_by_class = []
+        self.steps_by_id = []
+        self.steps_by_class = []
+        self.ingredients_by_id = []
+        self.ingredients_by_class = []
+        self.ingredient_lists = []
+        self.headings = []
+        self.serving_candidates = []
+
+        self._build()
+
+    def _build(self):
+        position = {}
+        serving_elements = set()
+
+        for element in self.soup.descendants:
+            if isinstance(element, Tag):
+                position[id(element)] = len(position)
+                self._classify(element)
+            elif type(element) in text_string_types and element.parent is not None:
+                # an element's text contains a serving keyword when one of its strings does,
+                # so mark the candidate ancestors instead of getting the text of every single element
+                text = element.lower()
+                if any(keyword in text for keyword in serving_keywords):
+                    for parent in element.parents:
+                        if parent.name in serving_candidate_tags:
+                            serving_elements.add(parent)
+
+        self.serving_candidates = sorted(serving_elements, key=lambda element: position[id(element)])
+
+    # element.get_text(), worked out once per element. Empty once the budget is used up
+    def text(self, element):
+        key = id(element)
+        text = self._texts.get(key)
+        if text is None:
+            if self.budget.exhausted:
+                return ''
+            text = self._texts[key] = element.get_text()
+            self.budget.read(len(text))
+        return text
+
+    # the elements after element in document order (its descendants first), like calling find_next() over and over,
+    # until the budget is used up
+    def elements_after(self, element):
+        for following in element.next_elements:
+            if isinstance(following, Tag):
+                if not self.budget.visit():
+                    return
+                yield following
+
+    def _classify(self, element):
+        name = element.name
+        element_id = element.get('id')
+        element_class = element.get('class')
+
+        if name in heading_tags:
+            self.headings.append(element)
+            if name in ('h1', 'h2'):
+                if label_matches(title_label_pattern, element_id):
+                    self.titles_by_id.append(element)
+                if label_matches(title_label_pattern, element_class):
+                    self.titles_by_class.append(element)
+        elif name == 'li':
+            if label_matches(step_label_pattern, element_id):
+                self.steps_by_id.append(element)
+            if label_matches(ingredient_label_pattern, element_id):
+                self.ingredients_by_id.append(element)
+
+        if name in ('p', 'li'):
+            if label_matches(step_label_pattern, element_class):
+                self.steps_by_class.append(element)
+            if label_matches(ingredient_label_pattern, element_class):
+                self.ingredients_by_class.append(element)
+        elif name in ('ol', 'ul', 'div'):
+            if label_matches(ingredient_label_pattern, element_class):
+                self.ingredient_lists.append(element)
+
+
+def build_dom_index(soup, budget=None):
+    return DomIndex(soup, budget)
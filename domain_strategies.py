@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# Remembers, per website, which extraction method found the steps/ingredients of its recipes last time and the CSS
+# selectors of the lists they were in. Recipe sites use the same template for every recipe, so the next page of the
+# same site can go straight to those lists instead of trying every method (and walking the page from every heading).
+# A learned strategy that finds nothing falls back to the full cascade, which learns the new one. Selectors are only
+# learned when they select exactly the lists the method found, and how many that was is kept with them (the shape of
+# the page): a later page where they select a different number of lists isn't trusted to them either.
+
+# class/id names with digits in them are usually generated per recipe (eg. wprm-recipe-container-1234)
+stable_name_pattern = re.compile(r'[A-Za-z_-]+')
+MAX_SELECTOR_DEPTH = 4
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_REFRESH_SECONDS = 60
+
+
+def recipe_domain(recipe_url):
+    host = (urlparse(recipe_url or '').hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+# CSS selector for an element, from its closest ancestor with a stable id down to the element, eg. "div.recipe-ingredients > ul"
+# None when nothing along the way has a stable id or class, a selector of bare tag names would match anything
+def css_selector(element):
+    parts = []
+    labelled = False
+    node = element
+    while node is not None and node.name != '[document]' and len(parts) <= MAX_SELECTOR_DEPTH:
+        node_id = node.get('id')
+        if isinstance(node_id, str) and stable_name_pattern.fullmatch(node_id):
+            parts.append('{}#{}'.format(node.name, node_id))
+            labelled = True
+            break
+        classes = [name for name in node.get('class') or [] if stable_name_pattern.fullmatch(name)]
+        parts.append(node.name + ''.join('.' + name for name in classes))
+        labelled = labelled or bool(classes)
+        node = node.parent
+    return ' > '.join(reversed(parts)) if labelled else None
+
+
+# domain -> field -> {'method', 'selectors', 'lists', 'learned_at'}, kept in memory and optionally in a SQLite file that
+# every worker process shares (RECIPE_SCRAPER_STRATEGY_PATH) so strategies survive restarts and can be looked at.
+# The in-memory copy keeps the max_domains most recently used websites and, with the SQLite file, reloads a website
+# after refresh_seconds to pick up what the other workers learned
+class DomainStrategies:
+    def __init__(self, path=None, max_domains=DEFAULT_CACHE_SIZE, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.path = path
+        self.max_domains = max_domains
+        self.refresh_seconds = refresh_seconds
+        self._strategies = OrderedDict()  # domain -> (loaded_at, {field: strategy}), least recently used first
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if path:
+            with self._connect() as conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS strategies (domain TEXT, field TEXT, method TEXT, selectors TEXT, '
+                             'learned_at REAL, PRIMARY KEY (domain, field))')
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(strategies)')]
+                if 'lists' not in columns:
+                    # files from before the list count was kept, their selectors miss once and are learned again
+                    conn.execute('ALTER TABLE strategies ADD COLUMN lists INTEGER')
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def _load(self, domain):
+        strategies = {}
+        if self.path:
+            rows = self._connect().execute('SELECT field, method, selectors, lists, learned_at FROM strategies WHERE domain = ?', (domain,))
+            for field, method, selectors, lists, learned_at in rows:
+                strategies[field] = {'method': method, 'selectors': json.loads(selectors), 'lists': lists, 'learned_at': learned_at}
+        return strategies
+
+    def _put(self, domain, loaded_at, strategies):
+        self._strategies[domain] = (loaded_at, strategies)
+        self._strategies.move_to_end(domain)
+        while len(self._strategies) > self.max_domains:
+            self._strategies.popitem(last=False)
+
+    # field -> strategy of everything known about the website
+    def for_domain(self, domain):
+        if not domain:
+            return {}
+        now = time.monotonic()
+        with self._lock:
+            entry = self._strategies.get(domain)
+            if entry is not None and (not self.path or now - entry[0] < self.refresh_seconds):
+                self._strategies.move_to_end(domain)
+                return dict(entry[1])
+        if not self.path:
+            return {}
+        strategies = self._load(domain)
+        with self._lock:
+            self._put(domain, now, strategies)
+        return dict(strategies)
+
+    def get(self, domain, field):
+        return self.for_domain(domain).get(field)
+
+    # What a parse worker process is given to extract a page with (see parse_pool.py), only kept in memory
+    def set_domain(self, domain, strategies):
+        with self._lock:
+            self._put(domain, time.monotonic(), dict(strategies))
+
+    # lists is how many lists the selectors matched on the page they were learned on
+    def learn(self, domain, field, method, selectors=None, lists=None):
+        if not domain:
+            return
+        strategy = {'method': method, 'selectors': selectors or [], 'lists': lists if selectors else None, 'learned_at': time.time()}
+        current = self.get(domain, field)
+        if current is not None and (current['method'], current['selectors'], current.get('lists')) == (method, strategy['selectors'], strategy['lists']):
+            return
+        with self._lock:
+            entry = self._strategies.get(domain)
+            strategies = dict(entry[1]) if entry is not None else {}
+            strategies[field] = strategy
+            self._put(domain, entry[0] if entry is not None else time.monotonic(), strategies)
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('INSERT OR REPLACE INTO strategies (domain, field, method, selectors, lists, learned_at) VALUES (?, ?, ?, ?, ?, ?)',
+                             (domain, field, method, json.dumps(strategy['selectors']), strategy['lists'], strategy['learned_at']))
+
+    # everything that has been learned, for the /domain-strategies endpoint
+    def all(self):
+        if self.path:
+            strategies = {}
+            rows = self._connect().execute('SELECT domain, field, method, selectors, lists, learned_at FROM strategies ORDER BY domain, field')
+            for domain, field, method, selectors, lists, learned_at in rows:
+                strategies.setdefault(domain, {})[field] = {'method': method, 'selectors': json.loads(selectors), 'lists': lists, 'learned_at': learned_at}
+            return strategies
+        with self._lock:
+            return {domain: dict(fields) for domain, (_, fields) in sorted(self._strategies.items()) if fields}
+
+
+# RECIPE_SCRAPER_LEARN_STRATEGIES=0 always runs the full cascade
+def create_domain_strategies():
+    if os.getenv('RECIPE_SCRAPER_LEARN_STRATEGIES', '1') == '0':
+        return None
+    return DomainStrategies(
+        os.getenv('RECIPE_SCRAPER_STRATEGY_PATH') or None,
+        max_domains=int(os.getenv('RECIPE_SCRAPER_STRATEGY_CACHE_SIZE', DEFAULT_CACHE_SIZE)),
+        refresh_seconds=float(os.getenv('RECIPE_SCRAPER_STRATEGY_REFRESH', DEFAULT_REFRESH_SECONDS)),
+    )
+
+
+# the one every extraction in this process shares, created when it's first needed
+@lru_cache(maxsize=None)
+def get_domain_strategies():
+    return create_domain_strategies()
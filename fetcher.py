@@ -0,0 +1,438 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from scrape_cache import normalize_url
+from recipe_scanner import RecipeScanner
+from metrics import stage_seconds, upstream_early_stops, upstream_responses, upstream_bytes
+
+# Fetch layer for recipe pages. All fetches go through a shared client with pooled keep-alive connections,
+# timeouts, retries, a response size limit and a cap on concurrent requests per host.
+# Pages are read in chunks and the download stops as soon as the recipe is in (see recipe_scanner), so the comments
+# and ads after it are never downloaded or kept in memory. Only pages that go over the size limit before that fail.
+# Raw HTML is kept (gzipped) on disk together with the ETag/Last-Modified validators
+# so that refreshing a recipe can be a conditional request, and a 304 skips both the download and the re-extraction.
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 15
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_RESPONSE_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_POOL_SIZE = 32
+DEFAULT_HOST_WAIT_TIMEOUT = 30
+DEFAULT_ASYNC_FALLBACK_THREADS = 256
+CHUNK_SIZE = 64 * 1024
+
+retry_status_codes = [429, 500, 502, 503, 504]
+
+
+# Subclasses of requests.RequestException so callers only have one kind of fetch error to handle
+class FetchError(requests.RequestException):
+    pass
+
+
+class ResponseTooLarge(FetchError):
+    pass
+
+
+class HostBusy(FetchError):
+    pass
+
+
+def get_host(url):
+    return urlsplit(url).netloc.lower()
+
+
+class FetchClient:
+    def __init__(self, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_response_bytes=DEFAULT_MAX_RESPONSE_BYTES, max_per_host=DEFAULT_MAX_PER_HOST,
+                 pool_size=DEFAULT_POOL_SIZE, host_wait_timeout=DEFAULT_HOST_WAIT_TIMEOUT, early_stop=True):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_response_bytes = max_response_bytes
+        self.max_per_host = max_per_host
+        self.pool_size = pool_size
+        self.host_wait_timeout = host_wait_timeout
+        self.early_stop = early_stop
+
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                      status_forcelist=retry_status_codes, allowed_methods=['GET', 'HEAD'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _host_semaphore(self, host):
+        with self._lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def get(self, url, headers=None):
+        semaphore = self._host_semaphore(get_host(url))
+        if not semaphore.acquire(timeout=self.host_wait_timeout):
+            raise HostBusy('Too many concurrent requests to {}'.format(get_host(url)))
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+            try:
+                response._content = self._read_body(response)
+            finally:
+                response.close()
+            return response
+        finally:
+            semaphore.release()
+
+    def create_scanner(self, status_code):
+        # error pages are read whole, there's no recipe to wait for
+        return RecipeScanner() if self.early_stop and status_code == 200 else None
+
+    def _read_body(self, response):
+        scanner = self.create_scanner(response.status_code)
+        # a page that's too big might still have the whole recipe before the limit
+        content_length = response.headers.get('Content-Length')
+        if scanner is None and content_length and content_length.isdigit() and int(content_length) > self.max_response_bytes:
+            raise ResponseTooLarge('Response is larger than {} bytes'.format(self.max_response_bytes), response=response)
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                raise ResponseTooLarge('Response is larger than {} bytes'.format(self.max_response_bytes), response=response)
+            chunks.append(chunk)
+            if scanner is not None and scanner.feed(chunk):
+                # closing the response drops the rest of it (and the connection with it)
+                response.early_stop = scanner.reason
+                break
+        return b''.join(chunks)
+
+
+# Response returned by AsyncFetchClient, with the same attributes fetch_page uses on a requests.Response
+class AsyncResponse:
+    def __init__(self, url, status_code, headers, content, early_stop=None):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.early_stop = early_stop
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FetchError('{} Error for url: {}'.format(self.status_code, self.url))
+
+
+# Same limits as FetchClient for asyncio code. Uses httpx when it's installed, otherwise runs the
+# blocking FetchClient on its own pool of fallback_threads threads (the loop's default executor only has a few dozen,
+# which would cap how many pages can be fetched at once) so that callers don't have to care which one they got.
+class AsyncFetchClient:
+    def __init__(self, sync_client, fallback_threads=DEFAULT_ASYNC_FALLBACK_THREADS):
+        self.sync_client = sync_client
+        self.fallback_threads = fallback_threads
+        self._host_semaphores = {}
+        self._client = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._httpx = None  # the httpx module, False when it isn't installed
+
+    def _host_semaphore(self, host):
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.sync_client.max_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    # httpx is imported by the first fetch, a WSGI worker never needs it
+    def _import_httpx(self):
+        if self._httpx is None:
+            try:
+                import httpx
+            except ImportError:
+                httpx = False
+            self._httpx = httpx
+        return self._httpx
+
+    async def get(self, url, headers=None):
+        if not self._import_httpx():
+            return await asyncio.get_running_loop().run_in_executor(self._fallback_executor(), self.sync_client.get, url, headers)
+
+        semaphore = self._host_semaphore(get_host(url))
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.sync_client.host_wait_timeout)
+        except asyncio.TimeoutError:
+            raise HostBusy('Too many concurrent requests to {}'.format(get_host(url)))
+        try:
+            return await self._get_with_retries(url, headers)
+        finally:
+            semaphore.release()
+
+    def _fallback_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.fallback_threads, thread_name_prefix='async-fetch')
+            return self._executor
+
+    async def _get_with_retries(self, url, headers):
+        httpx = self._httpx
+        if self._client is None:
+            connect_timeout, read_timeout = self.sync_client.timeout
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.sync_client.pool_size, max_keepalive_connections=self.sync_client.pool_size),
+                follow_redirects=True,
+            )
+
+        # every httpx error comes out as a FetchError, like the requests ones of FetchClient do, so the callers answer
+        # "Failed to fetch" for all of them. Only network errors are retried
+        attempt = 0
+        while True:
+            try:
+                response = await self._read(url, headers)
+                if response.status_code not in retry_status_codes or attempt >= self.sync_client.retries:
+                    return response
+            except httpx.UnsupportedProtocol as e:
+                raise FetchError(str(e))
+            except httpx.TransportError as e:
+                if attempt >= self.sync_client.retries:
+                    raise FetchError(str(e))
+            except (httpx.HTTPError, httpx.InvalidURL) as e:
+                raise FetchError(str(e))
+            await asyncio.sleep(self.sync_client.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def _read(self, url, headers):
+        max_bytes = self.sync_client.max_response_bytes
+        async with self._client.stream('GET', url, headers=headers) as response:
+            scanner = self.sync_client.create_scanner(response.status_code)
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ResponseTooLarge('Response is larger than {} bytes'.format(max_bytes))
+                chunks.append(chunk)
+                if scanner is not None and scanner.feed(chunk):
+                    break
+            early_stop = scanner.reason if scanner is not None else None
+            return AsyncResponse(str(response.url), response.status_code, response.headers, b''.join(chunks), early_stop)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class FetchedPage:
+    def __init__(self, url, content, status_code, not_modified=False, recipe=None):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.not_modified = not_modified
+        self.recipe = recipe  # extraction result saved for this exact content, if any
+        self.fetch_seconds = None  # how long fetch_page took
+
+
+class PageStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url, extension):
+        key = hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + extension)
+
+    # Returns the metadata of a stored page (url, etag, last_modified, fetched_at, size, truncated, recipe). truncated
+    # is what the download was stopped early on ('json_ld' or 'lists'), the stored content is then only the start of the page
+    def get(self, url):
+        try:
+            with open(self._path(url, '.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('url') == normalize_url(url) else None
+
+    def get_content(self, url):
+        try:
+            with gzip.open(self._path(url, '.html.gz'), 'rb') as f:
+                return f.read()
+        except (OSError, EOFError):
+            return None
+
+    def save(self, url, content, etag=None, last_modified=None, truncated=None):
+        with self._lock:
+            self._write(self._path(url, '.html.gz'), gzip.compress(content, compresslevel=6))
+            self._write_meta(url, {
+                'url': normalize_url(url),
+                'etag': etag,
+                'last_modified': last_modified,
+                'fetched_at': time.time(),
+                'size': len(content),
+                'truncated': truncated,
+                'recipe': None,
+            })
+
+    # Remember what we extracted from the stored content, so that a 304 can reuse it
+    def save_recipe(self, url, recipe):
+        with self._lock:
+            meta = self.get(url)
+            if meta is None:
+                return
+            meta['recipe'] = recipe
+            self._write_meta(url, meta)
+
+    def touch(self, url):
+        with self._lock:
+            meta = self.get(url)
+            if meta is None:
+                return
+            meta['fetched_at'] = time.time()
+            self._write_meta(url, meta)
+
+    def _write_meta(self, url, meta):
+        self._write(self._path(url, '.json'), json.dumps(meta).encode('utf-8'))
+
+    @staticmethod
+    def _write(path, data):
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+def _conditional_headers(headers, stored):
+    request_headers = dict(headers)
+    if stored:
+        if stored.get('etag'):
+            request_headers['If-None-Match'] = stored['etag']
+        if stored.get('last_modified'):
+            request_headers['If-Modified-Since'] = stored['last_modified']
+    return request_headers
+
+
+# A page whose download was stopped early only has its start stored: a 304 says those bytes haven't changed, so the
+# recipe extracted from them still holds, but they aren't parsed again as if they were the whole page
+def _not_modified_page(url, response, stored, page_store):
+    if response.status_code != 304 or not stored:
+        return None
+    if stored.get('truncated') and stored.get('recipe') is None:
+        return None
+    content = page_store.get_content(url)
+    if content is None:
+        return None
+    logging.info("DEBUG: page not modified")
+    page_store.touch(url)
+    return FetchedPage(url, content, response.status_code, not_modified=True, recipe=stored.get('recipe'))
+
+
+def _count_response(response):
+    upstream_responses.inc(response.status_code)
+    upstream_bytes.inc(amount=len(response.content or b''))
+    early_stop = getattr(response, 'early_stop', None)
+    if early_stop:
+        upstream_early_stops.inc(early_stop)
+
+
+def _stored_page(url, response, page_store):
+    response.raise_for_status()
+    if page_store:
+        try:
+            page_store.save(url, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                            getattr(response, 'early_stop', None))
+        except OSError as e:
+            logging.warning("Failed to store page {}: {}".format(url, str(e)))
+    return FetchedPage(url, response.content, response.status_code)
+
+
+def fetch_page(url, headers, page_store=None, client=None):
+    start_time = time.perf_counter()
+    with stage_seconds.time('fetch'):
+        page = _fetch_page(url, headers, page_store, client or default_client)
+    page.fetch_seconds = time.perf_counter() - start_time
+    return page
+
+
+def _fetch_page(url, headers, page_store, client):
+    stored = page_store.get(url) if page_store else None
+
+    response = client.get(url, headers=_conditional_headers(headers, stored))
+    _count_response(response)
+    page = _not_modified_page(url, response, stored, page_store)
+    if page is not None:
+        return page
+    if response.status_code == 304:
+        # we lost the stored copy somehow (or only kept the start of it, with no recipe from it), so download it again
+        # without the validators
+        response = client.get(url, headers=headers)
+        _count_response(response)
+
+    return _stored_page(url, response, page_store)
+
+
+async def fetch_page_async(url, headers, page_store=None, client=None):
+    start_time = time.perf_counter()
+    with stage_seconds.time('fetch'):
+        page = await _fetch_page_async(url, headers, page_store, client or default_async_client)
+    page.fetch_seconds = time.perf_counter() - start_time
+    return page
+
+
+# the page store reads and writes files, they run on a thread so the event loop keeps serving other requests
+async def _fetch_page_async(url, headers, page_store, client):
+    stored = await asyncio.to_thread(page_store.get, url) if page_store else None
+
+    response = await client.get(url, headers=_conditional_headers(headers, stored))
+    _count_response(response)
+    page = await asyncio.to_thread(_not_modified_page, url, response, stored, page_store) if stored else None
+    if page is not None:
+        return page
+    if response.status_code == 304:
+        response = await client.get(url, headers=headers)
+        _count_response(response)
+
+    if page_store:
+        return await asyncio.to_thread(_stored_page, url, response, page_store)
+    return _stored_page(url, response, page_store)
+
+
+def create_fetch_client():
+    return FetchClient(
+        connect_timeout=float(os.getenv('RECIPE_SCRAPER_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+        read_timeout=float(os.getenv('RECIPE_SCRAPER_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)),
+        retries=int(os.getenv('RECIPE_SCRAPER_FETCH_RETRIES', DEFAULT_RETRIES)),
+        max_response_bytes=int(os.getenv('RECIPE_SCRAPER_MAX_RESPONSE_BYTES', DEFAULT_MAX_RESPONSE_BYTES)),
+        max_per_host=int(os.getenv('RECIPE_SCRAPER_MAX_PER_HOST', DEFAULT_MAX_PER_HOST)),
+        pool_size=int(os.getenv('RECIPE_SCRAPER_FETCH_POOL_SIZE', DEFAULT_POOL_SIZE)),
+        early_stop=os.getenv('RECIPE_SCRAPER_EARLY_STOP', '1') != '0',
+    )
+
+
+def create_page_store():
+    directory = os.getenv('RECIPE_SCRAPER_PAGE_STORE_DIR')
+    return PageStore(directory) if directory else None
+
+
+# Shared clients so every fetch reuses the same connection pools and per-host limits
+default_client = create_fetch_client()
+default_async_client = AsyncFetchClient(default_client, int(os.getenv('RECIPE_SCRAPER_ASYNC_FETCH_THREADS', DEFAULT_ASYNC_FALLBACK_THREADS)))
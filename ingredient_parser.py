@@ -0,0 +1,151 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+from fractions import Fraction
+
+# Parses ingredient lines like "1 ½ cups flour" or "2 to 3 tbsp. olive oil" into quantity, unit and name.
+# All the patterns and the unit lookup are built once when the module is imported, not for every line.
+
+ParsedIngredient = namedtuple('ParsedIngredient', ['low', 'high', 'unit', 'name'])
+
+# canonical unit -> every way recipes write it
+unit_variants = {
+    'g': ['g', 'gram', 'grams'],
+    'kg': ['kg', 'kilogram', 'kilograms'],
+    'mg': ['mg', 'milligram', 'milligrams'],
+    'lb': ['lb', 'lbs', 'pound', 'pounds'],
+    'oz': ['oz', 'ounce', 'ounces'],
+    'l': ['l', 'liter', 'liters', 'litre', 'litres'],
+    'ml': ['ml', 'milliliter', 'milliliters', 'millilitre', 'millilitres'],
+    'tsp': ['tsp', 'teaspoon', 'teaspoons'],
+    'tbsp': ['tbsp', 'tb', 'tablespoon', 'tablespoons'],
+    'cup': ['cup'],
+    'cups': ['cups'],
+    'cm': ['cm', 'centimeter', 'centimeters', 'centimetre', 'centimetres'],
+    'fl oz': ['fl oz', 'fluid ounce', 'fluid ounces'],
+    'clove': ['clove'],
+    'cloves': ['cloves'],
+    'can': ['can'],
+    'tin': ['tin'],
+    'jar': ['jar'],
+}
+
+
+# Trie over the (lowercase) words of the units, so multi word units like "fluid ounces" are matched as well
+def build_unit_trie(variants):
+    trie = {}
+    for unit, spellings in variants.items():
+        for spelling in spellings:
+            node = trie
+            for word in spelling.split():
+                node = node.setdefault(word, {})
+            node[None] = unit
+    return trie
+
+
+unit_trie = build_unit_trie(unit_variants)
+
+
+# for units added from the units file (see units.py)
+def add_unit_spellings(unit, spellings):
+    unit_variants.setdefault(unit, []).extend(spellings)
+    for spelling in spellings:
+        node = unit_trie
+        for word in spelling.lower().split():
+            node = node.setdefault(word, {})
+        node[None] = unit
+
+vulgar_fractions = {
+    '½': '1/2', '⅓': '1/3', '⅔': '2/3', '¼': '1/4', '¾': '3/4', '⅕': '1/5', '⅖': '2/5', '⅗': '3/5', '⅘': '4/5',
+    '⅙': '1/6', '⅚': '5/6', '⅛': '1/8', '⅜': '3/8', '⅝': '5/8', '⅞': '7/8',
+}
+vulgar_fraction_pattern = re.compile(r'(\d)?\s*([{}])'.format(''.join(vulgar_fractions)))
+dash_pattern = re.compile(r'[‐‑‒–—−]')
+
+number = r'\d+\s+\d+\s*/\s*\d+|\d+\s*/\s*\d+|\d+(?:\.\d+)?|\.\d+'
+quantity_pattern = re.compile(r'\s*(?P<low>{0})(?:\s*(?:-|to\b)\s*(?P<high>{0}))?\s*'.format(number), re.I)
+slash_pattern = re.compile(r'\s*/\s*')
+# a whole word (so "g" never matches the start of "garlic") and the dot of abbreviations like "tbsp."
+word_pattern = re.compile(r'\s*([A-Za-z]+)(?:\s*\.)?')
+
+# fractions that read better than decimals in a recipe
+display_fractions = {Fraction(1, 2): '1/2', Fraction(1, 4): '1/4', Fraction(3, 4): '3/4', Fraction(1, 8): '1/8', Fraction(2, 3): '2/3'}
+
+
+def replace_vulgar_fraction(match):
+    whole = match.group(1)
+    fraction = vulgar_fractions[match.group(2)]
+    return '{} {}'.format(whole, fraction) if whole else fraction
+
+
+# "1 1/2" -> Fraction(3, 2). Recipes keep using the same few quantities, so the parsed ones are kept around
+@lru_cache(maxsize=1024)
+def parse_number(text):
+    if text.isdigit():
+        return Fraction(int(text))
+    return sum((Fraction(part) for part in slash_pattern.sub('/', text).split()), Fraction(0))
+
+
+def match_unit(text, position):
+    node = unit_trie
+    unit = None
+    end = position
+    while True:
+        match = word_pattern.match(text, position)
+        if match is None:
+            break
+        node = node.get(match.group(1).lower())
+        if node is None:
+            break
+        position = match.end()
+        if None in node:
+            unit = node[None]
+            end = position
+    return unit, end
+
+
+def parse_ingredient(line):
+    text = line
+    # vulgar fractions, fraction slashes and fancy dashes are all outside of ascii
+    if not text.isascii():
+        text = dash_pattern.sub('-', vulgar_fraction_pattern.sub(replace_vulgar_fraction, text)).replace('⁄', '/')
+
+    low = high = None
+    position = 0
+    match = quantity_pattern.match(text)
+    if match:
+        try:
+            low_text, high_text = match.groups()
+            low = parse_number(low_text)
+            high = parse_number(high_text) if high_text else None
+            position = match.end()
+        except ZeroDivisionError:
+            low = high = None
+
+    unit, position = match_unit(text, position)
+    name = text[position:].strip()
+    return ParsedIngredient(low, high, unit, name or None)
+
+
+def format_number(value):
+    return format_ratio(value.numerator, value.denominator)
+
+
+# cached on the plain ints, hashing a Fraction costs more than formatting it
+@lru_cache(maxsize=1024)
+def format_ratio(numerator, denominator):
+    whole, remainder = divmod(numerator, denominator)
+    if remainder == 0:
+        return str(whole)
+    fraction = Fraction(remainder, denominator)
+    if fraction in display_fractions:
+        return '{} {}'.format(whole, display_fractions[fraction]) if whole else display_fractions[fraction]
+    return '{:.2f}'.format(numerator / denominator).rstrip('0').rstrip('.')
+
+
+def format_quantity(low, high=None):
+    if low is None:
+        return None
+    if high is not None:
+        return '{}-{}'.format(format_number(low), format_number(high))
+    return format_number(low)
@@ -0,0 +1,88 @@
+from fractions import Fraction
+
+from ingredient_parser import parse_ingredient, format_quantity
+
+# The ingredients of a recipe as columns (low quantity, high quantity, unit, name) instead of a list of string rows.
+# Quantities are parsed once at scrape time and stay numbers from then on: Fractions while they're exact (scaling keeps
+# them exact, 1/3 cup for 2 servings is 2/3 cup for 4), floats once they've been converted to another unit.
+# They're only formatted back to strings for the response.
+
+
+class IngredientTable:
+    __slots__ = ('low', 'high', 'units', 'names')
+
+    def __init__(self, low, high, units, names):
+        self.low = low
+        self.high = high
+        self.units = units
+        self.names = names
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_parsed(cls, parsed_ingredients):
+        parsed_ingredients = list(parsed_ingredients)
+        return cls(
+            [parsed.low for parsed in parsed_ingredients],
+            [parsed.high for parsed in parsed_ingredients],
+            [parsed.unit for parsed in parsed_ingredients],
+            [parsed.name for parsed in parsed_ingredients],
+        )
+
+    # recipes that were cached before the table existed only have the formatted [quantity, unit, name] rows
+    @classmethod
+    def from_rows(cls, rows):
+        return cls.from_parsed(parse_ingredient(' '.join(str(part) for part in row if part)) for row in rows)
+
+    # JSON friendly form for the recipe store and the caches, exact quantities are kept as [numerator, denominator]
+    def to_json(self):
+        return {
+            'low': [encode_quantity(q) for q in self.low],
+            'high': [encode_quantity(q) for q in self.high],
+            'units': self.units,
+            'names': self.names,
+        }
+
+    @classmethod
+    def from_json(cls, columns):
+        return cls(
+            [decode_quantity(q) for q in columns['low']],
+            [decode_quantity(q) for q in columns['high']],
+            columns['units'],
+            columns['names'],
+        )
+
+    def scaled(self, factor):
+        if factor == 1:
+            return self
+        return IngredientTable(
+            [q * factor if q is not None else None for q in self.low],
+            [q * factor if q is not None else None for q in self.high],
+            self.units,
+            self.names,
+        )
+
+    def rows(self):
+        return [[format_row_quantity(low, high), unit, name] for low, high, unit, name in zip(self.low, self.high, self.units, self.names)]
+
+
+def encode_quantity(quantity):
+    if isinstance(quantity, Fraction):
+        return [quantity.numerator, quantity.denominator]
+    return quantity
+
+
+def decode_quantity(quantity):
+    if isinstance(quantity, list):
+        return Fraction(quantity[0], quantity[1])
+    return quantity
+
+
+def format_row_quantity(low, high):
+    if low is None or isinstance(low, Fraction):
+        return format_quantity(low, high)
+    # converted quantities, same format the unit conversion always had
+    if high is not None:
+        return '{}-{}'.format(round(low, 2), round(high, 2))
+    return round(low, 2)
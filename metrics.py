@@ -0,0 +1,157 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal in-process metrics (counters and histograms) rendered in the Prometheus text format on /metrics,
+# so slow scrapes can be broken down into fetch/parse/extraction stages without pulling in prometheus_client.
+# Every worker process has its own numbers, Prometheus sums them up when each worker is scraped on its own port,
+# otherwise they're per worker like the scrape cache stats.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_local = threading.local()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _record(self, value, labelvalues):
+        labelvalues = tuple(str(label) for label in labelvalues)
+        # inside deferred() the values are collected to be applied elsewhere (eg. by the parent of a worker process)
+        events = getattr(_local, 'events', None)
+        if events is not None:
+            events.append((self.name, value, labelvalues))
+            return
+        with self._lock:
+            self._apply(value, labelvalues)
+
+    def _labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in pairs) + '}'
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            lines += self._samples()
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        self._record(amount, labelvalues)
+
+    def _apply(self, amount, labelvalues):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def _samples(self):
+        return ['{}{} {}'.format(self.name, self._labels(labels), format_value(value)) for labels, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, *labelvalues):
+        self._record(seconds, labelvalues)
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *labelvalues)
+
+    def _apply(self, seconds, labelvalues):
+        values = self._values.get(labelvalues)
+        if values is None:
+            # one count per bucket, then the sum and the total count
+            values = self._values[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+    def _samples(self):
+        lines = []
+        for labels, values in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append('{}_bucket{} {}'.format(self.name, self._labels(labels, [('le', format_value(bound))]), count))
+            lines.append('{}_bucket{} {}'.format(self.name, self._labels(labels, [('le', '+Inf')]), values[-1]))
+            lines.append('{}_sum{} {}'.format(self.name, self._labels(labels), format_value(values[-2])))
+            lines.append('{}_count{} {}'.format(self.name, self._labels(labels), values[-1]))
+        return lines
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = []
+# callbacks returning extra metric lines (eg. counters another component already keeps)
+collectors = []
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    for collector in collectors:
+        lines += collector()
+    return '\n'.join(lines) + '\n'
+
+
+# Collects everything recorded by this thread instead of applying it, see replay()
+@contextmanager
+def deferred():
+    events = []
+    outer_events = getattr(_local, 'events', None)
+    _local.events = events
+    try:
+        yield events
+    finally:
+        _local.events = outer_events
+
+
+def replay(events):
+    # inside deferred() they're collected again (eg. a worker process' events for whoever is watching the whole scrape)
+    outer_events = getattr(_local, 'events', None)
+    if outer_events is not None:
+        outer_events.extend(events)
+        return
+    metrics = {metric.name: metric for metric in registry}
+    for name, value, labelvalues in events:
+        metric = metrics.get(name)
+        if metric is not None:
+            with metric._lock:
+                metric._apply(value, labelvalues)
+
+
+stage_seconds = Histogram('recipe_scraper_stage_seconds', 'Time spent in each stage of a scrape', ['stage'])
+conversion_seconds = Histogram('recipe_scraper_conversion_seconds', 'Time spent scaling/converting ingredients', ['method'])
+extraction_methods = Counter('recipe_scraper_extraction_method_total', 'Which extraction method produced each field', ['field', 'method'])
+strategy_lookups = Counter('recipe_scraper_domain_strategy_total', 'Learned per-website extraction strategies that found the field (hit) or not (miss)', ['field', 'result'])
+traversal_budget_exhausted = Counter('recipe_scraper_traversal_budget_exhausted_total', 'Extractions that gave up on the fallback heuristics, by the limit that ran out', ['limit'])
+upstream_responses = Counter('recipe_scraper_upstream_responses_total', 'Responses from recipe websites by status code', ['status'])
+upstream_bytes = Counter('recipe_scraper_upstream_bytes_total', 'Bytes downloaded from recipe websites')
+upstream_early_stops = Counter('recipe_scraper_upstream_early_stop_total', 'Page downloads stopped as soon as the recipe was in, by what it was found in', ['found'])
@@ -0,0 +1,71 @@
+import logging
+import os
+import re
+
+from bs4 import BeautifulSoup
+
+# Builds the soup the extraction heuristics run on. Uses lxml as the tree builder when it's installed (much faster and
+# lighter than the pure python html.parser), and prunes everything that can never be part of a recipe before parsing
+# (scripts, styles, svgs, comments, navigation, footers, ads and comment sections) so the tree is a lot smaller.
+# Pruning uses selectolax (lexbor) when it's installed, otherwise a few regexes over the raw bytes.
+
+try:
+    import lxml  # noqa: F401
+    lxml_available = True
+except ImportError:
+    lxml_available = False
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# the JSON-LD scripts are kept, they hold the schema.org Recipe on a lot of sites
+prune_selectors = ', '.join([
+    'script:not([type="application/ld+json"])', 'style', 'svg', 'noscript', 'iframe', 'template', 'nav', 'footer',
+    '#comments', '#respond', '.comments-area', '.comment-list', '.commentlist', '.comments',
+    '.adsbygoogle', '.advertisement', '.ad-container', '.ad-wrapper', '[id^="google_ads"]', '[class*="adthrive"]',
+])
+
+comment_pattern = re.compile(rb'<!--.*?-->', re.S)
+pruned_tags_pattern = re.compile(rb'<(style|svg|noscript|iframe|template|nav|footer)\b[^>]*>.*?</\1\s*>', re.I | re.S)
+script_pattern = re.compile(rb'<script\b([^>]*)>.*?</script\s*>', re.I | re.S)
+
+
+def get_parser_name():
+    parser = os.getenv('RECIPE_SCRAPER_HTML_PARSER', 'auto')
+    if parser == 'auto':
+        return 'lxml' if lxml_available else 'html.parser'
+    return parser
+
+
+def keep_json_ld(match):
+    return match.group(0) if b'ld+json' in match.group(1).lower() else b''
+
+
+def prune_html(content):
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(content)
+        for node in tree.css(prune_selectors):
+            node.decompose()
+        comments = [node for node in tree.root.traverse(include_text=False) if node.tag == '-comment']
+        for node in comments:
+            node.decompose()
+        return tree.html or ''
+
+    # without selectolax only what can safely be cut out of the raw html goes
+    content = comment_pattern.sub(b'', content)
+    content = script_pattern.sub(keep_json_ld, content)
+    return pruned_tags_pattern.sub(b'', content)
+
+
+def make_soup(content, prune=None):
+    if prune is None:
+        prune = os.getenv('RECIPE_SCRAPER_PRUNE_HTML', '1') != '0'
+    if prune:
+        try:
+            content = prune_html(content)
+        except Exception as e:
+            # a page we can't prune can still be parsed as it is
+            logging.warning("Failed to prune html: {}".format(str(e)))
+    return BeautifulSoup(content, get_parser_name())
@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from domain_strategies import get_domain_strategies, recipe_domain
+
+# Runs the CPU heavy part of a scrape (parsing + extraction) in a pool of worker processes, so that it doesn't hold
+# the GIL of the web worker and health checks/unit conversions don't have to wait behind it.
+# Workers get the raw page bytes and send back the plain recipe dict, along with the metrics recorded while extracting
+# so they show up on the /metrics of the web worker. The web worker keeps the per-website extraction strategies: it
+# sends the website's strategies along with the page and learns what the worker learned from it, so /domain-strategies,
+# the SQLite file and the corpus warm start all see them.
+
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_TASK_TIMEOUT = 10
+DEFAULT_QUEUE_TIMEOUT = 5
+
+
+class ParsePoolBusy(RuntimeError):
+    pass
+
+
+class ParseTimeout(RuntimeError):
+    pass
+
+
+# Raised by the alarm inside the worker. It's a BaseException so that no `except Exception` in the extraction code
+# swallows it, run_extraction turns it into a ParseTimeout
+class ExtractionDeadline(BaseException):
+    pass
+
+
+def raise_extraction_deadline(signum, frame):
+    raise ExtractionDeadline()
+
+
+# Runs in the worker process when it starts: tells the pool its PID (so a stuck worker can be killed) and keeps the
+# strategies it's given in memory only
+def init_worker(worker_pids):
+    worker_pids.put(os.getpid())
+    os.environ.pop('RECIPE_SCRAPER_STRATEGY_PATH', None)
+
+
+# Runs inside the worker process, strategies are the website's learned strategies (None when learning is off)
+def run_extraction(content, recipe_url, timeout, strategies=None):
+    # stop the extraction from inside the worker, the process stays alive for the next task
+    use_alarm = hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, raise_extraction_deadline)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    # only the workers need the scraping stack (bs4 etc), the web worker starts faster without it
+    import scraper
+
+    domain = recipe_domain(recipe_url)
+    domain_strategies = get_domain_strategies() if strategies is not None else None
+    if domain_strategies is not None:
+        domain_strategies.set_domain(domain, strategies)
+    try:
+        with metrics.deferred() as events:
+            recipe = scraper.extract_recipe(content, recipe_url)
+        learned = None
+        if domain_strategies is not None:
+            learned = {field: strategy for field, strategy in domain_strategies.for_domain(domain).items() if strategy != strategies.get(field)}
+        return recipe, events, learned
+    except ExtractionDeadline:
+        raise ParseTimeout('Extraction took too long')
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ParsePool:
+    def __init__(self, max_workers=None, queue_size=DEFAULT_QUEUE_SIZE, task_timeout=DEFAULT_TASK_TIMEOUT, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.task_timeout = task_timeout
+        self.queue_timeout = queue_timeout
+        # workers + the tasks allowed to wait for one, anything beyond that is turned away
+        self._slots = threading.BoundedSemaphore(self.max_workers + queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._worker_pids = None  # the workers of _executor put their PID on it when they start
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn instead of fork, forking a process that has threads running isn't safe
+                context = multiprocessing.get_context('spawn')
+                self._worker_pids = context.SimpleQueue()
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                     initializer=init_worker, initargs=(self._worker_pids,))
+            return self._executor
+
+    def extract(self, content, recipe_url):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ParsePoolBusy('Too many recipes are being extracted right now, please try again later')
+        try:
+            executor = self._get_executor()
+            domain = recipe_domain(recipe_url)
+            domain_strategies = get_domain_strategies() if domain else None
+            strategies = domain_strategies.for_domain(domain) if domain_strategies is not None else None
+            future = executor.submit(run_extraction, content, recipe_url, self.task_timeout, strategies)
+            try:
+                # the worker stops itself after task_timeout, the extra time is for the queue and sending results back
+                recipe, events, learned = future.result(timeout=self.task_timeout + self.queue_timeout)
+                metrics.replay(events)
+                for field, strategy in (learned or {}).items():
+                    domain_strategies.learn(domain, field, strategy['method'], strategy['selectors'], strategy.get('lists'))
+                return recipe
+            except TimeoutError:
+                # the worker is stuck somewhere the alarm can't interrupt (eg. inside one huge regex), get rid of it
+                logging.warning("Extraction of {} didn't stop, restarting the parse pool".format(recipe_url))
+                self._restart(executor)
+                raise ParseTimeout('Extraction took too long')
+            except BrokenProcessPool:
+                self._restart(executor)
+                raise
+        finally:
+            self._slots.release()
+
+    def _restart(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            worker_pids, self._worker_pids = self._worker_pids, None
+        # ProcessPoolExecutor has no public way to stop a running task, so its workers are killed by the PIDs they
+        # reported. One that has exited already is skipped
+        while not worker_pids.empty():
+            try:
+                os.kill(worker_pids.get(), signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# Only used with RECIPE_SCRAPER_PARSE_MODE=process, otherwise pages are extracted in the calling thread as before
+def create_parse_pool():
+    if os.getenv('RECIPE_SCRAPER_PARSE_MODE', 'thread') != 'process':
+        return None
+    return ParsePool(
+        max_workers=int(os.getenv('RECIPE_SCRAPER_PARSE_PROCESSES', 0)) or None,
+        queue_size=int(os.getenv('RECIPE_SCRAPER_PARSE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+        task_timeout=float(os.getenv('RECIPE_SCRAPER_PARSE_TIMEOUT', DEFAULT_TASK_TIMEOUT)),
+    )
@@ -0,0 +1,339 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from domain_strategies import recipe_domain
+from metrics import extraction_methods, stage_seconds
+from scrape_cache import normalize_url
+
+# Every successful extraction (URL, website, the recipe, which extraction method found each field and how long each
+# stage took) is appended to a log in RECIPE_SCRAPER_CORPUS_DIR, one log per worker process. Full logs are compacted
+# into columnar parts: Parquet when pyarrow is installed (Arrow IPC when it has no Parquet support), otherwise JSON
+# lines compressed with zstandard, or gzip when that isn't installed either. Nothing is ever rewritten, so the
+# directory can be copied off for analytics at any time.
+# When the app starts the latest records warm up the scrape cache and the per-website extraction strategies, and
+# benchmarks/reextract_corpus.py runs the current extraction over the pages in the page store to see what a heuristic
+# change does to real recipes without fetching them again.
+
+DEFAULT_LOG_RECORDS = 1000
+
+# what the re-extraction compares
+recipe_fields = ['recipe_name', 'recipe_steps', 'ingredients', 'servings', 'original_unit_type']
+# the fields domain_strategies learns a method for
+strategy_fields = ['steps', 'ingredients']
+
+part_extensions = {'parquet': '.parquet', 'arrow': '.arrow', 'zstd': '.jsonl.zst', 'gzip': '.jsonl.gz'}
+
+
+# pyarrow takes a while to import, it's only needed when parts are written or read
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return None, None
+    try:
+        import pyarrow.parquet as parquet
+    except ImportError:
+        parquet = None
+    return pyarrow, parquet
+
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def best_format():
+    pyarrow, parquet = import_pyarrow()
+    if pyarrow is not None:
+        return 'parquet' if parquet is not None else 'arrow'
+    return 'zstd' if import_zstandard() is not None else 'gzip'
+
+
+def part_format(name):
+    for file_format, extension in part_extensions.items():
+        if name.endswith(extension):
+            return file_format
+    return None
+
+
+# The record of one extraction, events are the metrics recorded while it ran (see metrics.deferred)
+def corpus_record(recipe_url, recipe, events, fetch_seconds=None):
+    methods = {}
+    timings = {}
+    for name, value, labelvalues in events:
+        if name == extraction_methods.name:
+            methods[labelvalues[0]] = labelvalues[1]
+        elif name == stage_seconds.name:
+            timings[labelvalues[0]] = timings.get(labelvalues[0], 0.0) + value
+    if fetch_seconds is not None:
+        timings['fetch'] = fetch_seconds
+
+    return {
+        'url': normalize_url(recipe_url),
+        'domain': recipe_domain(recipe_url),
+        'scraped_at': time.time(),
+        'recipe_name': recipe['recipe_name'],
+        'recipe_steps': recipe['recipe_steps'] or [],
+        'ingredients': [[None if value is None else str(value) for value in row] for row in recipe['ingredients'] or []],
+        'servings': None if recipe['servings'] is None else str(recipe['servings']),
+        'original_unit_type': recipe['original_unit_type'],
+        'methods': methods,
+        'timings': timings,
+        'elapsed': timings.get('fetch', 0.0) + timings.get('extract', 0.0),
+        # exactly what was extracted, to put back in the scrape cache
+        'recipe': json.dumps(recipe),
+    }
+
+
+# ============= Columnar parts =============
+def arrow_schema(pyarrow):
+    return pyarrow.schema([
+        ('url', pyarrow.string()),
+        ('domain', pyarrow.string()),
+        ('scraped_at', pyarrow.float64()),
+        ('recipe_name', pyarrow.string()),
+        ('recipe_steps', pyarrow.list_(pyarrow.string())),
+        ('ingredients', pyarrow.list_(pyarrow.list_(pyarrow.string()))),
+        ('servings', pyarrow.string()),
+        ('original_unit_type', pyarrow.string()),
+        ('methods', pyarrow.map_(pyarrow.string(), pyarrow.string())),
+        ('timings', pyarrow.map_(pyarrow.string(), pyarrow.float64())),
+        ('elapsed', pyarrow.float64()),
+        ('recipe', pyarrow.string()),
+    ])
+
+
+def write_part(directory, records, file_format):
+    path = os.path.join(directory, 'part-{}-{}{}'.format(time.time_ns(), uuid.uuid4().hex[:8], part_extensions[file_format]))
+    temp_path = path + '.tmp'
+    if file_format in ('parquet', 'arrow'):
+        pyarrow, parquet = import_pyarrow()
+        # map columns are built from (key, value) pairs
+        rows = [dict(record, methods=list(record['methods'].items()), timings=list(record['timings'].items())) for record in records]
+        table = pyarrow.Table.from_pylist(rows, schema=arrow_schema(pyarrow))
+        if file_format == 'parquet':
+            parquet.write_table(table, temp_path, compression='zstd')
+        else:
+            import pyarrow.ipc
+            with pyarrow.OSFile(temp_path, 'wb') as sink, pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        data = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+        if file_format == 'zstd':
+            data = import_zstandard().ZstdCompressor(level=10).compress(data)
+        else:
+            data = gzip.compress(data, compresslevel=9)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+    os.replace(temp_path, path)
+    return path
+
+
+def read_part(path):
+    file_format = part_format(path)
+    if file_format in ('parquet', 'arrow'):
+        pyarrow, parquet = import_pyarrow()
+        if pyarrow is None:
+            logging.warning("Skipping {}, reading it needs pyarrow".format(path))
+            return
+        if file_format == 'parquet':
+            table = parquet.read_table(path)
+        else:
+            import pyarrow.ipc
+            with pyarrow.memory_map(path) as source:
+                table = pyarrow.ipc.open_file(source).read_all()
+        for record in table.to_pylist():
+            record['methods'] = dict(record['methods'] or [])
+            record['timings'] = dict(record['timings'] or [])
+            yield record
+        return
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    if file_format == 'zstd':
+        zstandard = import_zstandard()
+        if zstandard is None:
+            logging.warning("Skipping {}, reading it needs zstandard".format(path))
+            return
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = gzip.decompress(data)
+    for line in data.splitlines():
+        yield json.loads(line)
+
+
+def read_log(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    pass  # the last line of a log that's still being written
+    except FileNotFoundError:
+        pass  # compacted in the meantime
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RecipeCorpus:
+    def __init__(self, directory, log_records=DEFAULT_LOG_RECORDS, file_format='auto'):
+        self.directory = directory
+        self.log_records = log_records
+        self.file_format = file_format  # 'auto' picks the best one there is when compacting
+        self._lock = threading.Lock()
+        self._log = None  # this process' open log
+        self._log_path = None
+        self._log_count = 0
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.close)
+
+    def append(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._log is None:
+                self._log_path = os.path.join(self.directory, 'log-{}-{}.jsonl'.format(os.getpid(), uuid.uuid4().hex[:8]))
+                self._log = open(self._log_path, 'a', encoding='utf-8')
+                self._log_count = 0
+            self._log.write(line)
+            self._log.flush()
+            self._log_count += 1
+            full = self._log_count >= self.log_records
+            if full:
+                self._seal()
+        if full:
+            threading.Thread(target=self.compact, name='corpus-compact', daemon=True).start()
+
+    # a sealed log is never written to again, so it can be compacted
+    def _seal(self):
+        self._log.close()
+        os.replace(self._log_path, self._log_path + '.sealed')
+        self._log = self._log_path = None
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._seal()
+
+    # logs nobody writes to anymore: sealed ones, and the ones of worker processes that are gone
+    # (.compacting-<pid> ones were being compacted by a process that's gone)
+    def _finished_log(self, name):
+        if name.endswith('.sealed'):
+            return True
+        if '.compacting-' in name:
+            return not process_alive(int(name.rsplit('-', 1)[1]))
+        if name.endswith('.jsonl'):
+            pid = int(name.split('-')[1])
+            if pid == os.getpid():
+                return os.path.join(self.directory, name) != self._log_path
+            return not process_alive(pid)
+        return False
+
+    # Turns the finished logs into one columnar part, returns its path (None when there was nothing to compact)
+    def compact(self):
+        claimed = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.startswith('log-') or not self._finished_log(name):
+                continue
+            path = os.path.join(self.directory, name)
+            claimed_path = '{}.compacting-{}'.format(path.split('.compacting-')[0], os.getpid())
+            try:
+                # whoever renames it first compacts it, other processes may be compacting at the same time
+                os.rename(path, claimed_path)
+            except FileNotFoundError:
+                continue
+            claimed.append(claimed_path)
+        if not claimed:
+            return None
+
+        records = [record for path in claimed for record in read_log(path)]
+        try:
+            file_format = best_format() if self.file_format == 'auto' else self.file_format
+            part = write_part(self.directory, records, file_format) if records else None
+        except Exception:
+            logging.exception("Failed to compact the recipe corpus")
+            for path in claimed:
+                os.rename(path, path.split('.compacting-')[0])
+            return None
+        for path in claimed:
+            os.remove(path)
+        logging.info("DEBUG: compacted {} corpus records into {}".format(len(records), part))
+        return part
+
+    # every record, roughly in the order they were scraped: compacted parts first, then the logs
+    def records(self):
+        names = sorted(os.listdir(self.directory))
+        for name in names:
+            if name.startswith('part-') and part_format(name):
+                yield from read_part(os.path.join(self.directory, name))
+        for name in names:
+            if name.startswith('log-'):
+                yield from read_log(os.path.join(self.directory, name))
+
+    # the last record of every URL, oldest first
+    def latest(self):
+        latest = {}
+        for record in self.records():
+            current = latest.get(record['url'])
+            if current is None or record['scraped_at'] >= current['scraped_at']:
+                latest[record['url']] = record
+        return sorted(latest.values(), key=lambda record: record['scraped_at'])
+
+
+# Puts the latest recipes that haven't expired yet back in the scrape cache and teaches the domain strategies the
+# extraction method that worked last on each website (without the list selectors, those aren't in the corpus), unless
+# they already know one
+def warm_start(corpus, scrape_cache, strategies=None):
+    start_time = time.perf_counter()
+    records = corpus.latest()
+    cached = 0
+    for record in records[-scrape_cache.max_entries:]:
+        if scrape_cache.warm(record['url'], json.loads(record['recipe']), record['elapsed'], record['scraped_at']):
+            cached += 1
+
+    learned = 0
+    if strategies is not None:
+        # only what the extraction can run again: not 'none', nor a method an older version had
+        from scraper import ingredient_methods, step_methods
+        known_methods = {'steps': step_methods, 'ingredients': ingredient_methods}
+        methods = {}
+        for record in records:
+            for field in strategy_fields:
+                if record['domain'] and record['methods'].get(field) in known_methods[field]:
+                    methods[(record['domain'], field)] = record['methods'][field]
+        for (domain, field), method in methods.items():
+            if strategies.get(domain, field) is None:
+                strategies.learn(domain, field, method)
+                learned += 1
+    logging.info("DEBUG: warmed up {} cached recipes and {} strategies from {} corpus records in {:.2f}s".format(
+        cached, learned, len(records), time.perf_counter() - start_time))
+    return cached, learned
+
+
+# RECIPE_SCRAPER_CORPUS_DIR turns it on
+def create_recipe_corpus():
+    directory = os.getenv('RECIPE_SCRAPER_CORPUS_DIR')
+    if not directory:
+        return None
+    return RecipeCorpus(
+        directory,
+        log_records=int(os.getenv('RECIPE_SCRAPER_CORPUS_LOG_RECORDS', DEFAULT_LOG_RECORDS)),
+        file_format=os.getenv('RECIPE_SCRAPER_CORPUS_FORMAT', 'auto'),
+    )
@@ -0,0 +1,135 @@
+import re
+
+from structured_data import parse_json_ld_block
+
+# Looks at a recipe page while it's still being downloaded and tells the fetch when everything the extraction needs
+# has come in, so it can stop reading there instead of downloading the comments, ads and related posts that make up
+# most of a bloated recipe page. Works on the raw bytes with a few regexes (no tree is built), carrying the end of
+# each chunk over to the next one for whatever was cut in half. A page is done early when
+#  - the first JSON-LD Recipe has closed and it has the steps, ingredients, name and servings: extract_recipe only
+#    looks at that block then, so stopping right after it gives exactly the same recipe
+#  - a list of labelled ingredients and a list of labelled steps have both closed and a serving size has been seen,
+#    the labels dom_index looks for. A bit more of the page (EARLY_STOP_MARGIN) is read after that for the elements
+#    the heuristics look at next to them
+
+EARLY_STOP_MARGIN = 32 * 1024
+MAX_JSON_LD_BYTES = 1024 * 1024
+MAX_TAG_BYTES = 4096
+SERVINGS_OVERLAP = 512
+
+# same as structured_data.json_ld_pattern, split in two so a block can be found across chunks
+json_ld_start_pattern = re.compile(rb'<script[^>]*type\s*=\s*["\']?application/ld\+json["\']?[^>]*>', re.I)
+script_end_pattern = re.compile(rb'</script\s*>', re.I)
+
+list_tag_pattern = re.compile(rb'<(/?)(ul|ol|li)\b([^>]*)>', re.I)
+attribute_pattern = re.compile(rb'\b(class|id)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.I)
+# the step/ingredient labels of dom_index, on bytes
+step_label_pattern = re.compile(rb'instruction|direction|step', re.I)
+ingredient_label_pattern = re.compile(rb'ingredient', re.I)
+# a serving keyword followed by a number, with at most a few tags in between ("Servings: <span>4</span>")
+servings_pattern = re.compile(rb'(?:serves|servings?|yields?)\b[^<\d]{0,40}(?:<[^>]*>[^<\d]{0,40}){0,6}\d', re.I)
+
+
+def tag_labels(attributes):
+    labels = set()
+    for match in attribute_pattern.finditer(attributes):
+        value = match.group(2) or match.group(3) or match.group(4) or b''
+        if step_label_pattern.search(value):
+            labels.add('steps')
+        if ingredient_label_pattern.search(value):
+            labels.add('ingredients')
+    return labels
+
+
+class RecipeScanner:
+    def __init__(self, margin=EARLY_STOP_MARGIN):
+        self.margin = margin
+        self.done = False
+        self.reason = None  # what the page was done on: 'json_ld' or 'lists'
+        self.size = 0
+
+        self._json_ld = b''  # unscanned bytes, or the contents of the JSON-LD script we're in so far
+        self._in_json_ld = False
+        self._json_ld_found = False  # the first usable JSON-LD recipe has been looked at
+        self._tags = b''  # the start of a tag cut off at the end of the last chunk
+        self._servings = b''
+        self._open_lists = []  # for each open ul/ol, what its items (or the list itself) are labelled as
+        self._closed = set()  # 'steps'/'ingredients' once a list of them has closed
+        self._servings_seen = False
+        self._stop_at = None
+
+    # Returns True once the rest of the page isn't needed
+    def feed(self, chunk):
+        if self.done:
+            return True
+        self.size += len(chunk)
+        if self._stop_at is None:
+            if not self._json_ld_found and self._scan_json_ld(chunk):
+                self.reason = 'json_ld'
+                self.done = True
+                return True
+            self._scan_lists(chunk)
+            self._scan_servings(chunk)
+            if self._servings_seen and self._closed == {'steps', 'ingredients'}:
+                self._stop_at = self.size + self.margin
+        if self._stop_at is not None and self.size >= self._stop_at:
+            self.reason = 'lists'
+            self.done = True
+        return self.done
+
+    def _scan_json_ld(self, chunk):
+        data = self._json_ld + chunk
+        while True:
+            if not self._in_json_ld:
+                match = json_ld_start_pattern.search(data)
+                if match is None:
+                    # no whole start tag in there, but the last bytes could be the beginning of one
+                    self._json_ld = data[-MAX_TAG_BYTES:]
+                    return False
+                self._in_json_ld = True
+                data = data[match.end():]
+                continue
+
+            match = script_end_pattern.search(data)
+            if match is None:
+                # a script this big isn't a recipe, wait for the next one
+                if len(data) > MAX_JSON_LD_BYTES:
+                    self._in_json_ld = False
+                    data = b''
+                self._json_ld = data
+                return False
+            self._in_json_ld = False
+            block, data = data[:match.start()], data[match.end():]
+            recipe = parse_json_ld_block(block)
+            if recipe is not None:
+                # extract_recipe goes with the first usable one, the soup is only needed when it's missing a field
+                self._json_ld_found = True
+                self._json_ld = b''
+                return bool(recipe['name'] and recipe['servings'])
+
+    def _scan_lists(self, chunk):
+        data = self._tags + chunk
+        # keep a tag that hasn't been closed yet for the next chunk
+        start = data.rfind(b'<')
+        if start != -1 and data.find(b'>', start) == -1 and len(data) - start <= MAX_TAG_BYTES:
+            data, self._tags = data[:start], data[start:]
+        else:
+            self._tags = b''
+
+        for match in list_tag_pattern.finditer(data):
+            closing, name = match.group(1), match.group(2).lower()
+            if name == b'li':
+                if not closing and self._open_lists:
+                    self._open_lists[-1].update(tag_labels(match.group(3)))
+            elif not closing:
+                # ul/ol labelled as the ingredients, like dom_index's ingredient_lists
+                self._open_lists.append(tag_labels(match.group(3)) & {'ingredients'})
+            elif self._open_lists:
+                self._closed.update(self._open_lists.pop())
+
+    def _scan_servings(self, chunk):
+        if self._servings_seen:
+            return
+        data = self._servings + chunk
+        self._servings_seen = servings_pattern.search(data) is not None
+        self._servings = data[-SERVINGS_OVERLAP:]
@@ -0,0 +1,120 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Per-recipe state (scraped ingredients, servings, unit type etc) that the follow-up endpoints need.
+# Every scrape gets its own recipe ID so that concurrent users/workers never see each other's recipes.
+
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 24 * 60 * 60  # same as the JWT expiry, a recipe is not useful to anyone after that
+
+
+# In-memory backend, only shared between the threads of one process
+class MemoryRecipeBackend:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # recipe_id -> (expires_at, serialized record)
+        self._lock = threading.Lock()
+
+    def get(self, recipe_id):
+        with self._lock:
+            entry = self._entries.get(recipe_id)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[recipe_id]
+                return None
+            self._entries.move_to_end(recipe_id)
+            return value
+
+    def set(self, recipe_id, value):
+        with self._lock:
+            self._entries[recipe_id] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(recipe_id)
+            # evict the least recently used recipes once we're over the limit
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, recipe_id):
+        with self._lock:
+            self._entries.pop(recipe_id, None)
+
+
+# Shared backend on a local SQLite file, so that all gunicorn workers (processes) on a node see the same recipes.
+# Anything with the same get/set/delete methods (eg. redis) can be dropped in instead for multiple nodes.
+class SQLiteRecipeBackend:
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS recipes (recipe_id TEXT PRIMARY KEY, expires_at REAL, value TEXT)')
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def get(self, recipe_id):
+        row = self._connect().execute('SELECT expires_at, value FROM recipes WHERE recipe_id = ?', (recipe_id,)).fetchone()
+        if row is None:
+            return None
+        expires_at, value = row
+        if expires_at < time.time():
+            self.delete(recipe_id)
+            return None
+        return value
+
+    def set(self, recipe_id, value):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO recipes (recipe_id, expires_at, value) VALUES (?, ?, ?)',
+                         (recipe_id, time.time() + self.ttl, value))
+            conn.execute('DELETE FROM recipes WHERE expires_at < ?', (time.time(),))
+
+    def delete(self, recipe_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM recipes WHERE recipe_id = ?', (recipe_id,))
+
+
+class RecipeStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create(self, recipe):
+        recipe_id = uuid.uuid4().hex
+        self.save(recipe_id, recipe)
+        return recipe_id
+
+    # Returns a fresh copy of the recipe every time, so callers are free to modify it before saving it back
+    def get(self, recipe_id):
+        if not recipe_id:
+            return None
+        value = self.backend.get(recipe_id)
+        return json.loads(value) if value is not None else None
+
+    def save(self, recipe_id, recipe):
+        self.backend.set(recipe_id, json.dumps(recipe))
+
+    def delete(self, recipe_id):
+        self.backend.delete(recipe_id)
+
+
+def create_recipe_store():
+    backend = os.getenv('RECIPE_SCRAPER_STORE_BACKEND', 'memory')
+    ttl = int(os.getenv('RECIPE_SCRAPER_STORE_TTL', DEFAULT_TTL))
+
+    if backend == 'sqlite':
+        path = os.getenv('RECIPE_SCRAPER_STORE_PATH', 'recipes.db')
+        return RecipeStore(SQLiteRecipeBackend(path, ttl=ttl))
+
+    max_entries = int(os.getenv('RECIPE_SCRAPER_STORE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+    return RecipeStore(MemoryRecipeBackend(max_entries=max_entries, ttl=ttl))
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Cache of scrape results (recipe name, steps, ingredients, servings...) keyed on the normalized recipe URL,
+# so that popular recipes are only fetched and parsed once in a while instead of on every request.
+
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_TTL = 6 * 60 * 60
+DEFAULT_DISK_MAX_ENTRIES = 5000
+
+# Query parameters that only track where the visitor came from and never change the page content
+tracking_params = {'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'igshid', 'yclid', '_ga', '_gl', 'ref', 'ref_src', 'share'}
+tracking_param_prefixes = ('utm_', 'pk_', 'hsa_')
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or 'https'
+    netloc = parts.netloc.lower()
+    if netloc.endswith(':80') and scheme == 'http':
+        netloc = netloc[:-3]
+    elif netloc.endswith(':443') and scheme == 'https':
+        netloc = netloc[:-4]
+
+    path = parts.path.rstrip('/') or '/'
+
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if key.lower() not in tracking_params and not key.lower().startswith(tracking_param_prefixes)]
+    query = urlencode(sorted(query))
+
+    # the fragment is never sent to the server, so it can't change the page
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+class ScrapeCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, disk_dir=None, disk_max_entries=DEFAULT_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()  # normalized url -> (expires_at, elapsed, serialized result)
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0  # fetch + parse time that didn't have to be spent thanks to the cache
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, url):
+        return self.lookup(url)[0]
+
+    # (result, when it expires), (None, None) on a miss
+    def lookup(self, url):
+        key = normalize_url(url)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return json.loads(entry[2]), entry[0]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None, None
+            self.disk_hits += 1
+            self.saved_seconds += entry[1]
+            self._put(key, entry)
+        return json.loads(entry[2]), entry[0]
+
+    # elapsed is how long the fetch + extraction took, it's credited to saved_seconds on every hit
+    def set(self, url, result, elapsed=0.0):
+        key = normalize_url(url)
+        entry = (time.time() + self.ttl, elapsed, json.dumps(result))
+        with self._lock:
+            self._put(key, entry)
+        self._write_disk(key, entry)
+
+    # An entry from an earlier scrape (the recipe corpus when the app starts), it expires as if it had been cached back
+    # then. Doesn't replace anything that's already cached and isn't written to the disk tier
+    def warm(self, url, result, elapsed=0.0, scraped_at=None):
+        key = normalize_url(url)
+        expires_at = (scraped_at or time.time()) + self.ttl
+        if expires_at < time.time():
+            return False
+        with self._lock:
+            if key in self._entries:
+                return False
+            self._put(key, (expires_at, elapsed, json.dumps(result)))
+        return True
+
+    def delete(self, url):
+        key = normalize_url(url)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3),
+            }
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # ============= Disk tier =============
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('url') != key or data['expires_at'] < now:
+            return None
+        return data['expires_at'], data['elapsed'], data['result']
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'url': key, 'expires_at': entry[0], 'elapsed': entry[1], 'result': entry[2]}, f)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    # Drop expired files, then the oldest ones if the directory grew past disk_max_entries
+    def _prune_disk(self):
+        now = time.time()
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if mtime + self.ttl < now:
+                self._remove_file(path)
+            else:
+                files.append((mtime, path))
+
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.disk_max_entries)]:
+            self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def create_scrape_cache():
+    return ScrapeCache(
+        max_entries=int(os.getenv('RECIPE_SCRAPER_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        ttl=int(os.getenv('RECIPE_SCRAPER_CACHE_TTL', DEFAULT_TTL)),
+        disk_dir=os.getenv('RECIPE_SCRAPER_CACHE_DIR') or None,
+        disk_max_entries=int(os.getenv('RECIPE_SCRAPER_CACHE_DISK_MAX_ENTRIES', DEFAULT_DISK_MAX_ENTRIES)),
+    )
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from scrape_cache import normalize_url
+
+# Background scrapes: submitting a recipe URL gives back a job ID straight away and a small pool of threads does the
+# fetch + extraction, so slow recipe websites don't hold a request worker. Clients poll the job or get it POSTed to
+# their callback URL when it's done. Jobs for the same (normalized) URL that come in while it's being scraped share
+# that one scrape, but every job still gets its own result (and recipe ID).
+# With the SQLite job store every unfinished job is leased to the worker process running it, which renews the lease
+# while it's alive. Jobs whose lease ran out (their worker died or was restarted) are claimed by whichever worker gets
+# to them first, so a job is never scraped (and called back) by two workers at once.
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_CALLBACK_TIMEOUT = 5
+DEFAULT_LEASE = 60
+DEFAULT_MAX_ENTRIES = 10000
+
+unfinished_statuses = ('queued', 'running')
+
+
+class ScrapeQueueFull(RuntimeError):
+    pass
+
+
+# Jobs in this process' memory. Past max_entries the least recently used finished jobs are dropped, never a queued or
+# running one: it still has to be finished and called back
+class MemoryJobBackend:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._unfinished = {}  # job_id -> (expires_at, serialized job)
+        self._finished = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        with self._lock:
+            entries = self._unfinished if job_id in self._unfinished else self._finished
+            entry = entries.get(job_id)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del entries[job_id]
+                return None
+            if entries is self._finished:
+                self._finished.move_to_end(job_id)
+            return value
+
+    def set(self, job_id, value):
+        entry = (time.time() + self.ttl, value)
+        with self._lock:
+            if json.loads(value)['status'] in unfinished_statuses:
+                self._finished.pop(job_id, None)
+                self._unfinished[job_id] = entry
+                return
+            self._unfinished.pop(job_id, None)
+            self._finished[job_id] = entry
+            self._finished.move_to_end(job_id)
+            while self._finished and len(self._finished) + len(self._unfinished) > self.max_entries:
+                self._finished.popitem(last=False)
+
+
+# Jobs on a local SQLite file, so all workers can answer for any job and unfinished jobs are picked up again after a restart
+class SQLiteJobBackend:
+    def __init__(self, path, ttl=DEFAULT_TTL, lease=DEFAULT_LEASE):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self.owner = uuid.uuid4().hex  # the jobs this process saves are leased to it
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT, expires_at REAL, value TEXT, '
+                         'owner TEXT, lease_until REAL)')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(jobs)')]
+            if 'owner' not in columns:
+                # files from before jobs were leased, their unfinished jobs can be claimed straight away
+                conn.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+                conn.execute('ALTER TABLE jobs ADD COLUMN lease_until REAL')
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            self._local.conn = conn
+        return conn
+
+    def get(self, job_id):
+        row = self._connect().execute('SELECT value FROM jobs WHERE job_id = ? AND expires_at >= ?', (job_id, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, job_id, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO jobs (job_id, status, expires_at, value, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?)',
+                         (job_id, json.loads(value)['status'], now + self.ttl, value, self.owner, now + self.lease))
+            conn.execute('DELETE FROM jobs WHERE expires_at < ?', (now,))
+
+    # keeps the jobs of this process from being claimed by the others
+    def renew(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)', (now + self.lease, self.owner) + unfinished_statuses)
+
+    # Leases the unfinished jobs nobody is running anymore to this process and returns them
+    def claim_unfinished(self):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            # takes the write lock right away, so two workers starting at the same time can't both claim a job
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT job_id, value FROM jobs WHERE status IN (?, ?) AND expires_at >= ? AND (lease_until IS NULL OR lease_until < ?)',
+                                unfinished_statuses + (now, now)).fetchall()
+            conn.executemany('UPDATE jobs SET owner = ?, lease_until = ? WHERE job_id = ?', [(self.owner, now + self.lease, job_id) for job_id, _ in rows])
+        return [value for _, value in rows]
+
+
+class ScrapeJobQueue:
+    # scrape(recipe_url) -> (recipe, error response), respond(recipe_url, recipe, error) -> (body, status) of each job
+    def __init__(self, scrape, respond, backend, max_workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, callback_timeout=DEFAULT_CALLBACK_TIMEOUT):
+        self.scrape = scrape
+        self.respond = respond
+        self.backend = backend
+        self.queue_size = queue_size
+        self.callback_timeout = callback_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scrape-job')
+        self._tasks = {}  # normalized url -> {'running': bool, 'job_ids': [...]}, one per URL being scraped
+        self._lock = threading.Lock()
+        self._started = False
+        self._stopped = threading.Event()
+
+    def get(self, job_id):
+        value = self.backend.get(job_id) if job_id else None
+        return json.loads(value) if value is not None else None
+
+    def _save(self, job):
+        self.backend.set(job['job_id'], json.dumps(job))
+
+    def submit(self, recipe_url, callback_url=None):
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'recipe_url': recipe_url,
+            'callback_url': callback_url,
+            'status': 'queued',
+            'created_at': time.time(),
+            'finished_at': None,
+            'status_code': None,
+            'result': None,
+        }
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job):
+        key = normalize_url(job['recipe_url'])
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                if len(self._tasks) >= self.queue_size:
+                    raise ScrapeQueueFull('Too many recipes are being scraped right now, please try again later')
+                task = self._tasks[key] = {'running': False, 'job_ids': []}
+                start = True
+            else:
+                start = False
+            if task['running']:
+                job['status'] = 'running'
+            # saved before the task can see it, so it's always there when the task finishes
+            self._save(job)
+            task['job_ids'].append(job['job_id'])
+        if start:
+            self._executor.submit(self._run, key, job['recipe_url'])
+
+    def _run(self, key, recipe_url):
+        with self._lock:
+            task = self._tasks[key]
+            task['running'] = True
+            job_ids = list(task['job_ids'])
+        for job_id in job_ids:
+            self._update(job_id, status='running')
+
+        try:
+            recipe, error = self.scrape(recipe_url)
+        except Exception as e:
+            logging.exception("Scrape job for {} failed".format(recipe_url))
+            recipe, error = None, ({'error': 'Failed to scrape recipe: {}'.format(str(e))}, 500)
+
+        with self._lock:
+            job_ids = self._tasks.pop(key)['job_ids']
+        for job_id in job_ids:
+            self._finish(job_id, recipe, error)
+
+    def _update(self, job_id, **changes):
+        job = self.get(job_id)
+        if job is not None:
+            job.update(changes)
+            self._save(job)
+        return job
+
+    def _finish(self, job_id, recipe, error):
+        job = self.get(job_id)
+        if job is None:
+            logging.warning("Scrape job {} is gone from the job store, its result is dropped".format(job_id))
+            return
+        try:
+            body, status = self.respond(job['recipe_url'], recipe, error)
+        except Exception as e:
+            logging.exception("Scrape job {} failed".format(job_id))
+            body, status = {'error': 'Failed to scrape recipe: {}'.format(str(e))}, 500
+        job.update(status='done' if status < 400 else 'failed', status_code=status, result=body, finished_at=time.time())
+        self._save(job)
+        if job['callback_url']:
+            self._call_back(job)
+
+    def _call_back(self, job):
+        import requests  # not needed at all until the first callback
+
+        try:
+            response = requests.post(job['callback_url'], json=job, timeout=self.callback_timeout)
+            if response.status_code >= 400:
+                logging.warning("Callback for job {} got status code {}".format(job['job_id'], response.status_code))
+        except requests.RequestException as e:
+            logging.warning("Callback for job {} failed: {}".format(job['job_id'], str(e)))
+
+    # jobs that were still queued or running when their process stopped
+    def resume(self):
+        claim_unfinished = getattr(self.backend, 'claim_unfinished', None)
+        if claim_unfinished is None:
+            return
+        for value in claim_unfinished():
+            job = json.loads(value)
+            with self._lock:
+                # still running here, its lease ran out while this process was too busy to renew it
+                if any(job['job_id'] in task['job_ids'] for task in self._tasks.values()):
+                    continue
+            logging.info("DEBUG: resuming scrape job {}".format(job['job_id']))
+            try:
+                self._enqueue(dict(job, status='queued'))
+            except ScrapeQueueFull:
+                self._update(job['job_id'], status='failed', status_code=503, finished_at=time.time(),
+                             result={'error': 'The job was lost while the server restarted, please submit it again'})
+
+    # Resumes the unfinished jobs and keeps the leases of this process' jobs alive (with a backend that leases them),
+    # called once the worker is serving rather than when the app is imported
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if not hasattr(self.backend, 'renew'):
+            return
+        self.resume()
+        threading.Thread(target=self._keep_leases, name='scrape-job-leases', daemon=True).start()
+
+    def _keep_leases(self):
+        while not self._stopped.wait(self.backend.lease / 3):
+            try:
+                self.backend.renew()
+                # and take over the jobs of workers that have died since
+                self.resume()
+            except Exception:
+                logging.exception("Failed to renew the scrape job leases")
+
+    def shutdown(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_scrape_job_queue(scrape, respond):
+    ttl = int(os.getenv('RECIPE_SCRAPER_JOB_TTL', DEFAULT_TTL))
+    path = os.getenv('RECIPE_SCRAPER_JOB_STORE_PATH')
+    if path:
+        backend = SQLiteJobBackend(path, ttl=ttl, lease=float(os.getenv('RECIPE_SCRAPER_JOB_LEASE', DEFAULT_LEASE)))
+    else:
+        backend = MemoryJobBackend(max_entries=int(os.getenv('RECIPE_SCRAPER_JOB_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)), ttl=ttl)
+
+    return ScrapeJobQueue(
+        scrape,
+        respond,
+        backend,
+        max_workers=int(os.getenv('RECIPE_SCRAPER_JOB_WORKERS', DEFAULT_WORKERS)),
+        queue_size=int(os.getenv('RECIPE_SCRAPER_JOB_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+        callback_timeout=float(os.getenv('RECIPE_SCRAPER_CALLBACK_TIMEOUT', DEFAULT_CALLBACK_TIMEOUT)),
+    )
@@ -0,0 +1,337 @@
+import re
+import logging
+from itertools import chain
+from urllib.parse import urlparse
+
+from soupsieve import SelectorSyntaxError
+
+from structured_data import extract_json_ld_recipe, extract_microdata_recipe
+from dom_index import build_dom_index, short_text
+from page_parser import make_soup
+from units import get_conversion_engine
+from ingredient_parser import parse_ingredient
+from ingredient_table import IngredientTable
+from domain_strategies import get_domain_strategies, recipe_domain, css_selector
+from metrics import stage_seconds, extraction_methods, strategy_lookups
+
+# Everything that turns the html of a recipe page into the recipe (name, steps, ingredients, servings).
+# Kept apart from the Flask app so that it can also run in parse worker processes.
+
+# Define some cooking action words to help locate the recipe in some websites where the recipe isn't labelled
+cooking_action_words = [
+    'heat', 'preheat', 'saute', 'stir', 'simmer', 'remove', 'serve', 'garnish', 
+    'pour', 'mix', 'bake', 'grill', 'boil', 'chop', 'slice', 'dice', 'cool', 
+    'prepare', 'melt', 'transfer', 'refrigerate', 'reheat', 'arrange', 'whisk', 'blend', 'fry',
+    'marinate', 'combine', 'drizzle', 'sprinkle', 'toss', 'fold', 'cover', 'let stand',
+    'mix together', 'beat', 'brush', 'shape', 'spray', 'roll', 'cut', 'spread', 'dip',
+    'top with', 'squeeze', 'shake', 'divide', 'whip', 'knead', 'grate', 'baste', 'pound', 'set', 'mash', 'stir',
+    'dry', 'wait', 'cool', 'season', 'start', 'cook'
+]
+
+# Function to extract the recipe steps when there's some labelling (id/class) on the html elements that indicates its the recipe
+def extract_recipe_steps_labelled(soup, index=None):
+    logging.info("DEBUG: extract_recipe_steps_labelled")
+    index = index or build_dom_index(soup)
+    recipe_steps = []
+    step_positions = []
+    extracted_steps = set()  
+
+    recipe_steps_html = index.steps_by_id + index.steps_by_class
+    recipe_steps_html = [step.get_text(strip=True) for step in recipe_steps_html]
+    has_cooking_related_words = any(any(word in step.lower() for word in cooking_action_words) for step in recipe_steps_html)
+    if has_cooking_related_words:
+        for element in recipe_steps_html:
+            text = element.strip()
+            if text.strip() not in extracted_steps:
+                recipe_steps.append(text.strip())
+                step_positions.append(recipe_steps_html.index(element))
+                extracted_steps.add(text.strip())
+    return recipe_steps
+
+# The first list (ol/ul) after each heading that has one of the keywords, walking the page from the heading's parent
+def lists_after_headings(index, keywords, list_tag):
+    lists = []
+    target_headers = [header for header in index.headings if any(keyword.lower() in index.text(header).lower() for keyword in keywords)]
+
+    for header in target_headers:
+        list_element = first_list_after(index, header.parent, list_tag)
+        if list_element is not None:
+            lists.append(list_element)
+    return lists
+
+# Same list as trying current_element.find(list_tag) on start and on every element after it, but in a single pass:
+# it's the first list whose parent is start or comes after it
+def first_list_after(index, start, list_tag):
+    if start is None:
+        return None
+    visited = {id(start)}
+    for element in index.elements_after(start):
+        visited.add(id(element))
+        if element.name == list_tag and id(element.parent) in visited:
+            return element
+    return None
+
+def list_items(lists):
+    items = []
+    for list_element in lists:
+        for li in list_element.find_all('li'):
+            text = li.get_text(strip=True)
+            if text not in items:
+                items.append(text)
+    return items
+
+# Each extraction method returns what it found and the list elements it was found in (so it can be learned, see
+# domain_strategies.py). They're tried in this order until one of them finds something
+def steps_labelled(soup, index):
+    return extract_recipe_steps_labelled(soup, index), []
+
+def steps_manual(soup, index):
+    logging.info("DEBUG: extract_recipe_steps_manual")
+    lists = lists_after_headings(index, ['directions', 'instructions', 'method', 'how to make'], 'ol')
+    return list_items(lists), lists
+
+def ingredients_method_1(soup, index):
+    # Found id or class labels for the ingredient li
+    ingredients_html = [ingredient.text.strip() + " " for ingredient in index.ingredients_by_id]
+    ingredients_html += [" ".join(ingredient.text.split()) for ingredient in index.ingredients_by_class]
+    if ingredients_html:
+        logging.info("DEBUG: method 1 ingredients")
+    return sorted(set(ingredients_html)), []
+
+def ingredients_method_2(soup, index):
+    # Found ingredients list (ol/ul) but li is not labelled
+    lists = [element for element in index.ingredient_lists if element.find('li')]
+    if lists:
+        logging.info("DEBUG: method 2 ingredients")
+    return list_items(lists), lists
+
+def ingredients_method_3(soup, index):
+    # Manually search for what looks like ingredients (current limitation is if the ingredients list totally got no labelling anywhere in the whole page then cannot)
+    logging.info("DEBUG: method 3 ingredients")
+    lists = lists_after_headings(index, ['ingredients'], 'ul')
+    return list_items(lists), lists
+
+step_methods = {'labelled': steps_labelled, 'manual': steps_manual}
+ingredient_methods = {'method_1': ingredients_method_1, 'method_2': ingredients_method_2, 'method_3': ingredients_method_3}
+
+# Function to extract the recipe steps when there is no labelling (id/class) on the html elements at all to indicate that its the recipe
+def extract_recipe_steps_manual(soup, index=None):
+    return steps_manual(soup, index or build_dom_index(soup))[0]
+
+# Selectors that reach every list the method found, empty when some of them have nothing stable to select them by
+def list_selectors(lists):
+    selectors = []
+    for element in lists:
+        selector = css_selector(element)
+        if selector is None:
+            return []
+        if selector not in selectors:
+            selectors.append(selector)
+    return selectors
+
+def select_lists(soup, selectors):
+    try:
+        # one selector list, so the lists come back in document order like the method would find them
+        return soup.select(', '.join(selectors))
+    except SelectorSyntaxError:
+        return []
+
+# The selectors worth learning: only when they select exactly the lists the method found on this page. A selector
+# like "div.entry-content > ul" also reaches the equipment list next to the ingredients, which would then be taken
+# for ingredients on every later page of the website
+def learnable_selectors(soup, lists):
+    selectors = list_selectors(lists)
+    if not selectors:
+        return []
+    found = {id(element) for element in lists}
+    selected = select_lists(soup, selectors)
+    if len(selected) != len(found) or {id(element) for element in selected} != found:
+        return []
+    return selectors
+
+def run_strategy(soup, index, strategy, method):
+    if not strategy['selectors']:
+        return method(soup, index)[0]
+    lists = select_lists(soup, strategy['selectors'])
+    # a page that isn't laid out like the one the selectors were learned on (more or fewer lists, lists without
+    # items) goes through the cascade instead
+    if len(lists) != strategy.get('lists') or not all(element.find('li') for element in lists):
+        return []
+    return list_items(lists)
+
+def extract_with_strategy(field, methods, soup, index, domain):
+    strategies = get_domain_strategies() if domain else None
+
+    # go straight to what worked on this website last time
+    strategy = strategies.get(domain, field) if strategies else None
+    if strategy and strategy['method'] in methods:
+        items = run_strategy(soup, index, strategy, methods[strategy['method']])
+        if items:
+            strategy_lookups.inc(field, 'hit')
+            extraction_methods.inc(field, strategy['method'])
+            return items
+        strategy_lookups.inc(field, 'miss')
+
+    for method, function in methods.items():
+        items, lists = function(soup, index)
+        if items:
+            extraction_methods.inc(field, method)
+            if strategies:
+                selectors = learnable_selectors(soup, lists)
+                strategies.learn(domain, field, method, selectors, len({id(element) for element in lists}) if selectors else None)
+            return items
+
+    extraction_methods.inc(field, 'none')
+    return []
+
+def extract_recipe_steps(soup, index=None, domain=None):
+    return extract_with_strategy('steps', step_methods, soup, index or build_dom_index(soup), domain)
+
+def extract_ingredients(soup, index=None, domain=None):
+    return extract_with_strategy('ingredients', ingredient_methods, soup, index or build_dom_index(soup), domain)
+
+def extract_recipe_name(soup, recipe_url, index=None):
+    # Parse the URL to extract the recipe name
+    recipe_url = recipe_url[:-1] if recipe_url.endswith('/') else recipe_url
+    parsed_url = urlparse(recipe_url)
+    path_components = parsed_url.path.split('/')
+    recipe_name_from_url = path_components[-1].replace('-', ' ').title()
+    recipe_name_from_url = recipe_name_from_url.split('.')
+    recipe_name_from_url = recipe_name_from_url[0]
+
+    # labelled with ID or class
+    index = index or build_dom_index(soup)
+    title_html = [title.text.strip() + " " for title in index.titles_by_id]
+    title_html += [title.text.strip() + " " for title in index.titles_by_class]
+    recipe_name_list = [item for item in title_html if item.strip().istitle()]
+
+    # compare which title/heading is most similar to the url cause the url usually has the recipe name in it
+    for item in recipe_name_list:
+        words1 = set(item.lower().split())
+        words2 = set(recipe_name_from_url.lower().split())
+        intersection = words1.intersection(words2)
+        similarity = len(intersection) / max(len(words1), len(words2))
+        if similarity >= 0.3:
+            extraction_methods.inc('name', 'heading')
+            return item.strip()
+    
+    extraction_methods.inc('name', 'url')
+    return recipe_name_from_url.strip()
+
+# The first digit of the first element with a short text (< 10 characters) with a number in it
+def first_short_number(elements):
+    for element in elements:
+        text = short_text(element, 10)
+        if text and re.search(r'\d', text):
+            return int(list(filter(str.isdigit, text))[0])
+    return None
+
+# FUNCTION TO GET THE SERVING SIZE OF THE RECIPE ON THE WEBSITE
+def get_serving_size(soup, index=None):
+    servings = None
+    # p/span/em/div elements whose text has 'serves', 'servings', 'yield' or 'serving' in it
+    index = index or build_dom_index(soup)
+    target_elements = index.serving_candidates
+
+    for element in target_elements:
+        text = index.text(element)
+        numbers = re.findall(r'\d+', text)
+        if numbers:
+            # check if the serving number is inside the same element as the word servings or yield etc
+            match = re.search(r'(?:Yields:|Serves:|Servings:|Yield:|Serving:)\s*(.+)', text, re.IGNORECASE)
+            if match:
+                text = match.group(1)
+                text = text.split(',') # split it just in case it comes together with the prep time etc
+                # if after splitting its still very long, then split it again by spaces cause it probably still contains some other irrelevant information
+                if len(text[0]) > 12:
+                    text[0] = text[0].split(' ', 1)
+                    return text[0][0]
+                else:
+                    return text[0]
+            # if not, check whether it is at the same level in the DOM structure (for both this and next method, extract a digit once its found)
+            servings = first_short_number(index.elements_after(element))
+            if servings is not None:
+                break
+            # if also not, then check the next elements within the same parent
+            if element.parent is not None:
+                servings = first_short_number(chain([element.parent], index.elements_after(element.parent)))
+                if servings is not None:
+                    break
+    return servings
+
+def postprocess_list(lst):
+    if lst:
+        return [re.sub(r'^\s*▢\s*', '', item) for item in lst]
+    else:
+        return None
+
+def postprocess_text(txt):
+    return txt.strip()
+
+# FUNCTIONS TO POSTPROCESS THE INGREDIENTS LIST
+def extract_units(ingredients):
+    ingredient_table = IngredientTable.from_parsed(parse_ingredient(ingredient) for ingredient in ingredients)
+
+    return ingredient_table, get_conversion_engine().unit_type(ingredient_table.units)
+
+# FUNCTION TO EXTRACT EVERYTHING WE NEED FROM THE HTML OF A RECIPE PAGE
+def extract_recipe(content, recipe_url):
+    servings = None
+    original_unit_type = None
+    ingredient_table = None
+
+    # Fast path: schema.org Recipe data embedded in the page, JSON-LD doesn't even need the soup
+    soup = None
+    with stage_seconds.time('json_ld'):
+        structured = extract_json_ld_recipe(content)
+    if structured is None:
+        with stage_seconds.time('parse'):
+            soup = make_soup(content)
+        with stage_seconds.time('microdata'):
+            structured = extract_microdata_recipe(soup)
+        extraction_methods.inc('recipe', 'microdata' if structured is not None else 'heuristics')
+    else:
+        extraction_methods.inc('recipe', 'json_ld')
+
+    if structured is not None:
+        logging.info("DEBUG: structured data recipe")
+        # only build the soup if the structured data is missing the name or servings
+        if soup is None and not (structured['name'] and structured['servings']):
+            with stage_seconds.time('parse'):
+                soup = make_soup(content)
+        with stage_seconds.time('name'):
+            recipe_name = postprocess_text(structured['name'] or extract_recipe_name(soup, recipe_url))
+        recipe_steps = postprocess_list(structured['steps'])
+        ingredients = postprocess_list(structured['ingredients'])
+        if ingredients:
+            with stage_seconds.time('units'):
+                ingredient_table, original_unit_type = extract_units(ingredients)
+                ingredients = ingredient_table.rows()
+            with stage_seconds.time('servings'):
+                servings = structured['servings'] or get_serving_size(soup)
+    else:
+        # index the page once for all of the heuristics below
+        domain = recipe_domain(recipe_url)
+        with stage_seconds.time('index'):
+            index = build_dom_index(soup)
+        with stage_seconds.time('name'):
+            recipe_name = postprocess_text(extract_recipe_name(soup, recipe_url, index))
+        with stage_seconds.time('steps'):
+            recipe_steps = postprocess_list(extract_recipe_steps(soup, index, domain))
+        with stage_seconds.time('ingredients'):
+            ingredients = postprocess_list(extract_ingredients(soup, index, domain))
+        if ingredients:
+            with stage_seconds.time('units'):
+                ingredient_table, original_unit_type = extract_units(ingredients)
+                ingredients = ingredient_table.rows()
+            with stage_seconds.time('servings'):
+                servings = get_serving_size(soup, index)
+
+    return {
+        'recipe_name': recipe_name,
+        'recipe_steps': recipe_steps,
+        'ingredients': ingredients,
+        'servings': servings,
+        'original_unit_type': original_unit_type,
+        'ingredient_table': ingredient_table.to_json() if ingredient_table else None,
+    }
@@ -0,0 +1,166 @@
+import html
+import json
+import re
+
+# Many recipe sites embed a schema.org Recipe object (JSON-LD in a <script> tag, or microdata attributes) for search engines.
+# When it's there it already has everything we need, so it's both faster and more accurate than the DOM heuristics.
+
+json_ld_pattern = re.compile(rb'<script[^>]*type\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>', re.I | re.S)
+tag_pattern = re.compile(r'<[^>]+>')
+whitespace_pattern = re.compile(r'\s+')
+space_before_punctuation_pattern = re.compile(r'\s+([.,;:!?)])')
+number_pattern = re.compile(r'\d+(?:[.,/]\d+)?')
+
+
+def clean_text(text):
+    if text is None:
+        return ''
+    text = html.unescape(tag_pattern.sub(' ', str(text)))
+    text = whitespace_pattern.sub(' ', text).strip()
+    # removing inline tags (eg. <b>butter</b>.) can leave a space before the punctuation
+    return space_before_punctuation_pattern.sub(r'\1', text)
+
+
+def unique(items):
+    seen = set()
+    result = []
+    for item in items:
+        if item and item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
+def is_recipe_type(value):
+    types = value if isinstance(value, list) else [value]
+    return any(isinstance(t, str) and t.split('/')[-1].lower() == 'recipe' for t in types)
+
+
+# JSON-LD can be a single object, a list of objects or a {"@graph": [...]}, and the recipe might be nested anywhere in it
+def find_recipe_object(data):
+    if isinstance(data, list):
+        for item in data:
+            recipe = find_recipe_object(item)
+            if recipe is not None:
+                return recipe
+    elif isinstance(data, dict):
+        if is_recipe_type(data.get('@type')):
+            return data
+        for key in ('@graph', 'mainEntity', 'mainEntityOfPage', 'itemListElement'):
+            if key in data:
+                recipe = find_recipe_object(data[key])
+                if recipe is not None:
+                    return recipe
+    return None
+
+
+def parse_instructions(instructions):
+    if isinstance(instructions, str):
+        # sometimes the whole method is one string, either html or one step per line
+        if '<li' in instructions.lower():
+            return [clean_text(step) for step in re.findall(r'<li[^>]*>(.*?)</li>', instructions, re.I | re.S)]
+        return [clean_text(step) for step in instructions.splitlines()]
+    if isinstance(instructions, list):
+        steps = []
+        for instruction in instructions:
+            steps += parse_instructions(instruction)
+        return steps
+    if isinstance(instructions, dict):
+        # HowToSection holds a list of HowToSteps
+        if 'itemListElement' in instructions:
+            return parse_instructions(instructions['itemListElement'])
+        return [clean_text(instructions.get('text') or instructions.get('name'))]
+    return []
+
+
+def parse_yield(recipe_yield):
+    values = recipe_yield if isinstance(recipe_yield, list) else [recipe_yield]
+    for value in values:
+        match = number_pattern.search(str(value)) if value is not None else None
+        if match:
+            return match.group(0)
+    return None
+
+
+def parse_name(name):
+    if isinstance(name, list):
+        name = name[0] if name else None
+    return clean_text(name) or None
+
+
+# Returns a dict with the recipe's name, steps, ingredients and servings, or None when there isn't a usable recipe object
+def parse_recipe_object(recipe):
+    ingredients = recipe.get('recipeIngredient') or recipe.get('ingredients') or []
+    if isinstance(ingredients, str):
+        ingredients = [ingredients]
+    ingredients = unique(clean_text(ingredient) for ingredient in ingredients)
+    steps = unique(parse_instructions(recipe.get('recipeInstructions')))
+
+    if not ingredients or not steps:
+        return None
+
+    return {
+        'name': parse_name(recipe.get('name')),
+        'steps': steps,
+        'ingredients': ingredients,
+        'servings': parse_yield(recipe.get('recipeYield')),
+    }
+
+
+# Only looks at the raw bytes, so no soup has to be built when the page has JSON-LD
+def extract_json_ld_recipe(content):
+    for block in json_ld_pattern.findall(content):
+        parsed = parse_json_ld_block(block)
+        if parsed is not None:
+            return parsed
+    return None
+
+
+# The recipe in the contents of one JSON-LD script, None when it doesn't have a usable one
+def parse_json_ld_block(block):
+    try:
+        data = json.loads(block.decode('utf-8', errors='replace'), strict=False)
+    except ValueError:
+        return None
+    recipe = find_recipe_object(data)
+    return parse_recipe_object(recipe) if recipe is not None else None
+
+
+# ============= Microdata =============
+def closest_scope(element):
+    parent = element.parent
+    while parent is not None and not parent.has_attr('itemscope'):
+        parent = parent.parent
+    return parent
+
+
+def find_props(recipe, *names):
+    # skip properties belonging to nested items (eg. the author's name)
+    return [element for element in recipe.find_all(attrs={'itemprop': re.compile(r'^({})$'.format('|'.join(names)), re.I)})
+            if closest_scope(element) is recipe]
+
+
+def microdata_value(element):
+    if element.name == 'meta':
+        return element.get('content')
+    return element.get_text(' ', strip=True)
+
+
+def extract_microdata_recipe(soup):
+    recipe = soup.find(attrs={'itemtype': re.compile(r'schema\.org/Recipe', re.I)})
+    if recipe is None:
+        return None
+
+    steps = []
+    for element in find_props(recipe, 'recipeInstructions'):
+        items = element.find_all('li')
+        steps += [clean_text(item.get_text(' ')) for item in items] if items else [clean_text(microdata_value(element))]
+    names = find_props(recipe, 'name')
+    yields = find_props(recipe, 'recipeYield')
+
+    return parse_recipe_object({
+        'name': microdata_value(names[0]) if names else None,
+        'recipeIngredient': [microdata_value(element) for element in find_props(recipe, 'recipeIngredient', 'ingredients')],
+        'recipeInstructions': steps,
+        'recipeYield': [microdata_value(element) for element in yields],
+    })
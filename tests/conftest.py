@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+# The app reads its settings when it's imported, so they have to be set before any test imports it.
+# Fetches of the stand-in recipe website don't retry and give up after a second, so the slow variants are quick to test
+os.environ.update({
+    'RECIPE_SCRAPER_USERNAME': 'tester',
+    'RECIPE_SCRAPER_PASSWORD': 'secret',
+    'RECIPE_SCRAPER_SECRET_KEY': 'test-secret',
+    'RECIPE_SCRAPER_SWAGGER': '0',
+    'RECIPE_SCRAPER_FETCH_RETRIES': '0',
+    'RECIPE_SCRAPER_READ_TIMEOUT': '1',
+    'RECIPE_SCRAPER_MAX_RESPONSE_BYTES': str(1024 * 1024),
+    # every page is served from the same host here, so what one page teaches about "its website" would leak into the others
+    'RECIPE_SCRAPER_LEARN_STRATEGIES': '0',
+})
+for name in ('RECIPE_SCRAPER_SECRET_KEYS', 'RECIPE_SCRAPER_PARSE_MODE', 'RECIPE_SCRAPER_PAGE_STORE_DIR', 'RECIPE_SCRAPER_CACHE_DIR',
+             'RECIPE_SCRAPER_STORE_BACKEND', 'RECIPE_SCRAPER_JOB_STORE_PATH', 'RECIPE_SCRAPER_CORPUS_DIR'):
+    os.environ.pop(name, None)
+
+from recipe_site import RecipeSite  # noqa: E402
+
+# Latency budgets are for a developer laptop, RECIPE_SCRAPER_TEST_LATENCY_SCALE=3 gives a slow CI runner 3x as long
+latency_scale = float(os.getenv('RECIPE_SCRAPER_TEST_LATENCY_SCALE', 1))
+
+
+@pytest.fixture(scope='session')
+def budget():
+    return lambda seconds: seconds * latency_scale
+
+
+@pytest.fixture(scope='session')
+def recipe_site():
+    site = RecipeSite().start()
+    yield site
+    site.stop()
+
+
+@pytest.fixture(scope='session')
+def corpus(recipe_site):
+    return recipe_site.corpus
+
+
+@pytest.fixture(scope='session')
+def flask_app():
+    import app as app_module
+    return app_module.create_app()
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+@pytest.fixture(scope='session')
+def auth_headers(flask_app):
+    response = flask_app.test_client().post('/login', json={'username': 'tester', 'password': 'secret'})
+    assert response.status_code == 200
+    return {'Authorization': 'Bearer ' + response.get_json()['token']}
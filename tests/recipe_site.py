@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Local stand-in for the recipe websites: serves the recorded pages of benchmarks/corpus under the path of their real
+# URL, so the extraction sees the same URL it was recorded with. The first path segment picks a variant of the page:
+#   /page/<tag>/<path>      the page as it was recorded
+#   /slow/<tag>/<path>      the page after SLOW_DELAY seconds
+#   /stalled/<tag>/<path>   nothing for STALLED_DELAY seconds, longer than the fetch read timeout of the tests
+#   /oversized/<tag>/<path> the page with megabytes of comments before </body>
+#   /junk/<tag>/<path>      megabytes without a recipe in them
+# <tag> is any string, it gives the same page a URL the scrape cache hasn't seen yet.
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+corpus_dir = os.path.join(root_dir, 'benchmarks', 'corpus')
+
+SLOW_DELAY = 0.5
+STALLED_DELAY = 3
+OVERSIZED_PADDING = 3 * 1024 * 1024
+
+comment = b'<div class="comment"><p>Made this twice, it serves 4 of us with leftovers!</p><ul><li>Reply</li></ul></div>\n'
+
+
+def load_corpus():
+    with open(os.path.join(corpus_dir, 'golden.json')) as f:
+        golden = json.load(f)
+    corpus = {}
+    for name, entry in sorted(golden['pages'].items()):
+        with open(os.path.join(corpus_dir, name), 'rb') as f:
+            corpus[name] = {'url': entry['url'], 'path': urlsplit(entry['url']).path, 'content': f.read(), 'expected': entry['expected']}
+    return corpus
+
+
+def pad_page(content, size):
+    padding = comment * (size // len(comment) + 1)
+    end = content.lower().rfind(b'</body>')
+    end = len(content) if end == -1 else end
+    return content[:end] + padding + content[end:]
+
+
+class RecipeSite:
+    def __init__(self):
+        self.corpus = load_corpus()
+        self.pages = {page['path']: page['content'] for page in self.corpus.values()}
+        self.requests = {}  # path -> how many times it was asked for
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = 'http://127.0.0.1:{}'.format(self._server.server_port)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # URL of a corpus page, eg. url('beef-rendang.html', 'slow', tag='load-3')
+    def url(self, name, variant='page', tag='default'):
+        return '{}/{}/{}{}'.format(self.base_url, variant, tag, self.corpus[name]['path'])
+
+    def request_count(self, url):
+        with self._lock:
+            return self.requests.get(urlsplit(url).path, 0)
+
+    def _respond(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+        _, variant, _, page_path = (path.split('/', 3) + ['', '', ''])[:4]
+        content = self.pages.get('/' + page_path)
+        if content is None:
+            return 404, b'<html><body>Not found</body></html>'
+        if variant == 'page':
+            return 200, content
+        if variant == 'slow':
+            time.sleep(SLOW_DELAY)
+            return 200, content
+        if variant == 'stalled':
+            time.sleep(STALLED_DELAY)
+            return 200, content
+        if variant == 'oversized':
+            return 200, pad_page(content, OVERSIZED_PADDING)
+        if variant == 'junk':
+            return 200, pad_page(b'<html><body></body></html>', OVERSIZED_PADDING)
+        return 404, b'<html><body>Not found</body></html>'
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content = site._respond(urlsplit(self.path).path)
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the scraper stopped reading once it had the recipe
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,230 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import pytest
+
+from recipe_site import load_corpus
+
+# The real Flask endpoints, the way the frontend calls them: /login, /scrape-recipe-steps, then
+# /calculate-serving-ingredients and /convert-recipe-units on the recipe ID, with the recipe pages coming from the
+# local stand-in recipe website
+
+page_names = sorted(load_corpus())
+
+
+def timed(call, *args, **kwargs):
+    start_time = time.perf_counter()
+    response = call(*args, **kwargs)
+    return response, time.perf_counter() - start_time
+
+
+def test_login(client):
+    response = client.post('/login', json={'username': 'tester', 'password': 'secret'})
+    assert response.status_code == 200
+    assert response.get_json()['token']
+
+
+@pytest.mark.parametrize('credentials, message', [
+    ({'username': 'tester', 'password': 'wrong'}, 'Invalid credentials'),
+    ({'username': 'tester'}, 'Missing username or password'),
+])
+def test_login_rejected(client, credentials, message):
+    response = client.post('/login', json=credentials)
+    assert response.status_code == 401
+    assert response.get_json()['message'] == message
+
+
+@pytest.mark.parametrize('authorization, message', [
+    (None, 'Missing authorization token'),
+    ('Bearer not-a-token', 'Invalid token'),
+])
+def test_token_required(client, recipe_site, authorization, message):
+    headers = {'Authorization': authorization} if authorization else {}
+    response = client.post('/scrape-recipe-steps', json={'recipe_url': recipe_site.url(page_names[0])}, headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()['message'] == message
+
+
+@pytest.mark.parametrize('name', page_names)
+def test_scrape_scale_convert(client, auth_headers, recipe_site, budget, name):
+    expected = recipe_site.corpus[name]['expected']
+    recipe_url = recipe_site.url(name, tag='flow')
+
+    response, elapsed = timed(client.post, '/scrape-recipe-steps', json={'recipe_url': recipe_url}, headers=auth_headers)
+    assert response.status_code == 200
+    recipe = response.get_json()
+    assert elapsed < budget(1.0)
+    assert recipe['recipe_name'] == expected['recipe_name']
+    assert recipe['recipe_steps'] == expected['recipe_steps']
+    assert sorted(map(json.dumps, recipe['ingredients'])) == sorted(map(json.dumps, expected['ingredients']))
+    assert recipe['original_unit_type'] == expected['original_unit_type']
+    recipe_id = recipe['recipe_id']
+
+    # the same number of servings gives back the ingredients as they were scraped
+    servings = float(re.search(r'\d+', str(recipe['servings']))[0])
+    response, elapsed = timed(client.post, '/calculate-serving-ingredients', json={'recipe_id': recipe_id, 'serving_size': servings}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.get_json() == recipe['ingredients']
+    assert elapsed < budget(0.1)
+
+    response = client.post('/calculate-serving-ingredients', json={'recipe_id': recipe_id, 'serving_size': servings * 2}, headers=auth_headers)
+    assert response.status_code == 200
+    doubled = response.get_json()
+    assert len(doubled) == len(recipe['ingredients'])
+
+    other_unit_type = 'si' if recipe['original_unit_type'] == 'metric' else 'metric'
+    response, elapsed = timed(client.post, '/convert-recipe-units', json={'recipe_id': recipe_id, 'unit_type': other_unit_type}, headers=auth_headers)
+    assert response.status_code == 200
+    converted = response.get_json()
+    assert elapsed < budget(0.1)
+    assert [row[2] for row in converted] == [row[2] for row in recipe['ingredients']]
+    # still for the doubled serving size, the same as the stateless endpoint works it out
+    response = client.post('/compute-ingredients', json={'recipe_id': recipe_id, 'serving_size': servings * 2, 'unit_type': other_unit_type}, headers=auth_headers)
+    assert response.get_json()['ingredients'] == converted
+
+    # and back to the recipe's own units
+    response = client.post('/convert-recipe-units', json={'recipe_id': recipe_id, 'unit_type': recipe['original_unit_type']}, headers=auth_headers)
+    assert response.status_code == 200
+    assert [row[2] for row in response.get_json()] == [row[2] for row in doubled]
+
+
+def test_scrape_is_cached(client, auth_headers, recipe_site, budget):
+    recipe_url = recipe_site.url(page_names[0], tag='cached')
+    first = client.post('/scrape-recipe-steps', json={'recipe_url': recipe_url}, headers=auth_headers)
+    assert first.status_code == 200
+
+    response, elapsed = timed(client.post, '/scrape-recipe-steps', json={'recipe_url': recipe_url}, headers=auth_headers)
+    assert response.status_code == 200
+    assert elapsed < budget(0.05)
+    assert recipe_site.request_count(recipe_url) == 1
+    # every scrape gets its own recipe ID, even when it came from the cache
+    assert response.get_json()['recipe_id'] != first.get_json()['recipe_id']
+    assert {key: value for key, value in response.get_json().items() if key != 'recipe_id'} == \
+        {key: value for key, value in first.get_json().items() if key != 'recipe_id'}
+
+
+def test_unknown_recipe_id(client, auth_headers):
+    response = client.post('/convert-recipe-units', json={'recipe_id': 'missing', 'unit_type': 'si'}, headers=auth_headers)
+    assert response.status_code == 404
+    response = client.post('/calculate-serving-ingredients', json={'recipe_id': 'missing', 'serving_size': 2}, headers=auth_headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize('path', ['/scrape-recipe-steps', '/scrape-jobs'])
+@pytest.mark.parametrize('data, message', [({}, 'recipe_url is required'), ({'recipe_url': None}, 'recipe_url is required'),
+                                           ({'recipe_url': 5}, 'recipe_url must be a string'),
+                                           ({'recipe_url': ['https://example.com/stew']}, 'recipe_url must be a string')])
+def test_invalid_recipe_url(client, auth_headers, path, data, message):
+    response = client.post(path, json=data, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == message
+
+
+@pytest.mark.parametrize('data', [{}, {'recipe_url': 5}, ['https://example.com/stew']])
+def test_invalid_recipe_url_async(data):
+    import asyncio
+    from asgi import scrape_recipe_steps_async
+    body, status = asyncio.run(scrape_recipe_steps_async(data))
+    assert status == 400
+    assert body['error'].startswith('recipe_url')
+
+
+@pytest.mark.parametrize('recipe_urls', [['https://example.com/stew', 5], ['https://example.com/stew', None], 'https://example.com/stew', []])
+def test_invalid_batch(client, auth_headers, recipe_urls):
+    response = client.post('/scrape-recipes/batch', json={'recipe_urls': recipe_urls}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'recipe_urls must be a list of recipe URLs'
+
+
+invalid_serving_sizes = ['nan', 'inf', '-inf', '0', '-2', 'four', None]
+
+
+@pytest.mark.parametrize('serving_size', invalid_serving_sizes)
+def test_invalid_serving_size(client, auth_headers, recipe_site, serving_size):
+    recipe_id = client.post('/scrape-recipe-steps', json={'recipe_url': recipe_site.url(page_names[0])}, headers=auth_headers).get_json()['recipe_id']
+    response = client.post('/calculate-serving-ingredients', json={'recipe_id': recipe_id, 'serving_size': serving_size}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'serving_size must be a number above 0'
+
+
+@pytest.mark.parametrize('serving_size', invalid_serving_sizes[:-1])
+def test_compute_invalid_serving_size(client, auth_headers, serving_size):
+    response = client.post('/compute-ingredients', json={'ingredients': ['2 cups water'], 'servings': '4', 'serving_size': serving_size},
+                           headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'serving_size must be a number above 0'
+
+
+@pytest.mark.parametrize('ingredients', [[[{'a': 1}]], [[None, None, None]], [['2', 'cups']], [[2, {'unit': 'cups'}, 'water']],
+                                         [[True, 'cups', 'water']], [['2', 'cups', '']], [''], [], 'water'])
+def test_compute_invalid_ingredients(client, auth_headers, ingredients):
+    response = client.post('/compute-ingredients', json={'ingredients': ingredients}, headers=auth_headers)
+    assert response.status_code == 400
+
+
+def test_compute_ingredient_rows(client, auth_headers):
+    response = client.post('/compute-ingredients', json={'ingredients': [[2, 'cups', 'water'], [None, None, 'salt'], '1 lb beef'], 'servings': '4',
+                                                         'serving_size': '2'}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.get_json()['ingredients'] == [['1', 'cups', 'water'], [None, None, 'salt'], ['1/2', 'lb', 'beef']]
+
+
+@pytest.mark.parametrize('path, view_params', [('/calculate-serving-ingredients', {}), ('/convert-recipe-units', {'unit_type': 'si'})])
+@pytest.mark.parametrize('serving_size', ['nan', 'inf', '-1', '0', 'four'])
+def test_get_view_invalid_serving_size(client, auth_headers, recipe_site, path, view_params, serving_size):
+    params = dict(view_params, recipe_url=recipe_site.url(page_names[0]), serving_size=serving_size)
+    response = client.get(path, query_string=params, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'serving_size must be a number above 0'
+
+
+def test_get_view_is_not_shared(client, auth_headers, recipe_site):
+    response = client.get('/scrape-recipe-steps', query_string={'recipe_url': recipe_site.url(page_names[0])}, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'].startswith('private, ')
+    assert response.headers['Vary'] == 'Authorization'
+    again = client.get('/scrape-recipe-steps', query_string={'recipe_url': recipe_site.url(page_names[0])},
+                       headers=dict(auth_headers, **{'If-None-Match': response.headers['ETag']}))
+    assert again.status_code == 304
+
+
+def test_get_view_max_age_is_what_the_cache_has_left(client, auth_headers, recipe_site):
+    import app as app_module
+    scrape_cache = app_module.scrape_cache
+    recipe_url = recipe_site.url(page_names[1])
+    scrape_cache.delete(recipe_url)
+    response = client.get('/scrape-recipe-steps', query_string={'recipe_url': recipe_url}, headers=auth_headers)
+    assert response.headers['Cache-Control'] == 'private, max-age={}'.format(scrape_cache.ttl)
+
+    # the same recipe, cached long ago: only what's left of its TTL
+    recipe = scrape_cache.get(recipe_url)
+    scrape_cache.delete(recipe_url)
+    scrape_cache.warm(recipe_url, recipe, scraped_at=time.time() - scrape_cache.ttl + 100)
+    response = client.get('/scrape-recipe-steps', query_string={'recipe_url': recipe_url}, headers=auth_headers)
+    max_age = int(response.headers['Cache-Control'].split('max-age=')[1])
+    assert 90 <= max_age <= 100
+    scrape_cache.delete(recipe_url)
+
+
+def test_import_starts_nothing(tmp_path):
+    # importing the app (gunicorn's master, a test, a script) doesn't open the job store, warm up from the corpus or
+    # import the libraries only some requests need; create_app does the first two
+    script = '''
+import sys, threading, app
+assert app.get_scrape_jobs.cache_info().currsize == 0
+assert [thread.name for thread in threading.enumerate()] == ['MainThread']
+assert not {'httpx', 'jwt', 'bs4'} & set(sys.modules), sorted({'httpx', 'jwt', 'bs4'} & set(sys.modules))
+warmed = threading.Event()
+app.warm_start = lambda *args: warmed.set()
+app.create_app()
+assert app.get_scrape_jobs.cache_info().currsize == 1
+assert warmed.wait(10)
+'''
+    env = dict(os.environ, RECIPE_SCRAPER_CORPUS_DIR=str(tmp_path), RECIPE_SCRAPER_JOB_STORE_PATH=str(tmp_path / 'jobs.sqlite3'))
+    result = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
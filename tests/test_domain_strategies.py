@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import parse_pool
+import scraper
+from domain_strategies import DomainStrategies
+
+# Extraction strategies learned per website: the selectors they keep must not reach more of the page than the
+# extraction found, and a later page that doesn't look like the learned one goes through the full cascade
+
+equipment_page = b'''<html><body><article><h1 class="entry-title">Dutch Oven Stew</h1>
+<div class="entry-content">
+<p>Servings: 4</p>
+<h2>Ingredients</h2><ul><li>2 cups water</li><li>1 lb beef</li></ul>
+<h2>Instructions</h2><ol><li>Heat the water.</li><li>Simmer the beef and serve.</li></ol>
+<h2>Equipment</h2><ul><li>Dutch oven</li></ul>
+</div></article></body></html>'''
+
+labelled_page = b'''<html><body><article><h1 class="entry-title">Labelled Stew</h1>
+<div class="recipe-card"><p>Servings: 4</p>
+<h2>Ingredients</h2><ul class="ingredient-list"><li>2 cups water</li><li>1 lb beef</li></ul>
+<h2>Instructions</h2><ol><li>Heat the water.</li><li>Simmer the beef and serve.</li></ol>
+</div></article></body></html>'''
+
+
+@pytest.fixture
+def strategies(monkeypatch):
+    strategies = DomainStrategies()
+    monkeypatch.setattr(scraper, 'get_domain_strategies', lambda: strategies)
+    return strategies
+
+
+def test_broad_selectors_are_not_learned(strategies):
+    url = 'https://stews.example.com/dutch-oven-stew/'
+    first = scraper.extract_recipe(equipment_page, url)
+    assert [row[2] for row in first['ingredients']] == ['water', 'beef']
+    # "div.entry-content > ul" would also select the equipment list
+    assert strategies.get('stews.example.com', 'ingredients')['selectors'] == []
+
+    again = scraper.extract_recipe(equipment_page, url)
+    assert again['ingredients'] == first['ingredients']
+    assert again['recipe_steps'] == first['recipe_steps']
+
+
+def test_learned_selectors_need_the_same_shape(strategies):
+    url = 'https://stews.example.com/labelled-stew/'
+    first = scraper.extract_recipe(labelled_page, url)
+    strategy = strategies.get('stews.example.com', 'ingredients')
+    assert strategy['selectors'] and strategy['lists'] == 1
+    assert scraper.extract_recipe(labelled_page, url)['ingredients'] == first['ingredients']
+
+    # the same selector reaches two lists here: not trusted to the strategy, the cascade runs and learns the new shape
+    two_lists = labelled_page.replace(b'</div></article>', b'<ul class="ingredient-list"><li>1 onion</li></ul></div></article>')
+    ingredients = scraper.extract_ingredients(scraper.make_soup(two_lists), domain='stews.example.com')
+    assert ingredients == ['2 cups water', '1 lb beef', '1 onion']
+    assert strategies.get('stews.example.com', 'ingredients')['lists'] == 2
+
+
+def test_cache_is_bounded_and_refreshed(tmp_path):
+    path = str(tmp_path / 'strategies.sqlite3')
+    strategies = DomainStrategies(path, max_domains=2, refresh_seconds=0.2)
+    other_worker = DomainStrategies(path)
+    for index in range(3):
+        strategies.learn('site{}.example.com'.format(index), 'steps', 'manual')
+    assert len(strategies._strategies) == 2
+    assert strategies.get('site0.example.com', 'steps')['method'] == 'manual'
+
+    other_worker.learn('site0.example.com', 'steps', 'labelled')
+    assert strategies.get('site0.example.com', 'steps')['method'] == 'manual'
+    time.sleep(0.25)
+    assert strategies.get('site0.example.com', 'steps')['method'] == 'labelled'
+
+
+def test_parse_workers_learn_in_the_web_worker(monkeypatch):
+    strategies = DomainStrategies()
+    monkeypatch.setattr(parse_pool, 'get_domain_strategies', lambda: strategies)
+    # the worker processes get the environment of this one
+    monkeypatch.setenv('RECIPE_SCRAPER_LEARN_STRATEGIES', '1')
+    pool = parse_pool.ParsePool(max_workers=1)
+    try:
+        recipe = pool.extract(labelled_page, 'https://stews.example.com/labelled-stew/')
+    finally:
+        pool.shutdown()
+    assert [row[2] for row in recipe['ingredients']] == ['water', 'beef']
+    assert strategies.get('stews.example.com', 'ingredients')['lists'] == 1
+    assert strategies.get('stews.example.com', 'steps')['method'] == 'manual'
@@ -0,0 +1,78 @@
+import json
+import time
+
+import pytest
+
+from ingredient_table import IngredientTable
+from recipe_site import load_corpus
+from scraper import extract_recipe, extract_ingredients, get_serving_size
+from page_parser import make_soup
+from units import calculate_servings, convert_units
+
+# The extraction and unit conversion on their own, against the golden outputs of benchmarks/corpus
+
+corpus = load_corpus()
+# pages whose serving size the heuristics still get wrong, see benchmarks/extraction_benchmark.py
+known_servings_mismatches = {'beef-rendang.html', 'classic-banana-bread.html', 'fluffy-pancakes.html'}
+
+labelled_page = b'''<html><body><h1 class="entry-title">Weeknight Chicken Stew</h1>
+<div class="recipe-meta"><span>Servings: 4</span></div>
+<ul><li class="recipe-ingredient">1 1/2 lb chicken thighs</li><li class="recipe-ingredient">2 cups water</li></ul>
+<ol><li class="recipe-instruction">Heat the oil in a pot.</li><li class="recipe-instruction">Simmer the chicken and serve.</li></ol>
+</body></html>'''
+
+ingredient_rows = [['1 1/2', 'lb', 'chicken thighs'], ['2', None, 'potatoes'], ['3', 'tbsp', 'oil'], ['2', 'cups', 'water']]
+
+
+@pytest.mark.parametrize('name', sorted(corpus))
+def test_extract_recipe_matches_golden(name):
+    page = corpus[name]
+    recipe = extract_recipe(page['content'], page['url'])
+    expected = page['expected']
+
+    assert recipe['recipe_name'] == expected['recipe_name']
+    assert recipe['recipe_steps'] == expected['recipe_steps']
+    # the labelled ingredient methods don't keep the page order
+    assert sorted(map(json.dumps, recipe['ingredients'])) == sorted(map(json.dumps, expected['ingredients']))
+    assert recipe['original_unit_type'] == expected['original_unit_type']
+
+
+@pytest.mark.parametrize('name', [
+    pytest.param(name, marks=pytest.mark.xfail(reason='known serving size mismatch', strict=True)) if name in known_servings_mismatches else name
+    for name in sorted(corpus)
+])
+def test_extract_recipe_servings(name):
+    page = corpus[name]
+    assert str(extract_recipe(page['content'], page['url'])['servings']) == str(page['expected']['servings'])
+
+
+def test_extract_recipe_latency(budget):
+    extract_recipe(corpus[sorted(corpus)[0]]['content'], 'https://example.com/warm-up')
+    for page in corpus.values():
+        start_time = time.perf_counter()
+        extract_recipe(page['content'], page['url'])
+        assert time.perf_counter() - start_time < budget(0.25), page['url']
+
+
+def test_heuristics_on_labelled_page():
+    soup = make_soup(labelled_page)
+    assert extract_ingredients(soup) == ['1 1/2 lb chicken thighs', '2 cups water']
+    assert get_serving_size(make_soup(labelled_page)) == '4'
+
+
+def test_calculate_servings():
+    table = IngredientTable.from_rows(ingredient_rows)
+    assert calculate_servings(table, 4, 8) == [['3', 'lb', 'chicken thighs'], ['4', None, 'potatoes'], ['6', 'tbsp', 'oil'], ['4', 'cups', 'water']]
+
+
+def test_convert_units():
+    table = IngredientTable.from_rows(ingredient_rows)
+    assert convert_units(table, 'si', None, 4, 'metric') == [[680.39, 'g', 'chicken thighs'], ['2', None, 'potatoes'], ['3', 'tbsp', 'oil'], [473.18, 'ml', 'water']]
+    # converting to the recipe's own units only scales it
+    assert convert_units(table, 'metric', None, 4, 'metric') == ingredient_rows
+    assert convert_units(table, 'si', 2, 4, 'metric') == [[340.19, 'g', 'chicken thighs'], ['1', None, 'potatoes'], ['1 1/2', 'tbsp', 'oil'], [236.59, 'ml', 'water']]
+
+
+def test_ingredient_table_round_trip():
+    table = IngredientTable.from_rows(ingredient_rows)
+    assert IngredientTable.from_json(table.to_json()).rows() == table.rows()
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from recipe_site import load_corpus
+
+# Many clients at once, each scraping a recipe and then changing its serving size and units back and forth. Every
+# client has to get exactly the answers it gets when it's alone (anything else is state leaking between users through
+# the recipe store, the caches or the conversion engine) and the whole run has to keep up a minimum throughput.
+
+CLIENTS = 16
+ROUNDS = 10
+MIN_REQUESTS_PER_SECOND = 100
+
+page_names = sorted(load_corpus())
+
+
+def client_operations(index):
+    # different for every client, so two clients never expect the same answers for long
+    operations = []
+    for round_number in range(ROUNDS):
+        serving_size = (index + round_number) % 7 + 1
+        unit_type = 'si' if (index + round_number) % 2 else 'metric'
+        operations.append(('/calculate-serving-ingredients', {'serving_size': serving_size}))
+        operations.append(('/convert-recipe-units', {'unit_type': unit_type}))
+    return operations
+
+
+def run_client(flask_app, headers, recipe_url, operations):
+    client = flask_app.test_client()
+    response = client.post('/scrape-recipe-steps', json={'recipe_url': recipe_url}, headers=headers)
+    assert response.status_code == 200
+    recipe = response.get_json()
+    results = [recipe['ingredients']]
+    for path, data in operations:
+        response = client.post(path, json=dict(data, recipe_id=recipe['recipe_id']), headers=headers)
+        assert response.status_code == 200
+        results.append(response.get_json())
+    return results
+
+
+def login(flask_app):
+    response = flask_app.test_client().post('/login', json={'username': 'tester', 'password': 'secret'})
+    return {'Authorization': 'Bearer ' + response.get_json()['token']}
+
+
+def test_concurrent_clients(flask_app, recipe_site, budget):
+    clients = []
+    for index in range(CLIENTS):
+        # the clients share a few recipe URLs, so they also share their scrapes and cache entries
+        recipe_url = recipe_site.url(page_names[index % len(page_names)], tag='load')
+        clients.append((login(flask_app), recipe_url, client_operations(index)))
+
+    # what every client gets when nobody else is around
+    expected = [run_client(flask_app, headers, recipe_url, operations) for headers, recipe_url, operations in clients]
+
+    results = [None] * CLIENTS
+    errors = []
+    start = threading.Barrier(CLIENTS)
+
+    def run(index):
+        headers, recipe_url, operations = clients[index]
+        try:
+            start.wait()
+            results[index] = run_client(flask_app, headers, recipe_url, operations)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(CLIENTS)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    assert not errors
+    for index in range(CLIENTS):
+        assert results[index] == expected[index], 'client {} got another client\'s answers'.format(index)
+
+    requests_per_second = CLIENTS * (1 + 2 * ROUNDS) / elapsed
+    assert requests_per_second > MIN_REQUESTS_PER_SECOND / budget(1)
+
+
+def test_concurrent_scrapes_of_one_page(flask_app, recipe_site):
+    # a burst of clients asking for a recipe nobody has scraped yet: every one gets the recipe and its own recipe ID
+    recipe_url = recipe_site.url(page_names[0], 'slow', tag='burst')
+    headers = login(flask_app)
+    responses = [None] * CLIENTS
+
+    def run(index):
+        responses[index] = flask_app.test_client().post('/scrape-recipe-steps', json={'recipe_url': recipe_url}, headers=headers)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len({response.get_json()['recipe_id'] for response in responses}) == CLIENTS
+    assert len({response.get_json()['recipe_name'] for response in responses}) == 1
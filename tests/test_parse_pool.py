@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+import parse_pool
+
+# Extraction in worker processes (RECIPE_SCRAPER_PARSE_MODE=process): a worker stuck where its own alarm can't stop it
+# is killed and the pool starts over
+
+page = b'''<html><body><article><h1 class="entry-title">Pool Stew</h1>
+<div class="recipe-card"><p>Servings: 4</p>
+<h2>Ingredients</h2><ul class="ingredient-list"><li>2 cups water</li><li>1 lb beef</li></ul>
+<h2>Instructions</h2><ol><li>Heat the water.</li><li>Simmer the beef and serve.</li></ol>
+</div></article></body></html>'''
+
+
+def test_stuck_worker_is_killed(budget):
+    pool = parse_pool.ParsePool(max_workers=1, queue_size=1, task_timeout=0.5, queue_timeout=0.5)
+    try:
+        # something the alarm inside run_extraction doesn't cover holds the only worker
+        stuck = pool._get_executor().submit(time.sleep, 60)
+        with pytest.raises(parse_pool.ParseTimeout):
+            pool.extract(page, 'https://stews.example.com/pool-stew/')
+        # the worker was killed rather than left sleeping, and a new one takes the next page
+        assert stuck.exception(timeout=budget(5)) is not None
+        assert pool.extract(page, 'https://stews.example.com/pool-stew/')['recipe_name'] == 'Pool Stew'
+    finally:
+        pool.shutdown()
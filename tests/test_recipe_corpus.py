@@ -0,0 +1,124 @@
+import json
+import os
+import time
+
+import pytest
+
+import metrics
+import scraper
+from domain_strategies import DomainStrategies
+from recipe_corpus import RecipeCorpus, corpus_record, warm_start
+from scrape_cache import ScrapeCache
+
+# The recipe corpus: extractions are appended to per-process logs, compacted into parts and read back to warm up a
+# fresh scrape cache and the per-website strategies
+
+page = b'''<html><body><article><h1 class="entry-title">Corpus Stew</h1>
+<div class="recipe-card"><p>Servings: 4</p>
+<h2>Ingredients</h2><ul class="ingredient-list"><li>2 cups water</li><li>1/2 lb beef</li></ul>
+<h2>Instructions</h2><ol><li>Chop everything.</li><li>Simmer for an hour.</li></ol>
+</div></article></body></html>'''
+
+# what the app appends: the extracted recipe and the metric events of its extraction
+with metrics.deferred() as events, metrics.stage_seconds.time('extract'):
+    recipe = scraper.extract_recipe(page, 'https://www.example.com/corpus-stew')
+
+
+def record(url='https://www.example.com/corpus-stew', **changes):
+    return dict(corpus_record(url, recipe, events, fetch_seconds=0.75), **changes)
+
+
+def test_corpus_record():
+    current = record('https://WWW.Example.com/corpus-stew/?utm_source=feed')
+    assert current['url'] == 'https://www.example.com/corpus-stew'
+    assert current['methods'] == {'recipe': 'heuristics', 'name': 'heading', 'steps': 'manual', 'ingredients': 'method_2'}
+    assert current['timings']['fetch'] == 0.75
+    assert {'parse', 'steps', 'ingredients', 'extract'} <= set(current['timings'])
+    assert current['elapsed'] == 0.75 + current['timings']['extract']
+    assert current['ingredients'] == [['2', 'cups', 'water'], ['1/2', 'lb', 'beef']]
+    assert current['servings'] == '4'
+    assert current['original_unit_type'] == recipe['original_unit_type']
+    assert json.loads(current['recipe']) == recipe
+
+
+def test_append_and_read_back(tmp_path):
+    corpus = RecipeCorpus(str(tmp_path))
+    corpus.append(record(scraped_at=1.0))
+    corpus.append(record(scraped_at=2.0, recipe_name='Corpus Stew II'))
+    corpus.append(record('https://www.example.com/other', scraped_at=3.0))
+    assert len(list(corpus.records())) == 3
+    latest = corpus.latest()
+    assert [current['url'] for current in latest] == ['https://www.example.com/corpus-stew', 'https://www.example.com/other']
+    assert latest[0]['recipe_name'] == 'Corpus Stew II'
+
+
+@pytest.mark.parametrize('file_format', ['gzip', 'auto'])
+def test_compact(tmp_path, file_format):
+    corpus = RecipeCorpus(str(tmp_path), file_format=file_format)
+    for index in range(5):
+        corpus.append(record('https://www.example.com/recipe-{}'.format(index)))
+    # the log this process is still writing isn't touched
+    assert corpus.compact() is None
+    corpus.close()
+    part = corpus.compact()
+    assert os.path.basename(part).startswith('part-')
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith('log-')] == []
+    records = list(corpus.records())
+    assert [current['url'] for current in records] == ['https://www.example.com/recipe-{}'.format(index) for index in range(5)]
+    assert records[0]['methods'] == record()['methods']
+    assert json.loads(records[0]['recipe']) == recipe
+
+
+def test_full_log_is_compacted(tmp_path, budget):
+    corpus = RecipeCorpus(str(tmp_path), log_records=3, file_format='gzip')
+    for index in range(4):
+        corpus.append(record('https://www.example.com/recipe-{}'.format(index)))
+    deadline = time.monotonic() + budget(2.0)
+    while not any(name.startswith('part-') for name in os.listdir(str(tmp_path))) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    names = os.listdir(str(tmp_path))
+    assert len([name for name in names if name.startswith('part-')]) == 1
+    assert len([name for name in names if name.startswith('log-')]) == 1
+    assert len(list(corpus.records())) == 4
+
+
+def test_warm_start(tmp_path):
+    corpus = RecipeCorpus(str(tmp_path))
+    corpus.append(record(scraped_at=time.time() - 60))
+    corpus.append(record('https://www.example.com/expired', scraped_at=time.time() - 7200))
+    corpus.append(record('https://known.example.org/stew'))
+
+    scrape_cache = ScrapeCache(ttl=3600)
+    strategies = DomainStrategies()
+    strategies.learn('known.example.org', 'steps', 'labelled')
+    assert warm_start(corpus, scrape_cache, strategies) == (2, 3)
+
+    assert scrape_cache.get('https://www.example.com/corpus-stew') == recipe
+    assert scrape_cache.get('https://www.example.com/expired') is None
+    assert strategies.get('example.com', 'steps')['method'] == 'manual'
+    assert strategies.get('example.com', 'ingredients')['method'] == 'method_2'
+    # what the website already has a strategy for is kept
+    assert strategies.get('known.example.org', 'steps')['method'] == 'labelled'
+    assert strategies.get('known.example.org', 'ingredients')['method'] == 'method_2'
+    # and the learned methods extract the page again
+    assert scraper.extract_recipe_steps(scraper.make_soup(page), domain='example.com') == recipe['recipe_steps']
+
+    # never replaces what's cached already
+    scrape_cache.set('https://www.example.com/other', {'recipe_name': 'Newer'})
+    corpus.append(record('https://www.example.com/other'))
+    warm_start(corpus, scrape_cache)
+    assert scrape_cache.get('https://www.example.com/other') == {'recipe_name': 'Newer'}
+
+
+def test_warm_start_skips_unknown_methods(tmp_path):
+    corpus = RecipeCorpus(str(tmp_path))
+    # nothing found, and a method this version doesn't have
+    corpus.append(record('https://nothing.example.com/stew', methods={'steps': 'none', 'ingredients': 'none'}))
+    corpus.append(record('https://older.example.com/stew', methods={'steps': 'manual', 'ingredients': 'json_ld'}))
+
+    strategies = DomainStrategies()
+    assert warm_start(corpus, ScrapeCache(ttl=3600), strategies) == (2, 1)
+    assert strategies.get('nothing.example.com', 'steps') is None
+    assert strategies.get('nothing.example.com', 'ingredients') is None
+    assert strategies.get('older.example.com', 'steps')['method'] == 'manual'
+    assert strategies.get('older.example.com', 'ingredients') is None
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from scrape_jobs import MemoryJobBackend, ScrapeJobQueue, SQLiteJobBackend
+
+# Background scrape jobs shared by several workers through the SQLite job store: a job is only ever run by the worker
+# holding its lease, the others take it over once that worker stops renewing it
+
+
+def respond(recipe_url, recipe, error):
+    return {'recipe_url': recipe_url, 'recipe': recipe}, 200
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def worker(path, scrape, lease=0.3):
+    return ScrapeJobQueue(scrape, respond, SQLiteJobBackend(path, lease=lease))
+
+
+def test_live_workers_keep_their_jobs(tmp_path, budget):
+    path = str(tmp_path / 'jobs.sqlite3')
+    release = threading.Event()
+    scrapes = []
+
+    def scrape(recipe_url):
+        scrapes.append(recipe_url)
+        release.wait(5)
+        return {'recipe_name': 'Stew'}, None
+
+    first = worker(path, scrape)
+    first.start()
+    job = first.submit('https://stews.example.com/stew/')
+    assert wait_for(lambda: scrapes, budget(1.0))
+
+    # a sibling starting (and renewing its leases) while the job runs doesn't run it again
+    second = worker(path, scrape)
+    second.start()
+    time.sleep(0.5)
+    second.resume()
+    release.set()
+    assert wait_for(lambda: first.get(job['job_id'])['status'] == 'done', budget(1.0))
+    assert scrapes == ['https://stews.example.com/stew/']
+    first.shutdown()
+    second.shutdown()
+
+
+def test_jobs_of_a_dead_worker_are_taken_over(tmp_path, budget):
+    path = str(tmp_path / 'jobs.sqlite3')
+    scrapes = []
+
+    def stuck(recipe_url):
+        threading.Event().wait(5)
+        return None, ({'error': 'gone'}, 500)
+
+    def scrape(recipe_url):
+        scrapes.append(recipe_url)
+        return {'recipe_name': 'Stew'}, None
+
+    # never started, so it never renews the lease of its job (like a worker that was killed)
+    dead = worker(path, stuck)
+    job = dead.submit('https://stews.example.com/stew/')
+    second = worker(path, scrape)
+    third = worker(path, scrape)
+    second.resume()
+    assert scrapes == []
+
+    time.sleep(0.35)
+    # only one of the two claims it
+    second.resume()
+    third.resume()
+    assert wait_for(lambda: second.get(job['job_id'])['status'] == 'done', budget(1.0))
+    time.sleep(0.1)
+    assert scrapes == ['https://stews.example.com/stew/']
+    for queue in (dead, second, third):
+        queue.shutdown()
+
+
+def test_memory_jobs_have_nothing_to_resume():
+    queue = ScrapeJobQueue(lambda recipe_url: ({'recipe_name': 'Stew'}, None), respond, MemoryJobBackend())
+    queue.start()
+    job = queue.submit('https://stews.example.com/stew/')
+    assert wait_for(lambda: queue.get(job['job_id'])['status'] == 'done', 1.0)
+    queue.shutdown()
+
+
+def test_memory_store_keeps_unfinished_jobs():
+    release = threading.Event()
+    callbacks = []
+
+    def scrape(recipe_url):
+        release.wait(5)
+        return {'recipe_name': 'Stew'}, None
+
+    # room for two jobs: the running ones outlive every finished one that comes after them
+    queue = ScrapeJobQueue(scrape, respond, MemoryJobBackend(max_entries=2))
+    queue._call_back = callbacks.append
+    waiting = [queue.submit('https://stews.example.com/stew-{}/'.format(index), 'https://client.example.com/done') for index in range(3)]
+    assert all(queue.get(job['job_id'])['status'] in ('queued', 'running') for job in waiting)
+    release.set()
+    assert wait_for(lambda: len(callbacks) == 3, 2.0)
+    assert sorted(job['job_id'] for job in callbacks) == sorted(job['job_id'] for job in waiting)
+    # and once they're done only the two most recent are kept
+    assert len([job for job in waiting if queue.get(job['job_id'])]) == 2
+    queue.shutdown()
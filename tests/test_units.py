@@ -0,0 +1,57 @@
+import pytest
+
+import units
+from ingredient_table import IngredientTable
+from units import ConversionEngine
+
+# Unit conversion numbers: the defaults are the ones the API has always answered with, the ingredient densities are
+# only used with RECIPE_SCRAPER_INGREDIENT_DENSITIES=1
+
+cases = [
+    # ingredient row, unit system, default, with densities
+    (['10', 'g', 'salt'], 'metric', [1.28, 'tbsp', 'salt'], [1.69, 'tsp', 'salt']),
+    (['200', 'g', 'sugar'], 'metric', [7.05, 'oz', 'sugar'], [0.99, 'cups', 'sugar']),
+    (['200', 'g', 'flour'], 'metric', [1.6, 'cups', 'flour'], [1.6, 'cups', 'flour']),
+    (['1', 'cup', 'sugar'], 'si', [125.39, 'g', 'sugar'], [201.1, 'g', 'sugar']),
+    (['1', 'cup', 'butter'], 'si', [125.39, 'g', 'butter'], [227.12, 'g', 'butter']),
+    (['1', 'cup', 'rice'], 'si', [125.39, 'g', 'rice'], [184.54, 'g', 'rice']),
+    (['2', 'cups', 'olive oil'], 'si', [473.18, 'ml', 'olive oil'], [473.18, 'ml', 'olive oil']),
+    (['8', 'oz', 'milk'], 'si', [226.8, 'g', 'milk'], [220.19, 'ml', 'milk']),
+    (['500', 'ml', 'water'], 'metric', [2.11, 'cups', 'water'], [2.11, 'cups', 'water']),
+    (['2', 'tbsp', 'sugar'], 'si', ['2', 'tbsp', 'sugar'], ['2', 'tbsp', 'sugar']),
+]
+
+
+def convert(engine, row, system):
+    return engine.convert_table(IngredientTable.from_rows([row]), system).rows()[0]
+
+
+@pytest.mark.parametrize('row, system, default, with_densities', cases)
+def test_default_conversion(row, system, default, with_densities):
+    assert convert(ConversionEngine(), row, system) == default
+
+
+@pytest.mark.parametrize('row, system, default, with_densities', cases)
+def test_density_conversion(row, system, default, with_densities):
+    assert convert(ConversionEngine(densities=True), row, system) == with_densities
+
+
+def test_densities_switch(monkeypatch):
+    monkeypatch.setenv('RECIPE_SCRAPER_INGREDIENT_DENSITIES', '1')
+    assert convert(units.create_conversion_engine(), ['1', 'cup', 'butter'], 'si') == [227.12, 'g', 'butter']
+    monkeypatch.delenv('RECIPE_SCRAPER_INGREDIENT_DENSITIES')
+    assert convert(units.create_conversion_engine(), ['1', 'cup', 'butter'], 'si') == [125.39, 'g', 'butter']
+
+
+@pytest.mark.parametrize('serving_size', ['nan', 'inf', float('-inf'), 0, -2, 'four', None])
+def test_invalid_serving_size(serving_size):
+    assert units.parse_serving_size(serving_size) is None
+    if serving_size is not None:
+        with pytest.raises(ValueError):
+            units.serving_scale(4, serving_size)
+
+
+def test_serving_scale():
+    assert units.parse_serving_size('6') == 6.0
+    assert units.serving_scale(4, 6) == units.Fraction(3, 2)
+    assert units.serving_scale(None, 6) == 1
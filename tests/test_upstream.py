@@ -0,0 +1,143 @@
+import time
+
+import pytest
+
+from recipe_site import SLOW_DELAY, load_corpus
+
+# Recipe websites that are slow, never answer in time, send far more than the size limit or don't exist
+
+page_name = 'best-mashed-potatoes-recipe.html'  # has JSON-LD
+heuristic_page_name = 'easy-egg-fried-rice.html'  # labelled lists, no structured data
+expected = load_corpus()[page_name]['expected']
+
+
+def scrape(client, auth_headers, recipe_url):
+    start_time = time.perf_counter()
+    response = client.post('/scrape-recipe-steps', json={'recipe_url': recipe_url}, headers=auth_headers)
+    return response, time.perf_counter() - start_time
+
+
+def test_slow_website(client, auth_headers, recipe_site, budget):
+    response, elapsed = scrape(client, auth_headers, recipe_site.url(page_name, 'slow'))
+    assert response.status_code == 200
+    assert response.get_json()['recipe_name'] == expected['recipe_name']
+    assert SLOW_DELAY <= elapsed < SLOW_DELAY + budget(1.0)
+
+
+def test_stalled_website_times_out(client, auth_headers, recipe_site, budget):
+    # RECIPE_SCRAPER_READ_TIMEOUT is 1 second in the tests
+    response, elapsed = scrape(client, auth_headers, recipe_site.url(page_name, 'stalled'))
+    assert response.status_code == 500
+    assert response.get_json()['error'].startswith('Failed to fetch recipe data')
+    assert elapsed < 1 + budget(0.5)
+
+
+def test_oversized_page_with_recipe_first(client, auth_headers, recipe_site, budget):
+    # megabytes over RECIPE_SCRAPER_MAX_RESPONSE_BYTES, but the download stops once the recipe is in
+    for name in (page_name, heuristic_page_name):
+        response, elapsed = scrape(client, auth_headers, recipe_site.url(name, 'oversized'))
+        assert response.status_code == 200, name
+        assert response.get_json()['recipe_steps'] == recipe_site.corpus[name]['expected']['recipe_steps']
+        assert elapsed < budget(0.5)
+
+
+def test_oversized_page_without_recipe(client, auth_headers, recipe_site, budget):
+    response, elapsed = scrape(client, auth_headers, recipe_site.url(page_name, 'junk'))
+    assert response.status_code == 500
+    assert 'larger than' in response.get_json()['error']
+    assert elapsed < budget(1.0)
+
+
+def test_missing_page(client, auth_headers, recipe_site):
+    response, _ = scrape(client, auth_headers, recipe_site.base_url + '/page/default/no-such-recipe/')
+    assert response.status_code == 500
+    assert response.get_json()['error'].startswith('Failed to fetch recipe data')
+    # a failed scrape isn't cached, the next try fetches it again
+    scrape(client, auth_headers, recipe_site.base_url + '/page/default/no-such-recipe/')
+    assert recipe_site.request_count(recipe_site.base_url + '/page/default/no-such-recipe/') == 2
+
+
+def test_async_fallback_fetches_concurrently(budget):
+    import asyncio
+    from fetcher import AsyncFetchClient
+
+    class SlowClient:
+        def get(self, url, headers=None):
+            time.sleep(0.2)
+            return url
+
+    # without httpx the blocking client runs on the async client's own threads, far more than the default executor has
+    client = AsyncFetchClient(SlowClient(), fallback_threads=100)
+    client._httpx = False
+
+    async def fetch_all():
+        try:
+            return await asyncio.gather(*(client.get('https://stews.example.com/{}'.format(index)) for index in range(100)))
+        finally:
+            await client.close()
+
+    start_time = time.perf_counter()
+    assert len(asyncio.run(fetch_all())) == 100
+    assert time.perf_counter() - start_time < 0.2 + budget(0.5)
+
+
+def test_truncated_pages_are_revalidated(tmp_path):
+    from fetcher import AsyncResponse, PageStore, fetch_page
+
+    class StoppingClient:
+        def __init__(self):
+            self.requests = []
+
+        def get(self, url, headers=None):
+            self.requests.append(headers)
+            if headers.get('If-None-Match') == '"v1"':
+                return AsyncResponse(url, 304, {}, b'')
+            return AsyncResponse(url, 200, {'ETag': '"v1"'}, b'<html><body>the recipe', early_stop='lists')
+
+    url = 'https://stews.example.com/stew'
+    page_store = PageStore(str(tmp_path))
+    client = StoppingClient()
+    fetch_page(url, {}, page_store, client)
+    assert page_store.get(url)['truncated'] == 'lists'
+
+    # nothing extracted from the start of the page yet: it isn't parsed again as the whole page, it's downloaded again
+    page = fetch_page(url, {}, page_store, client)
+    assert not page.not_modified
+    assert client.requests == [{}, {'If-None-Match': '"v1"'}, {}]
+
+    # a 304 answers with the recipe extracted from the same bytes
+    recipe = {'recipe_name': 'Stew'}
+    page_store.save_recipe(url, recipe)
+    page = fetch_page(url, {}, page_store, client)
+    assert page.not_modified
+    assert page.recipe == recipe
+    assert client.requests[-1] == {'If-None-Match': '"v1"'}
+
+    client.get = lambda url, headers=None: AsyncResponse(url, 200, {'ETag': '"v2"'}, b'<html><body>the whole recipe</body></html>')
+    fetch_page(url, {}, page_store, client)
+    assert page_store.get(url)['truncated'] is None
+
+
+def test_async_fetch_errors():
+    import asyncio
+    import httpx
+    from fetcher import AsyncFetchClient, FetchError, default_client, fetch_page_async
+
+    def redirect_forever(request):
+        return httpx.Response(302, headers={'Location': str(request.url) + 'x'})
+
+    # not network errors (they aren't retried), but the caller still gets a FetchError for its "Failed to fetch"
+    async def fetch(url, transport=None):
+        client = AsyncFetchClient(default_client)
+        if transport is not None:
+            client._httpx = httpx
+            client._client = httpx.AsyncClient(transport=transport, follow_redirects=True)
+        try:
+            with pytest.raises(FetchError):
+                await fetch_page_async(url, {}, None, client)
+        finally:
+            await client.close()
+
+    asyncio.run(fetch('ftp://stews.example.com/stew'))
+    asyncio.run(fetch('http://stews.example.com:abc/stew'))
+    asyncio.run(fetch('https://stews.example.com/', httpx.MockTransport(redirect_forever)))
@@ -0,0 +1,264 @@
+import json
+import logging
+import math
+import operator
+import os
+import re
+from fractions import Fraction
+from functools import lru_cache
+
+from ingredient_parser import add_unit_spellings
+from ingredient_table import IngredientTable
+from metrics import conversion_seconds
+
+# Scaling ingredient quantities to a serving size and converting them between SI (g/ml) and metric (cups/oz/lb) units.
+# Conversions are driven by tables: a registry of units with their dimension, size and unit system, the density of
+# common ingredients and the "nice unit" rules. More of each can be added from a JSON file
+# (RECIPE_SCRAPER_UNITS_FILE) without touching the code, eg.
+#   {"units": {"pint": {"dimension": "volume", "size": 473.176, "system": "metric", "spellings": ["pint", "pints"]}},
+#    "ingredients": {"yogurt": {"form": "liquid", "density": 1.03}},
+#    "nice_units": [["ml", ">=", 1000, "l"]]}
+# By default volumes and masses convert like they always have (1 cup of anything that isn't a liquid weighs 125.39g,
+# a few liquids and powders found anywhere in the name), RECIPE_SCRAPER_INGREDIENT_DENSITIES=1 switches to the density
+# of each ingredient instead.
+
+# unit -> (dimension, size in ml/g/pieces, unit system). Units without a system (tsp, tbsp, cloves...) are used
+# everywhere and are never converted
+default_units = {
+    'ml': ('volume', 1, 'si'),
+    'l': ('volume', 1000, 'si'),
+    'tsp': ('volume', 4.92892, None),
+    'tbsp': ('volume', 14.7868, None),
+    'cup': ('volume', 236.588, 'metric'),
+    'cups': ('volume', 236.588, 'metric'),
+    'fl oz': ('volume', 29.5735, 'metric'),
+    'g': ('mass', 1, 'si'),
+    'kg': ('mass', 1000, 'si'),
+    'mg': ('mass', 0.001, 'si'),
+    'oz': ('mass', 28.3495, 'metric'),
+    'lb': ('mass', 453.592, 'metric'),
+    'clove': ('count', 1, None),
+    'cloves': ('count', 1, None),
+    'can': ('count', 1, None),
+    'tin': ('count', 1, None),
+    'jar': ('count', 1, None),
+}
+
+# what a unit system writes volumes and masses in
+target_units = {
+    'si': {'volume': 'ml', 'mass': 'g'},
+    'metric': {'volume': 'cups', 'mass': 'oz'},
+}
+
+# 1 cup of anything weighs 125.39g
+default_density = 125.39 / 236.588
+
+# ingredient -> (form, density in g/ml). Liquids measured by volume stay volumes in SI (everything else measured by
+# volume is weighed), powders are measured by volume (cups) in metric, everything else keeps its dimension.
+# The default ones are matched anywhere in the ingredient's name ("olive oil", "salt and pepper")
+default_ingredients = {
+    'water': ('liquid', default_density), 'oil': ('liquid', default_density), 'milk': ('liquid', default_density),
+    'honey': ('liquid', default_density),
+    'flour': ('powder', default_density), 'pepper': ('powder', default_density), 'salt': ('powder', default_density),
+}
+# with RECIPE_SCRAPER_INGREDIENT_DENSITIES=1, matched on the last known word of the name. Liquids are then measured by
+# volume in SI even when the recipe weighs them
+density_ingredients = {
+    'water': ('liquid', 1.0), 'oil': ('liquid', 0.92), 'milk': ('liquid', 1.03), 'honey': ('liquid', 1.42),
+    'cream': ('liquid', 1.01), 'stock': ('liquid', 1.0), 'broth': ('liquid', 1.0), 'juice': ('liquid', 1.04),
+    'vinegar': ('liquid', 1.01), 'wine': ('liquid', 0.99), 'syrup': ('liquid', 1.33),
+    'flour': ('powder', 0.53), 'pepper': ('powder', 0.53), 'salt': ('powder', 1.2), 'sugar': ('powder', 0.85),
+    'cornstarch': ('powder', 0.54), 'cocoa': ('powder', 0.5), 'powder': ('powder', 0.6),
+    'butter': ('solid', 0.96), 'rice': ('solid', 0.78), 'oats': ('solid', 0.34),
+}
+
+# (unit, comparison, value, better unit), checked in order on converted quantities
+default_nice_unit_rules = [
+    ('cups', '<', 0.1, 'tsp'),  # if the cup value is super small, change to teaspoons
+    ('tsp', '>=', 3, 'tbsp'),  # if teaspoons is too much, change to tablespoons
+    ('oz', '>=', 32, 'lb'),  # if oz is greater than 32, change to pounds
+]
+
+comparisons = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+word_pattern = re.compile(r'[a-z]+')
+
+
+class ConversionEngine:
+    def __init__(self, units=None, ingredients=None, nice_unit_rules=None, densities=False):
+        units = units or default_units
+        self.unit_ids = {unit: i for i, unit in enumerate(units)}
+        self.dimensions = [dimension for dimension, size, system in units.values()]
+        self.sizes = [float(size) for dimension, size, system in units.values()]
+        self.systems = [system for dimension, size, system in units.values()]
+        self.unit_names = list(units)
+
+        # factor from every unit to every other unit of the same dimension, None between dimensions
+        self.matrix = [
+            [self.sizes[i] / self.sizes[j] if self.dimensions[i] == self.dimensions[j] != 'count' else None for j in range(len(units))]
+            for i in range(len(units))
+        ]
+
+        self.densities = densities
+        self.ingredients = dict(ingredients or (density_ingredients if densities else default_ingredients))
+
+        self.nice_unit_rules = {}
+        for unit, comparison, value, better_unit in nice_unit_rules or default_nice_unit_rules:
+            self.nice_unit_rules.setdefault(unit, []).append((comparisons[comparison], value, better_unit))
+
+        # (unit, unit system, ingredient) -> (unit, factor), worked out the first time it's needed
+        self._plans = {}
+        self.lookup_ingredient = lru_cache(maxsize=4096)(self._lookup_ingredient)
+
+    # (liquid, powder, density) of an ingredient name
+    def _lookup_ingredient(self, name):
+        if self.densities:
+            # "extra virgin olive oil" is oil, "salt and pepper" is pepper: the last known word decides
+            for word in reversed(word_pattern.findall((name or '').lower())):
+                if word.endswith('s') and word not in self.ingredients:
+                    word = word[:-1]
+                if word in self.ingredients:
+                    form, density = self.ingredients[word]
+                    return form == 'liquid', form == 'powder', density
+            return False, False, default_density
+        matches = [info for ingredient, info in self.ingredients.items() if ingredient in (name or '')]
+        return (any(form == 'liquid' for form, _ in matches), any(form == 'powder' for form, _ in matches),
+                matches[-1][1] if matches else default_density)
+
+    def plan(self, unit, system, name):
+        unit_id = self.unit_ids.get(unit)
+        if unit_id is None or self.systems[unit_id] in (None, system):
+            return None
+        ingredient = self.lookup_ingredient(name)
+        key = (unit_id, system, ingredient)
+        if key not in self._plans:
+            self._plans[key] = self._make_plan(unit_id, system, *ingredient)
+        return self._plans[key]
+
+    def _make_plan(self, unit_id, system, liquid, powder, density):
+        dimension = self.dimensions[unit_id]
+        if system == 'si':
+            if not liquid:
+                dimension = 'mass'
+            elif self.densities:
+                dimension = 'volume'
+        elif powder:
+            dimension = 'volume'
+
+        to_unit = target_units[system][dimension]
+        to_id = self.unit_ids[to_unit]
+        factor = self.matrix[unit_id][to_id]
+        if factor is None:
+            # between volume and mass, through the density of the ingredient
+            size = self.sizes[unit_id] * (density if self.dimensions[unit_id] == 'volume' else 1 / density)
+            factor = size / self.sizes[to_id]
+        return to_unit, factor
+
+    def nice_unit(self, unit, quantity):
+        factor = 1
+        for _ in range(len(self.nice_unit_rules) + 1):
+            for compare, value, better_unit in self.nice_unit_rules.get(unit, ()):
+                if compare(quantity * factor, value):
+                    factor *= self.matrix[self.unit_ids[unit]][self.unit_ids[better_unit]]
+                    unit = better_unit
+                    break
+            else:
+                break
+        return unit, factor
+
+    # Converts every ingredient of the table that isn't in the unit system yet, quantities become floats
+    def convert_table(self, table, system):
+        low, high, units = list(table.low), list(table.high), list(table.units)
+        for i, (quantity, unit, name) in enumerate(zip(table.low, table.units, table.names)):
+            if not quantity:
+                continue
+            plan = self.plan(unit, system, name)
+            if plan is None:
+                continue
+            to_unit, factor = plan
+            # a range keeps one unit, picked by its low end
+            units[i], nice_factor = self.nice_unit(to_unit, float(quantity) * factor)
+            low[i] = float(quantity) * factor * nice_factor
+            if high[i] is not None:
+                high[i] = float(high[i]) * factor * nice_factor
+        return IngredientTable(low, high, units, table.names)
+
+    def convert_tables(self, tables, system):
+        return [self.convert_table(table, system) for table in tables]
+
+    # the unit system a recipe is written in, SI wins when there's both
+    def unit_type(self, units):
+        systems = {self.systems[self.unit_ids[unit]] for unit in units if unit in self.unit_ids}
+        if 'si' in systems:
+            return 'si'
+        if 'metric' in systems:
+            return 'metric'
+        return None
+
+
+def create_conversion_engine():
+    densities = os.getenv('RECIPE_SCRAPER_INGREDIENT_DENSITIES', '0') == '1'
+    units, nice_unit_rules = dict(default_units), list(default_nice_unit_rules)
+    ingredients = dict(density_ingredients if densities else default_ingredients)
+
+    path = os.getenv('RECIPE_SCRAPER_UNITS_FILE')
+    if path:
+        with open(path) as f:
+            config = json.load(f)
+        for unit, info in config.get('units', {}).items():
+            units[unit] = (info['dimension'], info['size'], info.get('system'))
+            add_unit_spellings(unit, info.get('spellings', [unit]))
+        for ingredient, info in config.get('ingredients', {}).items():
+            ingredients[ingredient] = (info.get('form', 'solid'), info.get('density', default_density))
+        nice_unit_rules += [tuple(rule) for rule in config.get('nice_units', [])]
+
+    return ConversionEngine(units, ingredients, nice_unit_rules, densities=densities)
+
+
+# built (and the units file read) the first time something is converted, not when a worker starts
+@lru_cache(maxsize=None)
+def get_conversion_engine():
+    return create_conversion_engine()
+
+
+# A serving size sent by a client as a float, None when it isn't a number above 0 (nan and inf included)
+def parse_serving_size(serving_size):
+    try:
+        serving_size = float(serving_size)
+    except (TypeError, ValueError):
+        return None
+    return serving_size if math.isfinite(serving_size) and serving_size > 0 else None
+
+def serving_scale(servings, requested_serving_size):
+    if requested_serving_size is None or not servings:
+        return 1
+    # Fraction can't hold nan or inf, the endpoints turn those away with parse_serving_size first
+    if parse_serving_size(requested_serving_size) is None:
+        raise ValueError('serving size must be a finite number above 0, got {!r}'.format(requested_serving_size))
+    return Fraction(float(requested_serving_size)) / Fraction(float(servings))
+
+def calculate_servings(ingredients, servings, requested_serving_size):
+    return ingredients.scaled(serving_scale(servings, requested_serving_size)).rows()
+
+# ingredients is the IngredientTable of the recipe as it was scraped, the result is the rows to send back
+def convert_units(ingredients, unit_type, requested_serving_size, servings, original_unit_type):
+    # check if ingredients is populated or not first
+    if not ingredients:
+        return None
+
+    # if they want to convert back to the original unit, must maintain the original units
+    if original_unit_type == unit_type:
+        if requested_serving_size is None or requested_serving_size == servings:
+            logging.info("DEBUG: Conversion method 1")
+            with conversion_seconds.time('1'):
+                return ingredients.rows()
+        else:
+            logging.info("DEBUG: Conversion method 2")
+            with conversion_seconds.time('2'):
+                return calculate_servings(ingredients, servings, requested_serving_size)
+
+    # only do the conversion if they want a different unit
+    logging.info("DEBUG: Conversion method 3")
+    with conversion_seconds.time('3'):
+        system = "si" if unit_type == "si" else "metric"
+        scaled = ingredients.scaled(serving_scale(servings, requested_serving_size))
+        return get_conversion_engine().convert_table(scaled, system).rows()